@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks of the hot paths of Ensemble Analyser, on synthetic ensembles of increasing size.
+Outputs are written by the mock calculator, so no ORCA installation is needed.
+
+    python benchmarks/benchmark.py --sizes 100 1000 --save    # record the baseline
+    python benchmarks/benchmark.py --sizes 100 1000           # compare with the baseline, exit 1 on regressions
+
+Timings are the best of --repeat runs. A baseline is only meaningful on the machine that recorded it.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+from ase.build import molecule
+from scipy.constants import R
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ensemble_analyser.conformer import Conformer, Ensemble
+from ensemble_analyser.executor import stage_out
+from ensemble_analyser.IOsystem import conf_folder
+from ensemble_analyser.grapher import Graph, FACTOR_EV_NM
+from ensemble_analyser.ioFile import read_ensemble
+from ensemble_analyser.mock_calculator import MockCalculator
+from ensemble_analyser.parser_parameter import get_conf_parameters
+from ensemble_analyser.protocol import Protocol, ORCA_LABEL
+from ensemble_analyser.pruning import check_ensemble, calculate_rel_energies
+from ensemble_analyser.rrho import free_gibbs_energy
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+THRESHOLD = 0.25
+TEMPERATURE = 298.15
+STATES = 10
+
+
+def quiet_log():
+    """
+    Logger discarding every message, so that the timings do not include the logging
+
+    return : logger instance
+    """
+    log = logging.getLogger('benchmark')
+    log.addHandler(logging.NullHandler())
+    log.propagate = False
+    return log
+
+
+def synthetic_geometries(n : int, name : str, seed : int = 0) -> tuple:
+    """
+    Ensemble of distorted copies of a molecule
+
+    n | int : number of conformers
+    name | str : molecule name in the ASE database (e.g. CH3CH2OH)
+    seed | int : seed of the distortions
+
+    return | tuple(np.array, np.array) : atoms and geometries (n, N, 3) [Å]
+    """
+    mol = molecule(name)
+    rng = np.random.default_rng(seed)
+    geoms = mol.positions[None] + rng.normal(scale=0.1, size=(n, len(mol), 3))
+    return np.array(mol.get_chemical_symbols()), geoms
+
+
+def synthetic_ensemble(n : int, name : str, raw : bool = False) -> list:
+    """
+    Conformers of a synthetic ensemble
+
+    n | int : number of conformers
+    name | str : molecule name in the ASE database
+    raw | bool : do not check that the conformer folders are free
+
+    return | list : whole ensemble list
+    """
+    atoms, geoms = synthetic_geometries(n, name)
+    ensemble = Ensemble(atoms, capacity=n)
+    return [Conformer(i+1, geom=g, atoms=atoms, raw=raw, ensemble=ensemble) for i, g in enumerate(geoms)]
+
+
+def synthetic_energies(confs, number : str = '0', seed : int = 0) -> None:
+    """
+    Fill the conformers with energies in a 10 kcal/mol window, with rotational constants close enough to find
+    duplicates
+
+    confs | list : whole ensemble list
+    number | str : protocol number
+    seed | int : seed of the energies
+
+    return None
+    """
+    rng = np.random.default_rng(seed)
+    en = -150*627.5 + rng.uniform(0, 10, len(confs))
+    b = 1.25 + rng.normal(scale=0.005, size=len(confs))
+    for conf, e, bi in zip(confs, en, b):
+        conf.energies[number] = {'E' : e, 'G' : None, 'B' : bi, 'm' : 1., 'time' : 1.}
+    return None
+
+
+def synthetic_impulses(n : int, seed : int = 0) -> list:
+    """
+    Excited states of each conformer as (eV, intensity)
+
+    n | int : number of conformers
+    seed | int : seed of the states
+
+    return | list : impulses for each conformer
+    """
+    rng = np.random.default_rng(seed)
+    return [list(zip(FACTOR_EV_NM/rng.uniform(180, 450, STATES), rng.normal(scale=30, size=STATES))) for _ in range(n)]
+
+
+def synthetic_graph(confs, impulses, log) -> Graph:
+    """
+    Graph instance ready for the convolution, skipping the parsing of the outputs done by its constructor
+
+    confs | list : whole ensemble list
+    impulses | list : impulses for each conformer
+    log : logger instance
+
+    return | Graph
+    """
+    graph = Graph.__new__(Graph)
+    graph.confs = confs
+    graph.log = log
+    graph.protocol = Protocol(number='1', functional='cam-b3lyp', graph=True, calculator='mock')
+    graph.x = np.linspace(FACTOR_EV_NM/100, FACTOR_EV_NM/800, 10**4)
+    ens = np.array([i.get_energy for i in confs])
+    bolz = np.exp(-(ens-np.min(ens))*4186/(R*TEMPERATURE))
+    graph.pop = bolz/np.sum(bolz)
+    return graph
+
+
+
+# Each benchmark prepares its data inside the (empty) working directory and returns the function to time and the
+# function resetting the state before each repetition
+
+def bench_read_ensemble(n, name, log):
+    atoms, geoms = synthetic_geometries(n, name)
+    with open('ensemble.xyz', 'w') as f:
+        for g in geoms:
+            f.write(f'{len(atoms)}\n\n' + ''.join(f'{a} {x:.6f} {y:.6f} {z:.6f}\n' for a, (x, y, z) in zip(atoms, g)))
+
+    counter = iter(range(10**6))
+    def reset():
+        # read_ensemble refuses the folders of a previous run: every run starts in an empty folder
+        folder = f'run_{next(counter)}'
+        os.mkdir(folder)
+        os.chdir(folder)
+
+    def run():
+        read_ensemble('../ensemble.xyz', 0, 1, log)
+        os.chdir('..')
+
+    return run, reset
+
+
+def bench_get_conf_parameters(n, name, log):
+    confs = synthetic_ensemble(n, name)
+    protocol = Protocol(number='0', functional='r2scan-3c', opt=True, freq=True, calculator='mock')
+    for conf in confs:
+        label = os.path.join(conf_folder(conf.number, create=True), ORCA_LABEL)
+        conf.get_ase_atoms(MockCalculator(protocol, 0, 1, label)).get_potential_energy()
+        stage_out(label, conf, protocol)
+
+    def run():
+        for conf in confs:
+            get_conf_parameters(conf, protocol.number, protocol, 1., TEMPERATURE, log)
+
+    return run, lambda: None
+
+
+def bench_check_ensemble(n, name, log):
+    confs = synthetic_ensemble(n, name, raw=True)
+    synthetic_energies(confs)
+    confs = sorted(confs)
+    protocol = Protocol(number='0', functional='b97-3c', calculator='mock')
+
+    def reset():
+        for conf in confs:
+            conf.active = True
+            conf.diactivated_by = None
+
+    return lambda: check_ensemble(confs, protocol, log), reset
+
+
+def bench_calculate_rel_energies(n, name, log):
+    confs = synthetic_ensemble(n, name, raw=True)
+    synthetic_energies(confs)
+    return lambda: calculate_rel_energies(confs, TEMPERATURE), lambda: None
+
+
+def bench_free_gibbs_energy(n, name, log):
+    confs = synthetic_ensemble(n, name, raw=True)
+    rng = np.random.default_rng(0)
+    n_freq = 3*len(confs[0].atoms) - 6
+    freqs = [np.sort(rng.uniform(20, 3200, n_freq)) for _ in confs]
+    mw = confs[0].weight_mass
+    B = np.array([1.2, 0.3, 0.25])
+
+    def run():
+        for freq in freqs:
+            free_gibbs_energy(SCF=-150., T=TEMPERATURE, freq=freq, mw=mw, B=B, m=1)
+
+    return run, lambda: None
+
+
+def bench_calc_graph(n, name, log):
+    confs = synthetic_ensemble(n, name, raw=True)
+    synthetic_energies(confs)
+    impulses = synthetic_impulses(n)
+    graph = synthetic_graph(confs, impulses, log)
+    return lambda: graph.calc_graph(impulses=impulses, sigma=1/3), lambda: None
+
+
+def bench_auto_convolution(n, name, log):
+    confs = synthetic_ensemble(n, name)
+    synthetic_energies(confs)
+    impulses = synthetic_impulses(n)
+    graph = synthetic_graph(confs, impulses, log)
+
+    # reference: the computed spectrum itself, red-shifted and broadened
+    x = np.linspace(180, 450, 500)
+    ref = sum(graph.pop[i] * Graph.gaussian(FACTOR_EV_NM/x - 0.2, ev, I, 0.4) for i in range(n) for ev, I in impulses[i])
+    np.savetxt('ecd_ref.dat', np.column_stack([x, ref]))
+
+    return lambda: graph.auto_convolution('ecd_ref.dat', impulses=impulses, fname='ecd_auto_conv.dat'), lambda: None
+
+
+BENCHMARKS = {
+    'read_ensemble' : bench_read_ensemble,
+    'get_conf_parameters' : bench_get_conf_parameters,
+    'check_ensemble' : bench_check_ensemble,
+    'calculate_rel_energies' : bench_calculate_rel_energies,
+    'free_gibbs_energy' : bench_free_gibbs_energy,
+    'calc_graph' : bench_calc_graph,
+    'auto_convolution' : bench_auto_convolution,
+}
+
+
+def run_benchmark(name : str, n : int, molecule_name : str, repeat : int, log) -> float:
+    """
+    Time a benchmark inside a temporary folder
+
+    name | str : benchmark name
+    n | int : number of conformers
+    molecule_name | str : molecule name in the ASE database
+    repeat | int : number of repetitions
+    log : logger instance
+
+    return | float : best time [sec]
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix=f'ea_bench_{name}_') as tmp:
+        os.chdir(tmp)
+        try:
+            run, reset = BENCHMARKS[name](n, molecule_name, log)
+            best = np.inf
+            for _ in range(repeat):
+                reset()
+                st = time.perf_counter()
+                run()
+                best = min(best, time.perf_counter() - st)
+        finally:
+            os.chdir(cwd)
+    return best
+
+
+def compare(results : dict, baseline : dict, threshold : float) -> list:
+    """
+    Find the regressions with respect to the baseline
+
+    results | dict : {benchmark : {size : time}}
+    baseline | dict : {benchmark : {size : time}}
+    threshold | float : tolerated relative slow down
+
+    return | list : (benchmark, size, time, baseline time) of the regressions
+    """
+    regressions = []
+    for name, sizes in results.items():
+        for n, t in sizes.items():
+            ref = baseline.get(name, {}).get(n)
+            if ref and t > ref*(1+threshold):
+                regressions.append((name, n, t, ref))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks of Ensemble Analyser on synthetic ensembles')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000], help='Number of conformers. Default %(default)s')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS), help='Benchmarks to run. Default: all')
+    parser.add_argument('--molecule', default='CH3CH2OH', help='Molecule of the synthetic ensembles (ASE database name). Default %(default)s')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions of each benchmark, the best one is kept. Default %(default)s')
+    parser.add_argument('--baseline', default=BASELINE, help='Baseline file. Default %(default)s')
+    parser.add_argument('--save', action='store_true', help='Store the timings as the new baseline instead of comparing them')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='Tolerated relative slow down before failing. Default %(default)s')
+    args = parser.parse_args()
+
+    os.environ.setdefault('MOCK_LATENCY', '0')
+    log = quiet_log()
+
+    results = {}
+    for name in args.only:
+        results[name] = {}
+        for n in args.sizes:
+            results[name][str(n)] = run_benchmark(name, n, args.molecule, args.repeat, log)
+            print(f'{name:>24s} N={n:<8d} {results[name][str(n)]:12.4f} s', flush=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        baseline = json.load(open(args.baseline)).get('results', {})
+
+    table = []
+    for name, sizes in results.items():
+        for n, t in sizes.items():
+            ref = baseline.get(name, {}).get(n)
+            table.append([name, n, t, t/int(n)*1e3, ref, t/ref if ref else None])
+    print()
+    print(tabulate(table, headers=['Benchmark', 'N', 'Time [s]', 'Per conformer [ms]', 'Baseline [s]', 'Ratio'], floatfmt='.4f'))
+
+    if args.save:
+        for name, sizes in results.items():
+            baseline.setdefault(name, {}).update(sizes)
+        json.dump({
+            'machine' : f'{platform.node()} - {platform.processor() or platform.machine()}',
+            'python' : platform.python_version(),
+            'date' : datetime.datetime.now().isoformat(timespec='seconds'),
+            'results' : baseline,
+        }, open(args.baseline, 'w'), indent=4)
+        print(f'\nBaseline saved in {args.baseline}')
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f'\nRegressions over {args.threshold*100:.0f}%:')
+        for name, n, t, ref in regressions:
+            print(f'\t{name} N={n}: {t:.4f} s (baseline {ref:.4f} s, +{(t/ref-1)*100:.0f}%)')
+        return 1
+
+    return 0
+
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
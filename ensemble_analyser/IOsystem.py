@@ -1,3 +1,4 @@
+from collections.abc import Mapping
 import numpy as np
 import shutil, json
 import os
@@ -36,9 +37,37 @@ def mkdir(directory:str) -> None:
     return None
 
 
+def conf_folder(number : int, create : bool = False) -> str:
+    """
+    Folder of a conformer, sharded by its number (e.g. confs/00/12/conf_1234) so that no directory holds more than
+    100 entries. The flat conf_N folder of a calculation started before the sharding is used if it exists
+
+    number | int : conformer number
+    create | bool : create the folder, if missing
+
+    return | str : folder, relative to the working directory
+    """
+    legacy = f'conf_{number}'
+    if os.path.isdir(legacy):
+        return legacy
+
+    digits = f'{number:06d}'
+    folder = os.path.join('confs', digits[:2], digits[2:4], legacy)
+    if create:
+        os.makedirs(folder, exist_ok=True)
+    return folder
+
+
 
 class SerialiseEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, np.ndarray):
             return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, Mapping):
+            return dict(obj)
+        # objects without __dict__ (e.g. Conformer views on the Ensemble)
+        if hasattr(obj, 'dump_raw'):
+            return obj.dump_raw()
         return obj.__dict__
\ No newline at end of file
@@ -0,0 +1,135 @@
+from ensemble_analyser.tracer import TRACER
+
+import threading
+import zipfile
+import io, os
+
+
+ARCHIVE_FOLDER = 'archive'
+# outputs packed at the end of each protocol step. The wavefunctions stay in place, as initial guess of the next steps
+EXTENSIONS = ('out', 'hess', 'xyz', 'property.txt', 'property.json')
+
+_ARCHIVES = {}
+_LOCK = threading.Lock()
+
+
+def archive_path(number) -> str:
+    """
+    Archive of the outputs of a protocol step
+
+    number | int : protocol number
+
+    return | str : ZIP filename
+    """
+    return os.path.join(ARCHIVE_FOLDER, f'protocol_{number}.zip')
+
+
+def _locate(fname : str) -> tuple:
+    """
+    Archive and member corresponding to an output file (e.g. confs/00/00/conf_7/protocol_2.out)
+
+    fname | str : output filename
+
+    return | tuple(str, str) : archive filename and member name (e.g. conf_7/protocol_2.out)
+    """
+    folder, name = os.path.split(fname)
+    number = name.split('.')[0].split('_')[-1]
+    return archive_path(number), f'{os.path.basename(folder)}/{name}'
+
+
+def _archive(path : str):
+    """
+    Archive opened for reading, kept open (and its index in memory) until the file changes
+
+    path | str : ZIP filename
+
+    return | zipfile.ZipFile : None if the archive does not exist
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = (st.st_mtime_ns, st.st_size)
+    with _LOCK:
+        cached = _ARCHIVES.get(path)
+        if cached is None or cached[0] != key:
+            if cached is not None:
+                cached[1].close()
+            cached = _ARCHIVES[path] = (key, zipfile.ZipFile(path))
+        return cached[1]
+
+
+def output_exists(fname : str) -> bool:
+    """
+    Whether an output is present, as a file or packed in the archive of its protocol step
+
+    fname | str : output filename
+
+    return | bool
+    """
+    if os.path.exists(fname):
+        return True
+    path, member = _locate(fname)
+    zf = _archive(path)
+    return zf is not None and member in zf.NameToInfo
+
+
+def open_output(fname : str, errors : str = None):
+    """
+    Open an output for reading, from the file or, once packed, directly from the archive of its protocol step.
+    The file is preferred, being more recent than the archive if the calculation has been repeated
+
+    fname | str : output filename
+    errors | str : handling of the decoding errors, as for open
+
+    return | file object (text)
+    """
+    if os.path.exists(fname):
+        return open(fname, errors=errors)
+
+    path, member = _locate(fname)
+    zf = _archive(path)
+    if zf is None or member not in zf.NameToInfo:
+        raise FileNotFoundError(f'{fname} is neither present nor archived in {path}')
+    return io.TextIOWrapper(zf.open(member), errors=errors)
+
+
+def pack_outputs(confs : list, protocol, log) -> None:
+    """
+    Pack the outputs of a protocol step into a single ZIP archive (each member compressed, with the index at the end),
+    removing the files. The outputs already archived are skipped, so the packing can be repeated after a restart
+
+    confs | list : whole ensemble list
+    protocol | Protocol : protocol step completed
+    log : logger instance
+
+    return None
+    """
+    os.makedirs(ARCHIVE_FOLDER, exist_ok=True)
+    path = archive_path(protocol.number)
+
+    with _LOCK:
+        cached = _ARCHIVES.pop(path, None)
+        if cached is not None:
+            cached[1].close()
+
+    packed = []
+    with TRACER.span('archive', protocol=protocol):
+        with zipfile.ZipFile(path, 'a', compression=zipfile.ZIP_DEFLATED) as zf:
+            names = set(zf.namelist())
+            for conf in confs:
+                for ext in EXTENSIONS:
+                    fname = os.path.join(conf.folder, f'protocol_{protocol.number}.{ext}')
+                    member = _locate(fname)[1]
+                    if member in names or not os.path.exists(fname):
+                        continue
+                    zf.write(fname, member)
+                    packed.append(fname)
+
+        # the files are removed only once the archive is complete
+        for fname in packed:
+            os.remove(fname)
+
+    log.debug(f'Packed {len(packed)} outputs of protocol {protocol.number} into {path}')
+    return None
@@ -0,0 +1,151 @@
+from ensemble_analyser.conformer import Conformer, Ensemble
+from ensemble_analyser.IOsystem import SerialiseEncoder
+from ensemble_analyser.tracer import TRACER
+
+import numpy as np
+import json, os
+
+
+JOURNAL = 'checkpoint.journal'
+SNAPSHOT = 'checkpoint.npz'
+LEGACY = 'checkpoint.json'
+COMPACT_EVERY = 500
+
+
+class Checkpoint:
+    """
+    Checkpoint of the ensemble as a binary snapshot plus an append-only journal.
+
+    After each calculation only the delta of the conformer (energies of the protocol step, active flag and, if changed,
+    the geometry) is appended to the journal. Periodically, and at the end of each protocol step, the whole ensemble
+    is compacted into the snapshot (all the geometries in a single array) and the journal is emptied.
+    """
+
+    def __init__(self, ensemble, journal : str = JOURNAL, snapshot : str = SNAPSHOT, compact_every : int = COMPACT_EVERY):
+        """
+        ensemble | list : whole ensemble list
+        journal | str : journal filename
+        snapshot | str : snapshot filename
+        compact_every | int : number of journal records after which the snapshot is rewritten
+        """
+        self.ensemble = ensemble
+        self.journal = journal
+        self.snapshot = snapshot
+        self.compact_every = compact_every
+        self.records = 0
+
+    def record(self, conf, number, geometry : bool = False) -> None:
+        """
+        Append the delta of a conformer to the journal
+
+        conf | Conformer : conformer instance
+        number | int : protocol number calculated
+        geometry | bool : the geometry has changed and must be saved
+
+        return None
+        """
+
+        delta = {
+            'number' : conf.number,
+            'energies' : {str(number) : dict(conf.energies[str(number)])} if str(number) in conf.energies else {},
+            'active' : conf.active,
+        }
+        if geometry:
+            delta['last_geometry'] = np.asarray(conf.last_geometry, dtype=float).tolist()
+
+        with TRACER.span('checkpoint record', conf, number):
+            with open(self.journal, 'a') as f:
+                f.write(json.dumps(delta) + '\n')
+
+        self.records += 1
+        if self.records >= self.compact_every:
+            self.compact()
+
+        return None
+
+    def compact(self) -> None:
+        """
+        Write the whole ensemble into the snapshot and empty the journal
+
+        return None
+        """
+
+        with TRACER.span('checkpoint compact'):
+            geoms = [np.asarray(i.last_geometry, dtype=float).reshape(-1, 3) for i in self.ensemble]
+            meta = {i.number : {'energies' : i.energies, 'diactivated_by' : i.diactivated_by, 'metadata' : i.metadata} for i in self.ensemble}
+
+            tmp = self.snapshot + '.tmp.npz'
+            np.savez(
+                tmp,
+                number = np.array([i.number for i in self.ensemble], dtype=int),
+                charge = np.array([i.charge for i in self.ensemble], dtype=int),
+                mult = np.array([i.mult for i in self.ensemble], dtype=int),
+                active = np.array([i.active for i in self.ensemble], dtype=bool),
+                natoms = np.array([len(i) for i in geoms], dtype=int),
+                atoms = np.concatenate([np.asarray(i.atoms, dtype=str) for i in self.ensemble]) if self.ensemble else np.array([], dtype=str),
+                geometry = np.concatenate(geoms) if geoms else np.zeros((0, 3)),
+                meta = np.array(json.dumps(meta, cls=SerialiseEncoder)),
+            )
+            os.replace(tmp, self.snapshot)
+
+        open(self.journal, 'w').close()
+        self.records = 0
+
+        return None
+
+    @staticmethod
+    def load(journal : str = JOURNAL, snapshot : str = SNAPSHOT) -> list:
+        """
+        Reload the ensemble from the snapshot, replaying the journal on top of it.
+        A checkpoint.json of a previous version is read if no snapshot is present.
+
+        journal | str : journal filename
+        snapshot | str : snapshot filename
+
+        return | list : whole ensemble list
+        """
+
+        if os.path.exists(snapshot):
+            with np.load(snapshot) as data:
+                meta = json.loads(str(data['meta']))
+                offsets = np.concatenate([[0], np.cumsum(data['natoms'])])
+                # conformers with the same atoms as the first share its storage
+                store = Ensemble(data['atoms'][:offsets[1]], capacity=len(data['number'])) if len(data['number']) else None
+                ensemble = []
+                for idx, number in enumerate(data['number']):
+                    conf = Conformer(
+                        number = int(number),
+                        geom = data['geometry'][offsets[idx]:offsets[idx+1]],
+                        atoms = data['atoms'][offsets[idx]:offsets[idx+1]],
+                        charge = int(data['charge'][idx]),
+                        mult = int(data['mult'][idx]),
+                        raw = True,
+                        ensemble = store,
+                    )
+                    conf.energies = meta[str(number)]['energies']
+                    conf.active = bool(data['active'][idx])
+                    if meta[str(number)]['diactivated_by'] is not None:
+                        conf.diactivated_by = meta[str(number)]['diactivated_by']
+                    conf.metadata = meta[str(number)].get('metadata', {})
+                    ensemble.append(conf)
+        else:
+            confs = json.load(open(LEGACY))
+            store = Ensemble(next(iter(confs.values()))['atoms'], capacity=len(confs)) if confs else None
+            ensemble = [Conformer.load_raw(confs[i], store) for i in confs]
+
+        if os.path.exists(journal):
+            index = {i.number : i for i in ensemble}
+            with open(journal) as f:
+                for line in f:
+                    try:
+                        delta = json.loads(line)
+                    except json.JSONDecodeError:
+                        # record truncated by a crash while writing
+                        break
+                    conf = index[delta['number']]
+                    conf.energies.update(delta['energies'])
+                    conf.active = delta['active']
+                    if 'last_geometry' in delta:
+                        conf.last_geometry = np.array(delta['last_geometry'])
+
+        return ensemble
@@ -1,31 +1,355 @@
+from ensemble_analyser.IOsystem import conf_folder
 
-from ensemble_analyser.IOsystem import mkdir
-
+from collections.abc import MutableMapping
 import numpy as np
 from ase.atoms import Atoms
+from ase.data import atomic_masses, atomic_numbers
+import os
+
+
+# parameters stored for each conformer and protocol step
+FIELDS = ('E', 'G', 'B', 'm', 'time', 'Erel', 'Pop')
+FIELD_INDEX = {f : idx for idx, f in enumerate(FIELDS)}
+
+
+class Ensemble:
+    '''
+    Struct-of-arrays storage of a whole ensemble: all the geometries in a single (N, natoms, 3) array, the elements
+    shared by all the conformers, and each parameter (E, G, B, m, time, Erel, Pop) as an (N x protocol steps) column.
+    A None parameter is stored as NaN, and the parameters set are tracked as bits of an (N x protocol steps) mask.
+
+    Conformer instances are lightweight views on a row of the ensemble.
+    '''
+
+    def __init__(self, atoms: np.array, capacity : int = 1) -> None:
+        '''
+        atoms | np.array : atomic symbols, shared by all the conformers
+        capacity | int : number of conformers allocated in advance
+        '''
+        self.atoms = np.asarray(atoms, dtype=str)
+        self.size = 0
+
+        # format of the XYZ coordinates block, filled at once with the flattened geometry
+        self.xyz_template = '\n'.join(f' {a}\t%14f\t%14f\t%14f' for a in self.atoms)
+
+        capacity = max(capacity, 1)
+        self.number = np.zeros(capacity, dtype=int)
+        self.charge = np.zeros(capacity, dtype=int)
+        self.mult = np.ones(capacity, dtype=int)
+        self.active = np.ones(capacity, dtype=bool)
+        self.diactivated_by = np.full(capacity, -1, dtype=int)
+        self.initial_geometry = np.zeros((capacity, len(self.atoms), 3))
+        self.geometry = np.zeros((capacity, len(self.atoms), 3))
+
+        # protocol steps, in order of first calculation, as columns of the parameters
+        self.protocols = []
+        self.index = {}
+        self.columns = {f : np.full((capacity, 0), np.nan) for f in FIELDS}
+        self.fields = np.zeros((capacity, 0), dtype=np.uint8)
+        self.done = np.zeros((capacity, 0), dtype=bool)
+        self.last = np.full(capacity, -1, dtype=int)
+
+        # information read from the input file (e.g. title and data fields of a SDF), by row
+        self.metadata = {}
+
+    def __len__(self) -> int:
+        return self.size
+
+    def compatible(self, atoms) -> bool:
+        '''
+        Whether a conformer with these atoms can be stored
+
+        atoms | np.array : atomic symbols
+
+        return | bool
+        '''
+        return len(atoms) == len(self.atoms) and bool(np.all(np.asarray(atoms, dtype=str) == self.atoms))
+
+    def append(self, number : int, geom : np.array, charge : int, mult : int) -> int:
+        '''
+        Add a conformer, doubling the storage when full
+
+        number | int : conformer number
+        geom | np.array : geometry
+        charge | int : charge of the molecule
+        mult | int : multiplicity of the molecule
+
+        return | int : row of the conformer
+        '''
+        if self.size == len(self.number):
+            self._resize(2*len(self.number))
+
+        row = self.size
+        self.number[row], self.charge[row], self.mult[row] = number, charge, mult
+        self.initial_geometry[row] = geom
+        self.geometry[row] = geom
+        self.size += 1
+        return row
+
+    def _resize(self, capacity : int) -> None:
+        def grow(arr, fill):
+            new = np.full((capacity,) + arr.shape[1:], fill, dtype=arr.dtype)
+            new[:len(arr)] = arr
+            return new
+
+        self.number, self.charge, self.mult = grow(self.number, 0), grow(self.charge, 0), grow(self.mult, 1)
+        self.active, self.diactivated_by = grow(self.active, True), grow(self.diactivated_by, -1)
+        self.initial_geometry, self.geometry = grow(self.initial_geometry, 0), grow(self.geometry, 0)
+        self.columns = {f : grow(self.columns[f], np.nan) for f in FIELDS}
+        self.fields, self.done, self.last = grow(self.fields, 0), grow(self.done, False), grow(self.last, -1)
+        return None
+
+    def column(self, key) -> int:
+        '''
+        Column of a protocol step, added if not present
+
+        key | str : protocol number
+
+        return | int : column
+        '''
+        if key not in self.index:
+            self.index[key] = len(self.protocols)
+            self.protocols.append(key)
+            add = lambda arr, fill: np.hstack([arr, np.full((len(arr), 1), fill, dtype=arr.dtype)])
+            self.columns = {f : add(self.columns[f], np.nan) for f in FIELDS}
+            self.fields, self.done = add(self.fields, 0), add(self.done, False)
+        return self.index[key]
+
+    def last_values(self, rows, field : str) -> np.array:
+        '''
+        Parameter of the last protocol step calculated, for many conformers at once
+
+        rows | np.array : rows of the conformers
+        field | str : parameter name
+
+        return | np.array : values; NaN if None or not calculated
+        '''
+        rows = np.asarray(rows, dtype=int)
+        cols = self.last[rows]
+        if not self.protocols:
+            return np.full(len(rows), np.nan)
+        return np.where(cols >= 0, self.columns[field][rows, np.maximum(cols, 0)], np.nan)
+
+    def set_last_values(self, rows, field : str, values) -> None:
+        '''
+        Set a parameter of the last protocol step calculated, for many conformers at once
+
+        rows | np.array : rows of the conformers; all must have a protocol step calculated
+        field | str : parameter name
+        values | np.array : values
+
+        return None
+        '''
+        rows = np.asarray(rows, dtype=int)
+        cols = self.last[rows]
+        self.columns[field][rows, cols] = values
+        self.fields[rows, cols] |= np.uint8(1 << FIELD_INDEX[field])
+        return None
+
+    @property
+    def mass(self) -> float:
+        return float(np.sum(atomic_masses[[atomic_numbers[i] for i in self.atoms]]))
+
+
+
+def shared_ensemble(confs) -> Ensemble:
+    '''
+    Ensemble storing all the conformers, so that they can be handled at once through its arrays
+
+    confs | list : conformers
+
+    return | Ensemble : None if the conformers are stored in different ensembles (or if there are none)
+    '''
+    if not confs:
+        return None
+    store = confs[0].ensemble
+    return store if all(i.ensemble is store for i in confs) else None
+
+
+
+class Parameters(MutableMapping):
+    '''
+    Parameters of a conformer at a protocol step, as a dictionary view on the ensemble columns
+    '''
+    __slots__ = ('ensemble', 'row', 'col')
+
+    def __init__(self, ensemble : Ensemble, row : int, col : int) -> None:
+        self.ensemble, self.row, self.col = ensemble, row, col
+
+    def __getitem__(self, key):
+        f = FIELD_INDEX.get(key)
+        if f is None or not (self.ensemble.fields[self.row, self.col] >> f) & 1:
+            raise KeyError(key)
+        value = self.ensemble.columns[key][self.row, self.col]
+        return None if np.isnan(value) else float(value)
+
+    def __setitem__(self, key, value) -> None:
+        if key not in FIELD_INDEX:
+            raise KeyError(f'{key} is not a parameter of the conformers (available: {", ".join(FIELDS)})')
+        self.ensemble.columns[key][self.row, self.col] = np.nan if value is None else value
+        self.ensemble.fields[self.row, self.col] |= np.uint8(1 << FIELD_INDEX[key])
+
+    def __delitem__(self, key) -> None:
+        self[key]
+        self.ensemble.columns[key][self.row, self.col] = np.nan
+        self.ensemble.fields[self.row, self.col] &= ~np.uint8(1 << FIELD_INDEX[key])
+
+    def __iter__(self):
+        mask = self.ensemble.fields[self.row, self.col]
+        return iter([f for idx, f in enumerate(FIELDS) if (mask >> idx) & 1])
+
+    def __len__(self) -> int:
+        return len(list(iter(self)))
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+
+class Energies(MutableMapping):
+    '''
+    Parameters of a conformer for each protocol step ({protocol number : parameters}), as a dictionary view on the ensemble
+    '''
+    __slots__ = ('ensemble', 'row')
+
+    def __init__(self, ensemble : Ensemble, row : int) -> None:
+        self.ensemble, self.row = ensemble, row
+
+    def __getitem__(self, key) -> Parameters:
+        col = self.ensemble.index.get(key)
+        if col is None or not self.ensemble.done[self.row, col]:
+            raise KeyError(key)
+        return Parameters(self.ensemble, self.row, col)
+
+    def __setitem__(self, key, value) -> None:
+        value = dict(value)
+        col = self.ensemble.column(key)
+        for f in FIELDS:
+            self.ensemble.columns[f][self.row, col] = np.nan
+        self.ensemble.fields[self.row, col] = 0
+        self.ensemble.done[self.row, col] = True
+        self.ensemble.last[self.row] = max(self.ensemble.last[self.row], col)
+        params = Parameters(self.ensemble, self.row, col)
+        for k, v in value.items():
+            params[k] = v
+
+    def __delitem__(self, key) -> None:
+        col = self[key].col
+        for f in FIELDS:
+            self.ensemble.columns[f][self.row, col] = np.nan
+        self.ensemble.fields[self.row, col] = 0
+        self.ensemble.done[self.row, col] = False
+        done = np.flatnonzero(self.ensemble.done[self.row])
+        self.ensemble.last[self.row] = done[-1] if done.size else -1
+
+    def __iter__(self):
+        return iter([self.ensemble.protocols[col] for col in np.flatnonzero(self.ensemble.done[self.row])])
+
+    def __len__(self) -> int:
+        return int(np.sum(self.ensemble.done[self.row]))
+
+    def __repr__(self) -> str:
+        return repr({k : dict(v) for k, v in self.items()})
+
 
 
 class Conformer:
     '''
-    Storing all the information on each conformer for all the parts of the protocol
-    
+    Storing all the information on each conformer for all the parts of the protocol.
+    The information is stored in a row of an Ensemble, shared with the other conformers read together
+
     '''
+    __slots__ = ('ensemble', 'row')
+
+    def __init__(self, number: int, geom: np.array, atoms: np.array, charge : int= 0, mult : int = 1, raw=False, ensemble : Ensemble = None) -> None:
+        '''
+        raw | bool : do not check that the folder is free (e.g. conformer reloaded from a checkpoint)
+        ensemble | Ensemble : storage shared with the other conformers. If None or with different atoms, a new one is created
+        '''
+        if ensemble is None or not ensemble.compatible(atoms):
+            ensemble = Ensemble(atoms)
+        self.ensemble = ensemble
+        self.row = ensemble.append(number, geom, charge, mult)
+
+        # IO: the folder is created by the first calculation, but the one of a previous calculation is not overwritten
+        if not raw and os.path.exists(self.folder):
+            raise IOError(f'Directory {self.folder} already exists. Going to exit!')
+
+    @property
+    def number(self) -> int:
+        return int(self.ensemble.number[self.row])
+
+    @property
+    def charge(self) -> int:
+        return int(self.ensemble.charge[self.row])
+
+    @property
+    def mult(self) -> int:
+        return int(self.ensemble.mult[self.row])
+
+    @property
+    def atoms(self) -> np.array:
+        return self.ensemble.atoms
+
+    @property
+    def folder(self) -> str:
+        return conf_folder(self.number)
+
+    @property
+    def _initial_geometry(self) -> np.array:
+        return self.ensemble.initial_geometry[self.row]
+
+    @property
+    def last_geometry(self) -> np.array:
+        # read-only view: a new geometry must be assigned
+        geom = self.ensemble.geometry[self.row]
+        geom.flags.writeable = False
+        return geom
+
+    @last_geometry.setter
+    def last_geometry(self, geom) -> None:
+        self.ensemble.geometry[self.row] = geom
+
+    @property
+    def active(self) -> bool:
+        return self.ensemble.active.item(self.row)
+
+    @active.setter
+    def active(self, value : bool) -> None:
+        self.ensemble.active[self.row] = value
+
+    @property
+    def diactivated_by(self) -> int:
+        number = self.ensemble.diactivated_by[self.row]
+        return int(number) if number >= 0 else None
+
+    @diactivated_by.setter
+    def diactivated_by(self, number : int) -> None:
+        self.ensemble.diactivated_by[self.row] = -1 if number is None else number
+
+    @property
+    def metadata(self) -> dict:
+        return self.ensemble.metadata.get(self.row, {})
+
+    @metadata.setter
+    def metadata(self, info : dict) -> None:
+        if info:
+            self.ensemble.metadata[self.row] = dict(info)
+        else:
+            self.ensemble.metadata.pop(self.row, None)
+
+    @property
+    def energies(self) -> Energies:
+        return Energies(self.ensemble, self.row)
+
+    @energies.setter
+    def energies(self, energies : dict) -> None:
+        view = Energies(self.ensemble, self.row)
+        for key in list(view):
+            del view[key]
+        for key, value in energies.items():
+            view[key] = value
 
-    def __init__(self, number: int, geom: np.array, atoms: np.array, charge : int= 0, mult : int = 1, raw=False) -> None:
-        self.number = number
-        self._initial_geometry = geom
-        self.charge = charge
-        self.mult = mult
-        
-        self.last_geometry = geom
-        self.atoms = atoms
-        self.energies = {}
-        self.active = True
-
-        # IO
-        self.folder = f'conf_{self.number}'
-        if not raw: mkdir(self.folder)
-    
     def get_ase_atoms(self, calc=None):
         return Atoms(
             symbols = ''.join(list(self.atoms)),
@@ -35,35 +359,38 @@ class Conformer:
 
     @property
     def weight_mass(self):
-        return np.sum(Atoms(
-            symbols = ''.join(list(self.atoms)),
-            positions = self.last_geometry,
-        ).get_masses())
+        return self.ensemble.mass
 
     @property
     def rotatory(self):
-        return self.energies[list(self.energies.keys())[-1]]['B']
-    
+        return self._last_energy['B']
+
     @property
     def moment(self):
-        return self.energies[list(self.energies.keys())[-1]]['m']
+        return self._last_energy['m']
 
     @property
     def get_energy(self):
-        en = self.energies[list(self.energies.keys())[-1]]
-        if en['G']: return en['G']
-        return en['E']
-    
+        # called at each comparison while sorting: plain Python floats (NaN != NaN)
+        col = self.ensemble.last.item(self.row)
+        if col < 0:
+            raise IndexError(f'No energy calculated for CONF_{self.number}')
+        g = self.ensemble.columns['G'].item(self.row, col)
+        if g and g == g: return g
+        e = self.ensemble.columns['E'].item(self.row, col)
+        return e if e == e else None
+
     @property
     def _last_energy(self):
-        return self.energies[list(self.energies.keys())[-1]]
-        
+        col = self.ensemble.last[self.row]
+        if col < 0:
+            raise IndexError(f'No energy calculated for CONF_{self.number}')
+        return Parameters(self.ensemble, self.row, col)
+
     def write_xyz(self):
         if not self.active: return ''
         txt = f'{len(self.atoms)}\nCONFORMER {self.number} {"G : {:.6f} kcal/mol".format(self._last_energy["G"]) if self._last_energy["G"] else "E : {:.6f} kcal/mol".format(self._last_energy["E"])}\n'
-        for a, pos in zip(self.atoms, self.last_geometry):
-            x, y, z = pos
-            txt += f' {a}\t{x:14f}\t{y:14f}\t{z:14f}\n'
+        txt += self.ensemble.xyz_template % tuple(self.last_geometry.ravel().tolist())
         return txt.strip()
 
     def create_log(self):
@@ -72,39 +399,66 @@ class Conformer:
         if g: g /= 627.51
         return number, e/627.51, g, b, erel, pop, time
 
+    def dump_raw(self) -> dict:
+        '''
+        Plain dictionary of the conformer, to be serialised and read back with load_raw
+
+        return | dict
+        '''
+        return {
+            'number' : self.number,
+            'last_geometry' : self.last_geometry.tolist(),
+            'atoms' : self.atoms.tolist(),
+            'charge' : self.charge,
+            'mult' : self.mult,
+            'energies' : {k : dict(v) for k, v in self.energies.items()},
+            'active' : self.active,
+            'diactivated_by' : self.diactivated_by,
+            'metadata' : self.metadata,
+        }
+
 
     @staticmethod
-    def load_raw(json):
+    def load_raw(json, ensemble : Ensemble = None):
         a = Conformer(
             number = json['number'],
             geom = json['last_geometry'],
             atoms = json['atoms'],
-            charge = json['charge'], 
+            charge = json['charge'],
             mult = json['mult'],
             raw = True,
+            ensemble = ensemble,
         )
         a.energies = json['energies']
         a.active = json['active']
+        a.diactivated_by = json.get('diactivated_by')
+        a.metadata = json.get('metadata', {})
         return a
 
 
     def __str__(self) -> str:
         return str(self.number)
-    
+
     def __repr__(self) -> str:
         return str(self.number)
-    
+
 
     # Functions needed for sorting the conformers' ensemble
 
+    @property
+    def _sort_energy(self):
+        # conformers deactivated before any energy was computed (e.g. failed calculations)
+        if self.ensemble.last.item(self.row) < 0: return 0
+        return self.get_energy
+
     def __lt__(self, other):
-        if not self.active: return 0 < other.get_energy
-        return self.get_energy < other.get_energy
-        
+        if not self.active: return 0 < other._sort_energy
+        return self.get_energy < other._sort_energy
+
     def __gt__(self, other):
-        if not self.active: return 0 > other.get_energy
-        return self.get_energy > other.get_energy
-        
+        if not self.active: return 0 > other._sort_energy
+        return self.get_energy > other._sort_energy
+
     def __eq__(self, other):
-        if not self.active: return 0 == other.get_energy
-        return self.get_energy == other.get_energy
\ No newline at end of file
+        if not self.active: return 0 == other._sort_energy
+        return self.get_energy == other._sort_energy
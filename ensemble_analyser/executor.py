@@ -0,0 +1,740 @@
+from ensemble_analyser.conformer import Conformer
+from ensemble_analyser.IOsystem import SerialiseEncoder, conf_folder
+from ensemble_analyser.logger import ordinal
+from ensemble_analyser.parser_parameter import classify_failure, PROPERTY_FILES
+from ensemble_analyser.protocol import Protocol, ORCA_LABEL
+from ensemble_analyser.pruning import rmsd_many
+from ensemble_analyser.monitor import Monitor
+from ensemble_analyser.tracer import TRACER
+
+import ase
+import json, os, sys
+import logging
+import shlex, shutil, subprocess
+import tempfile
+import numpy as np
+from glob import glob
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+BATCH_FOLDER = 'batch'
+MAX_NEIGHBOURS = 200
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Failure:
+    """
+    Result of a calculation that did not end correctly
+    """
+
+    def __init__(self, kind : str, message : str = ''):
+        """
+        kind | str : fatal, scf or transient (see parser_parameter.classify_failure)
+        message | str : description of the error
+        """
+        self.kind = kind
+        self.message = message
+
+    def __str__(self):
+        return f'{self.kind}: {self.message}'
+
+    def __repr__(self):
+        return f'Failure({self.kind})'
+
+
+
+def stage_out(label, conf, protocol, keep_gbw : bool = False) -> None:
+    """
+    Move the outputs needed by the rest of the calculation into the conformer folder.
+    Outputs are copied if the calculation ran on a different filesystem (e.g. node-local scratch)
+
+    label | str : path of the files of the calculation without extension (e.g. conf_1/orca)
+    conf | Conformer : conformer instance
+    protocol | Protocol : protocol instance
+    keep_gbw | bool : keep the wavefunction, replacing the one of the previous protocol steps
+
+    return None
+    """
+
+    shutil.move(f'{label}.out', os.path.join(conf.folder, f'protocol_{protocol.number}.out'))
+    if protocol.freq:
+        shutil.move(f'{label}.hess', os.path.join(conf.folder, f'protocol_{protocol.number}.hess'))
+    if protocol.opt and os.path.exists(f'{label}.xyz'):
+        shutil.move(f'{label}.xyz', os.path.join(conf.folder, f'protocol_{protocol.number}.xyz'))
+
+    # machine-readable properties (ORCA 5: orca_property.txt, ORCA 6: orca.property.txt/.json). A stale file of a
+    # previous run of the step would be preferred to the output, so it is removed
+    for ext in PROPERTY_FILES:
+        fname = os.path.join(conf.folder, f'protocol_{protocol.number}.{ext}')
+        source = next((i for i in (f'{label}_{ext}', f'{label}.{ext}') if os.path.exists(i)), None)
+        if source:
+            shutil.move(source, fname)
+        elif os.path.exists(fname):
+            os.remove(fname)
+
+    if keep_gbw and os.path.exists(f'{label}.gbw'):
+        for old in glob(os.path.join(conf.folder, 'protocol_*.gbw')):
+            os.remove(old)
+        shutil.move(f'{label}.gbw', os.path.join(conf.folder, f'protocol_{protocol.number}.gbw'))
+
+    return None
+
+
+def find_guess(conf, protocol, finished : list):
+    """
+    Wavefunction to be used as initial guess: the one of the last protocol step of the conformer,
+    else the one of the nearest (lowest RMSD) conformer already calculated with this protocol step
+
+    conf | Conformer : conformer instance
+    protocol | Protocol : protocol instance
+    finished | list : conformers already calculated with this protocol step
+
+    return | str : GBW filename; None if no guess is available
+    """
+
+    if 'xtb' in protocol.functional.lower():
+        return None
+
+    own = [(int(os.path.basename(i).split('_')[1].split('.')[0]), i) for i in glob(os.path.join(conf.folder, 'protocol_*.gbw'))]
+    own = [i for i in own if i[0] < int(protocol.number)]
+    if own:
+        return max(own)[1]
+
+    candidates = [i for i in finished[-MAX_NEIGHBOURS:] if i is not conf and len(i.atoms) == len(conf.atoms)]
+    if not candidates:
+        return None
+
+    nearest = candidates[int(np.argmin(rmsd_many(conf.last_geometry, [i.last_geometry for i in candidates])))]
+    return os.path.join(nearest.folder, f'protocol_{protocol.number}.gbw')
+
+
+def run_calculator(idx, conf, protocol, cpu, log, escalate : int = 0, scratch : str = None, guess : str = None, keep_gbw : bool = False, ceiling = None):
+    """
+    Run the calculator for a single conformer inside its own folder, moving the outputs in place.
+    No state of the conformer is changed, so it can be safely executed in a worker thread or process
+
+    idx | int : index of the calculation
+    conf | Conformer : conformer instance
+    protocol | Protocol : protocol instance
+    cpu | int : number of cpu to allocate
+    log : logger instance
+    escalate | int : level of the more robust convergence settings to use
+    scratch | str : folder where to run the calculation (e.g. node-local disk). If None, the calculation runs in the conformer folder
+    guess | str : GBW file to be used as initial guess
+    keep_gbw | bool : keep the wavefunction in the conformer folder
+    ceiling | callable : returns the energy over which an optimization is aborted [kcal/mol]. If None, no abort
+
+    return | float or Failure : elapsed time [sec], or the failure if the calculator crashed
+    """
+
+    log.info(f'{idx}. Running {ordinal(int(protocol.number))} PROTOCOL -> CONF{conf.number}' + (f' (convergence settings level {escalate})' if escalate else ''))
+    # the conformer folder is created by its first calculation
+    folder = conf_folder(conf.number, create=True)
+    if scratch:
+        scratch = os.path.expandvars(scratch)
+        os.makedirs(scratch, exist_ok=True)
+        workdir = tempfile.mkdtemp(prefix=f'conf_{conf.number}_protocol_{protocol.number}_', dir=scratch)
+    else:
+        workdir = folder
+    # the calculator writes all its files (orca.inp, orca.out, ...) into the folder where it runs
+    label = os.path.join(workdir, ORCA_LABEL)
+
+    # the guess is copied next to the input: the original may be replaced meanwhile by its conformer's next step
+    if guess:
+        try:
+            shutil.copyfile(guess, os.path.join(workdir, 'guess.gbw'))
+            guess = 'guess.gbw'
+        except OSError:
+            guess = None
+
+    monitor = None
+    if ceiling and protocol.opt:
+        monitor = Monitor(f'{label}.out', workdir, ceiling, protocol.calculator)
+        monitor.start()
+
+    try:
+        st = time.perf_counter()
+
+        with TRACER.span('calculator setup', conf, protocol):
+            calculator, label = protocol.get_calculator(cpu=cpu, charge=conf.charge, mult=conf.mult, directory=workdir, escalate=escalate, guess=guess)
+            TRACER.instrument(calculator, conf, protocol)
+            atm = conf.get_ase_atoms(calculator)
+
+        with TRACER.span('calculator run', conf, protocol):
+            try:
+                atm.get_potential_energy()
+            except ase.calculators.calculator.PropertyNotImplementedError:
+                pass
+
+        end = time.perf_counter()
+        if monitor:
+            monitor.stop()
+
+        with TRACER.span('stage out', conf, protocol):
+            stage_out(label, conf, protocol, keep_gbw)
+            if not scratch:
+                for fname in (f'{label}.gbw', os.path.join(workdir, 'guess.gbw')):
+                    if os.path.exists(fname):
+                        os.remove(fname)
+
+
+    # ORCA exiting with an error is raised by the ASE calculator as a failure of its subprocess
+    except (ase.calculators.calculator.CalculationFailed, subprocess.CalledProcessError):
+        if monitor:
+            monitor.stop()
+            if monitor.aborted is not None:
+                shutil.move(f'{label}.out', os.path.join(conf.folder, f'protocol_{protocol.number}.out'))
+                return Failure('aborted', f'CONF_{conf.number} optimization aborted: E {monitor.limit + monitor.aborted:.2f} kcal/mol, {monitor.aborted:.2f} kcal/mol over the ceiling of the energy window ({monitor.limit:.2f} kcal/mol)')
+
+        message = ''
+        if os.path.exists(f'{label}.out'):
+            with open(f'{label}.out', errors='replace') as f:
+                message = '\n'.join(f.read().splitlines()[-6:-3])
+        return Failure(classify_failure(f'{label}.out', protocol.calculator), message)
+
+    finally:
+        if monitor and monitor.is_alive():
+            monitor.stop()
+        # everything not staged out is left behind
+        if scratch:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return end-st
+
+
+
+class Job:
+    """
+    A protocol step to be calculated on a conformer
+    """
+
+    def __init__(self, idx : int, conf, protocol, try_num : int = 1):
+        self.idx = idx
+        self.conf = conf
+        self.protocol = protocol
+        self.try_num = try_num
+        self.escalate = 0
+        self.discard = False
+
+    def __str__(self):
+        return f'CONF{self.conf.number}@{self.protocol.number}'
+
+    def __repr__(self):
+        return f'CONF{self.conf.number}@{self.protocol.number}'
+
+
+
+class Executor:
+    """
+    Run the jobs submitted by run_protocol and give back the completed ones.
+    Outputs are left in the conformer folder and are parsed by the caller, that remains the only writer of the ensemble.
+
+    Subclasses implement start (begin the execution of a list of jobs) and collect (wait for some job to be completed)
+    """
+
+    name = ''
+
+    def __init__(self, cpu : int, workers : int, log, scratch : str = None, reuse_guess : bool = False):
+        """
+        cpu | int : total number of cpu to allocate
+        workers | int : number of simultaneous calculations
+        log : logger instance
+        scratch | str : folder where to run the calculations. If None, they run in the conformer folders
+        reuse_guess | bool : keep the wavefunctions and use them as initial guess for the following calculations
+        """
+        self.workers = max(1, workers)
+        self.cpu = max(1, cpu // self.workers)
+        self.log = log
+        self.scratch = scratch
+        self.reuse_guess = reuse_guess
+        self.finished = {}
+        self.window = None
+        self.waiting = []
+        self.running = {}
+
+    @property
+    def pending(self) -> int:
+        return len(self.waiting) + len(self.running)
+
+    def pending_for(self, number) -> int:
+        """
+        Number of jobs of a protocol step not yet completed
+
+        number | int : protocol number
+
+        return | int
+        """
+        return len([j for _, j in self.waiting if str(j.protocol.number) == str(number)]) + len([j for j in self.running.values() if str(j.protocol.number) == str(number)])
+
+    def submit(self, job, delay : float = 0) -> None:
+        """
+        Queue a job
+
+        job | Job : job to be executed
+        delay | float : seconds to wait before the job can start
+
+        return None
+        """
+        self.waiting.append((time.time() + delay, job))
+        return None
+
+    def poll(self) -> list:
+        """
+        Start the queued jobs that are due and wait for some of the running ones to finish
+
+        return | list : (Job, elapsed time [sec] or Failure) of the completed jobs
+        """
+
+        now = time.time()
+        due = [j for t, j in self.waiting if t <= now]
+        self.waiting = [(t, j) for t, j in self.waiting if t > now]
+        if due:
+            self.start(due)
+
+        if not self.running:
+            if self.waiting:
+                time.sleep(max(0, min(t for t, _ in self.waiting) - time.time()))
+            return []
+
+        timeout = max(0, min(t for t, _ in self.waiting) - time.time()) if self.waiting else None
+        return self.collect(timeout)
+
+    def guess(self, job):
+        """
+        Initial guess for a job, if the wavefunctions are reused
+
+        job | Job : job to be executed
+
+        return | str : GBW filename; None if no guess is available
+        """
+        if not self.reuse_guess:
+            return None
+        return find_guess(job.conf, job.protocol, self.finished.get(str(job.protocol.number), []))
+
+    def ceiling(self, job):
+        """
+        Ceiling of the energy window for a job, if the running optimizations are monitored
+
+        job | Job : job to be executed
+
+        return | callable : returns the current ceiling [kcal/mol]; None if not monitored
+        """
+        if not self.window or not self.window.applies(job.protocol):
+            return None
+        return lambda: self.window.ceiling(job.protocol)
+
+    def done(self, job, result) -> None:
+        """
+        Keep track of the conformers whose wavefunction is available
+
+        job | Job : completed job
+        result | float or Failure : result of the job
+
+        return None
+        """
+        if self.reuse_guess and not isinstance(result, Failure):
+            self.finished.setdefault(str(job.protocol.number), []).append(job.conf)
+        return None
+
+    def execute(self, job):
+        """
+        Run a job inside this process
+
+        job | Job : job to be executed
+
+        return | float or Failure : elapsed time [sec], or the failure if the calculator crashed
+        """
+        result = run_calculator(job.idx, job.conf, job.protocol, self.cpu, self.log, job.escalate, self.scratch, self.guess(job), self.reuse_guess, self.ceiling(job))
+        self.done(job, result)
+        return result
+
+    def cancel(self, job) -> bool:
+        """
+        Remove a job that has not been completed yet
+
+        job | Job : job to be removed
+
+        return | bool : True if the job will not be given back by poll
+        """
+        for idx, (_, j) in enumerate(self.waiting):
+            if j is job:
+                self.waiting.pop(idx)
+                return True
+        return self.stop(job)
+
+    def stop(self, job) -> bool:
+        return False
+
+    def start(self, jobs) -> None:
+        raise NotImplementedError
+
+    def collect(self, timeout) -> list:
+        raise NotImplementedError
+
+    def shutdown(self) -> None:
+        self.waiting = []
+        return None
+
+
+
+class InlineExecutor(Executor):
+    """
+    Run one job at a time inside the main process
+    """
+
+    name = 'inline'
+
+    def start(self, jobs) -> None:
+        for job in jobs:
+            self.running[id(job)] = job
+
+    def collect(self, timeout) -> list:
+        job = self.running.pop(next(iter(self.running)))
+        return [(job, self.execute(job))]
+
+    def stop(self, job) -> bool:
+        return self.running.pop(id(job), None) is not None
+
+
+
+class LocalExecutor(Executor):
+    """
+    Run the jobs on a pool of threads, each one driving its own calculator process
+    """
+
+    name = 'local'
+
+    def __init__(self, cpu : int, workers : int, log, scratch : str = None, reuse_guess : bool = False):
+        super().__init__(cpu, workers, log, scratch, reuse_guess)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def start(self, jobs) -> None:
+        for job in jobs:
+            self.running[self.pool.submit(self.execute, job)] = job
+
+    def collect(self, timeout) -> list:
+        done, _ = wait(self.running, timeout=timeout, return_when=FIRST_COMPLETED)
+        completed = []
+        for fut in done:
+            job = self.running.pop(fut)
+            try:
+                completed.append((job, fut.result()))
+            except Exception:
+                self.shutdown()
+                raise
+        return completed
+
+    def stop(self, job) -> bool:
+        for fut, j in list(self.running.items()):
+            if j is job and fut.cancel():
+                self.running.pop(fut)
+                return True
+        return False
+
+    def shutdown(self) -> None:
+        super().shutdown()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        return None
+
+
+
+class BatchExecutor(Executor):
+    """
+    Submit the jobs as tasks of a batch array. Each task runs this module as a script
+    (python -m ensemble_analyser.executor BATCH_FILE TASK_ID) and writes a status file next to the batch file.
+    """
+
+    poll_interval = 30
+
+    def __init__(self, cpu : int, workers : int, log, scratch : str = None, reuse_guess : bool = False):
+        super().__init__(cpu, workers, log, scratch, reuse_guess)
+        self.counter = 0
+
+    def write_batch(self, jobs) -> str:
+        """
+        Write the batch file with all the information to run the jobs in a separate process
+
+        jobs | list : jobs in the array
+
+        return | str : batch folder
+        """
+
+        self.counter += 1
+        folder = os.path.join(os.getcwd(), BATCH_FOLDER, f'protocol_{jobs[0].protocol.number}_{self.counter}')
+        os.makedirs(folder, exist_ok=True)
+
+        tasks = [{
+            'idx' : job.idx,
+            'conf' : job.conf.dump_raw(),
+            'protocol' : job.protocol.__dict__,
+            'cpu' : self.cpu,
+            'escalate' : job.escalate,
+            'guess' : self.guess(job),
+            # the ceiling can only decrease: the one at submission time is a safe bound
+            'ceiling' : self.window.ceiling(job.protocol) if self.window else None,
+        } for job in jobs]
+        json.dump({'cwd' : os.getcwd(), 'scratch' : self.scratch, 'reuse_guess' : self.reuse_guess, 'trace' : TRACER.enabled, 'tasks' : tasks}, open(os.path.join(folder, 'batch.json'), 'w'), cls=SerialiseEncoder)
+
+        return folder
+
+    def status(self, folder, task) -> dict:
+        """
+        Read the status file of a task, if the task is completed
+
+        folder | str : batch folder
+        task | int : task id
+
+        return | dict : status of the task; None if not completed
+        """
+        fname = os.path.join(folder, f'task_{task}.status')
+        if not os.path.exists(fname):
+            return None
+        with open(fname) as f:
+            return json.load(f)
+
+    def harvest(self, key, job, status) -> tuple:
+        """
+        Convert the status of a completed task into the (Job, elapsed time or Failure) tuple
+
+        key : key of the job in the running dictionary
+        job | Job : job of the task
+        status | dict : status of the task
+
+        return | tuple
+        """
+        self.running.pop(key)
+        if status is None:
+            return job, Failure('transient', 'The task ended without giving back any result')
+        TRACER.add(status.get('spans'))
+        if status.get('failure'):
+            return job, Failure(status['failure'], status.get('message', ''))
+        if status.get('error'):
+            self.shutdown()
+            self.log.critical(f"\n{'='*20}\nCRITICAL ERROR\n{'='*20}\n{status['error']}\n{'='*20}\nExiting\n{'='*20}\n")
+            raise RuntimeError(status['error'])
+        self.done(job, status['time'])
+        return job, status['time']
+
+    def environment(self) -> dict:
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([PACKAGE_ROOT] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+        return env
+
+
+
+class FakeSchedulerExecutor(BatchExecutor):
+    """
+    Local stand-in for a batch system: every task of the array is a separate process,
+    at most WORKERS of them running at the same time
+    """
+
+    name = 'fake'
+    poll_interval = .5
+
+    def __init__(self, cpu : int, workers : int, log, scratch : str = None, reuse_guess : bool = False):
+        super().__init__(cpu, workers, log, scratch, reuse_guess)
+        self.queue = []
+        self.processes = {}
+
+    def start(self, jobs) -> None:
+        folder = self.write_batch(jobs)
+        for task, job in enumerate(jobs):
+            self.queue.append((folder, task))
+            self.running[(folder, task)] = job
+
+    def collect(self, timeout) -> list:
+        end = time.time() + timeout if timeout is not None else None
+        while True:
+            # fill the free slots, as the scheduler would do
+            while self.queue and len(self.processes) < self.workers:
+                folder, task = self.queue.pop(0)
+                log = open(os.path.join(folder, f'task_{task}.log'), 'w')
+                self.processes[(folder, task)] = subprocess.Popen(
+                    [sys.executable, '-m', 'ensemble_analyser.executor', os.path.join(folder, 'batch.json'), str(task)],
+                    stdout=log, stderr=subprocess.STDOUT, env=self.environment(),
+                )
+
+            completed = []
+            for key, proc in list(self.processes.items()):
+                if proc.poll() is None:
+                    continue
+                self.processes.pop(key)
+                completed.append(self.harvest(key, self.running[key], self.status(*key)))
+
+            if completed or (end is not None and time.time() >= end):
+                return completed
+            time.sleep(self.poll_interval)
+
+    def stop(self, job) -> bool:
+        for key, j in list(self.running.items()):
+            if j is not job:
+                continue
+            if key in self.queue:
+                self.queue.remove(key)
+            if key in self.processes:
+                self.processes.pop(key).terminate()
+            self.running.pop(key)
+            return True
+        return False
+
+    def shutdown(self) -> None:
+        super().shutdown()
+        self.queue = []
+        for proc in self.processes.values():
+            proc.terminate()
+        return None
+
+
+
+class SlurmExecutor(BatchExecutor):
+    """
+    Submit each group of jobs as a SLURM job array, throttled to WORKERS simultaneous tasks
+    """
+
+    name = 'slurm'
+
+    def __init__(self, cpu : int, workers : int, log, scratch : str = None, reuse_guess : bool = False, options : str = ''):
+        super().__init__(cpu, workers, log, scratch, reuse_guess)
+        self.options = options
+        self.arrays = {}
+
+    def start(self, jobs) -> None:
+        folder = self.write_batch(jobs)
+        script = os.path.join(folder, 'array.sh')
+        with open(script, 'w') as f:
+            f.write('\n'.join([
+                '#!/bin/bash',
+                f'#SBATCH --job-name=ensemble_analyser_{jobs[0].protocol.number}',
+                f'#SBATCH --array=0-{len(jobs)-1}%{self.workers}',
+                f'#SBATCH --cpus-per-task={self.cpu}',
+                f'#SBATCH --output={folder}/task_%a.log',
+                f'export PYTHONPATH={shlex.quote(self.environment()["PYTHONPATH"])}',
+                f'{shlex.quote(sys.executable)} -m ensemble_analyser.executor {shlex.quote(os.path.join(folder, "batch.json"))} $SLURM_ARRAY_TASK_ID',
+                ''
+            ]))
+
+        out = subprocess.run(['sbatch', '--parsable'] + shlex.split(self.options) + [script], capture_output=True, text=True, check=True)
+        job_id = out.stdout.strip().split(';')[0]
+        self.log.info(f'Submitted job array {job_id} with {len(jobs)} tasks')
+
+        self.arrays[job_id] = folder
+        for task, job in enumerate(jobs):
+            self.running[(job_id, task)] = job
+
+    def queued(self, job_id) -> bool:
+        out = subprocess.run(['squeue', '-h', '-j', job_id, '-o', '%i'], capture_output=True, text=True)
+        return bool(out.stdout.strip())
+
+    def collect(self, timeout) -> list:
+        end = time.time() + timeout if timeout is not None else None
+        while True:
+            completed = []
+            for job_id, folder in list(self.arrays.items()):
+                in_queue = self.queued(job_id)
+                for key in [k for k in self.running if k[0] == job_id]:
+                    status = self.status(folder, key[1])
+                    if status is not None or not in_queue:
+                        completed.append(self.harvest(key, self.running[key], status))
+                if not in_queue:
+                    self.arrays.pop(job_id)
+
+            if completed or (end is not None and time.time() >= end):
+                return completed
+            time.sleep(self.poll_interval)
+
+    def stop(self, job) -> bool:
+        for key, j in list(self.running.items()):
+            if j is job:
+                subprocess.run(['scancel', f'{key[0]}_{key[1]}'])
+                self.running.pop(key)
+                return True
+        return False
+
+    def shutdown(self) -> None:
+        super().shutdown()
+        for job_id in self.arrays:
+            subprocess.run(['scancel', job_id])
+        return None
+
+
+
+EXECUTORS = {
+    'local' : LocalExecutor,
+    'fake' : FakeSchedulerExecutor,
+    'slurm' : SlurmExecutor,
+}
+
+
+def get_executor(name : str, cpu : int, workers : int, log, batch_options : str = '', scratch : str = None, reuse_guess : bool = False):
+    """
+    Get the executor from the user selector
+
+    name | str : name of the executor
+    cpu | int : total number of cpu to allocate
+    workers | int : number of simultaneous calculations
+    log : logger instance
+    batch_options | str : additional options for the batch system submission
+    scratch | str : folder where to run the calculations. If None, they run in the conformer folders
+    reuse_guess | bool : keep the wavefunctions and use them as initial guess for the following calculations
+
+    return | Executor
+    """
+
+    if name == 'local' and workers <= 1:
+        return InlineExecutor(cpu, 1, log, scratch, reuse_guess)
+    if name == 'slurm':
+        return SlurmExecutor(cpu, workers, log, scratch, reuse_guess, options=batch_options)
+    return EXECUTORS[name](cpu, workers, log, scratch, reuse_guess)
+
+
+
+def run_task(batch_file : str, task : int) -> None:
+    """
+    Entry point of a batch task: run one job of the batch file and write its status
+
+    batch_file | str : batch file written by BatchExecutor
+    task | int : index of the task in the batch
+
+    return None
+    """
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stdout)
+    log = logging.getLogger()
+
+    with open(batch_file) as f:
+        batch = json.load(f)
+    spec = batch['tasks'][task]
+    os.chdir(batch['cwd'])
+
+    conf = Conformer.load_raw(spec['conf'])
+    protocol = Protocol(**spec['protocol'])
+    if batch.get('trace'):
+        TRACER.enable()
+
+    ceiling = None
+    if spec.get('ceiling') is not None:
+        ceiling = lambda: spec['ceiling']
+
+    try:
+        result = run_calculator(spec['idx'], conf, protocol, spec['cpu'], log, spec.get('escalate', 0), batch.get('scratch'), spec.get('guess'), batch.get('reuse_guess', False), ceiling)
+        if isinstance(result, Failure):
+            status = {'failure' : result.kind, 'message' : result.message}
+        else:
+            status = {'time' : result}
+    except Exception as e:
+        status = {'error' : f'CONF_{conf.number}: {e}'}
+    if TRACER.enabled:
+        status['spans'] = TRACER.records()
+
+    fname = os.path.join(os.path.dirname(batch_file), f'task_{task}.status')
+    json.dump(status, open(fname + '.tmp', 'w'))
+    os.replace(fname + '.tmp', fname)
+
+    return None
+
+
+
+if __name__ == '__main__':
+
+    run_task(sys.argv[1], int(sys.argv[2]))
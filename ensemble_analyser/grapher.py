@@ -7,6 +7,9 @@ import matplotlib.pyplot as plt
 
 
 from ensemble_analyser.regex_parsing import regex_parsing
+from ensemble_analyser.tracer import TRACER
+from ensemble_analyser.IOsystem import conf_folder
+from ensemble_analyser.parser_parameter import parse_output
 
 FACTOR_EV_NM = h*c/(10**-9*electron_volt)
 
@@ -63,8 +66,7 @@ class Graph:
         st , en = regex_parsing[self.protocol.calculator]['start_spec'], regex_parsing[self.protocol.calculator]['end_spec']
 
         for i in self.confs:
-            with open(os.path.join(os.getcwd(), i.folder, f'protocol_{self.protocol.number}.out')) as f:
-                fl = f.read()
+            fl = parse_output(os.path.join(os.getcwd(), i.folder, f'protocol_{self.protocol.number}.out'), self.protocol.calculator, ('spectra',)).block('spectra')
 
             sp = fl.split(st)[-1].split(en)[0]
             self.spectra.append(sp)
@@ -167,6 +169,7 @@ class Graph:
         # resampling the experimental data, in order to fetch the x_exp.size
         X = self.x.copy()
         Y_exp_interp = np.interp(X, ref.x, ref.y, left=0, right=0)
+        graphs = {}
 
 
         def optimiser(variables):
@@ -200,7 +203,7 @@ class Graph:
             self.log.info(f'Convergence of parameters succeeded within a threshold of {thr:.2f}u.a. for the ∆ε. Confidence level: {(1-result.fun/(2*X.size))*100:.2f}%. Parameters obtained\n\t- σ = {sigma:.4f} eV (that correspond to a FWHM = {(sigma*np.sqrt(2*np.log(2))*2):.4f} eV\n\t- Δ = {shift:.4f} eV (in this case, a negative shift corresponds to a RED-shift)')
             Y_COMP = Graph.normalise(self.calc_graph(impulses=impulses, shift=shift, sigma=sigma, save=True, fname=fname), norm=norm)
         else:
-            self.log.info(f'Convergence of parameters NOT succeeded within a threshold of {thr:.2f}u.a. for the ∆ε. Parameters used to convolute the saved graph\n\t- σ = {initial_guess[0]:.4f} eV (that correspond to a FWHM = {(initial_guess[0]*np.sqrt(2*np.log(2))*2):.4f} eV\n\t- Δ = 0.0000 eV')
+            self.log.info(f'Convergence of parameters NOT succeeded within a threshold of {confidence:.2f}u.a. for the ∆ε. Parameters used to convolute the saved graph\n\t- σ = {initial_guess[0]:.4f} eV (that correspond to a FWHM = {(initial_guess[0]*np.sqrt(2*np.log(2))*2):.4f} eV\n\t- Δ = 0.0000 eV')
             Y_COMP = Graph.normalise(self.calc_graph(impulses=impulses, shift=0, sigma=initial_guess[0], save=True, fname=fname), norm=norm)
 
         return Y_COMP
@@ -221,17 +224,18 @@ class Graph:
         x = self.x.copy()
         y = np.zeros(x.shape)
 
-        for idx in range(len(self.confs)):
-            y_ = np.zeros(x.shape)
-            for ev, I in impulses[idx]:
-                y_ += Graph.gaussian(x+shift, ev, I, sigma)
+        with TRACER.span('convolution', protocol=self.protocol, aggregate=True):
+            for idx in range(len(self.confs)):
+                y_ = np.zeros(x.shape)
+                for ev, I in impulses[idx]:
+                    y_ += Graph.gaussian(x+shift, ev, I, sigma)
 
-            if save: Graph.damp_graph(
-                        fname = os.path.join(os.getcwd(), self.confs[idx].folder, fname), 
-                        x = x, y = y_
-                    )
+                if save: Graph.damp_graph(
+                            fname = os.path.join(os.getcwd(), conf_folder(self.confs[idx].number, create=True), fname), 
+                            x = x, y = y_
+                        )
 
-            y += self.pop[idx] * y_
+                y += self.pop[idx] * y_
 
         return y
 
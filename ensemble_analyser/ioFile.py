@@ -1,8 +1,44 @@
-from ensemble_analyser.IOsystem import _parse_xyz_str
-from ensemble_analyser.conformer import Conformer
+from ensemble_analyser.conformer import Conformer, Ensemble
 
+from ase.data import chemical_symbols
+import numpy as np
+import subprocess
+import itertools
+import shutil
+import gzip
+import mmap
 import os
 
+
+# bytes scanned at once for the newlines, and frames parsed at once
+WINDOW = 1 << 26
+CHUNK = 4096
+
+# compression of the snapshots of the ensemble (None, gz or zst), set from the command line
+SNAPSHOT_COMPRESSION = None
+COMPRESSED = ('.gz', '.zst')
+
+
+def open_file(fname : str, mode : str = 'rt'):
+    """
+    Open a file, compressed or decompressed transparently if it ends with .gz (gzip) or .zst (zstandard)
+
+    fname | str : filename
+    mode | str : opening mode
+
+    return | file object
+    """
+    if fname.endswith('.gz'):
+        return gzip.open(fname, mode, compresslevel=6)
+    if fname.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise IOError(f'{fname} is compressed with zstandard: install the zstandard package (pip install zstandard)')
+        return zstandard.open(fname, mode)
+    return open(fname, mode)
+
+
 def convert_file(file) -> str:
     """
     Convert the input file into xyz multigeometry XYZ file.
@@ -12,15 +48,358 @@ def convert_file(file) -> str:
 
     return | str : input converted filename
     """
+    if not shutil.which('obabel'):
+        raise IOError(f'{file} is not a format read natively (XYZ, SDF, MOL2, PDB) and OpenBabel (obabel) is not available to convert it')
     output = '_'.join(file.split('.')[:-1])+'.xyz'
-    os.system(f'obabel {file} -O{output}')
+    subprocess.run(['obabel', file, f'-O{output}'], check=True, capture_output=True)
     return output
 
 
+def _element(label : str) -> str:
+    """
+    Element from an atom label or type (e.g. CA, C.ar, Cl1, 1HB)
+
+    label | str : label
+
+    return | str : element symbol
+    """
+    label = label.strip().split('.')[0].lstrip('0123456789')
+    symbol = ''.join(itertools.takewhile(str.isalpha, label))
+    return symbol[:2].capitalize() if symbol[:2].capitalize() in chemical_symbols else symbol[:1].upper()
+
+
+def iter_sdf(file : str):
+    """
+    Read lazily a multi-molecule SDF (or MOL) file, V2000 and V3000
+
+    file | str : SDF filename
+
+    return | generator : (atoms, geometry, info) of each molecule. info holds the title, the data fields and, if any
+                         formal charge is defined, the total charge
+    """
+    # V2000 charge codes of the atom block
+    codes = {1 : 3, 2 : 2, 3 : 1, 5 : -1, 6 : -2, 7 : -3}
+
+    with open_file(file) as f:
+        while True:
+            # header: title, program and comment lines
+            title, program, _ = f.readline(), f.readline(), f.readline()
+            if not program:
+                # end of file (or trailing empty lines)
+                return
+            counts = f.readline()
+
+            atoms, geom, charges, chg = [], [], [], None
+            if 'V3000' in counts:
+                for line in f:
+                    if line.startswith('M  END'):
+                        break
+                    if line.startswith('M  V30 BEGIN ATOM'):
+                        for line in f:
+                            if line.startswith('M  V30 END ATOM'):
+                                break
+                            _, _, _, a, x, y, z, *rest = line.split()
+                            atoms.append(_element(a))
+                            geom.append((float(x), float(y), float(z)))
+                            charges += [int(i.split('=')[1]) for i in rest if i.startswith('CHG=')]
+            else:
+                n_atoms = int(counts[0:3])
+                for _ in range(n_atoms):
+                    line = f.readline()
+                    geom.append((float(line[0:10]), float(line[10:20]), float(line[20:30])))
+                    atoms.append(_element(line[31:34]))
+                    code = int(line[36:39]) if line[36:39].strip() else 0
+                    charges.append(codes.get(code, 0))
+                for line in f:
+                    if line.startswith('M  END'):
+                        break
+                    if line.startswith('M  CHG'):
+                        # the property block supersedes the charges of the atom block
+                        chg = (chg or []) + [int(i) for i in line.split()[4::2]]
+
+            info = {'title' : title.strip()}
+            if chg is not None or any(charges):
+                info['charge'] = sum(chg if chg is not None else charges)
+
+            # data fields, up to the end of the molecule
+            field = None
+            for line in f:
+                if line.startswith('$$$$'):
+                    break
+                if line.startswith('>'):
+                    field = line[line.find('<')+1:line.rfind('>')] if '<' in line else line[1:].strip()
+                    info[field] = ''
+                elif field is not None and line.strip():
+                    info[field] = (info[field] + '\n' + line.strip()).strip()
+
+            yield np.array(atoms), np.array(geom, dtype=float), info
+
+
+def iter_mol2(file : str):
+    """
+    Read lazily a multi-molecule MOL2 file
+
+    file | str : MOL2 filename
+
+    return | generator : (atoms, geometry, info) of each molecule. info holds the name and the total charge, as the
+                         rounded sum of the partial charges (if any is defined: a NO_CHARGES file can pad the column with zeros)
+    """
+    molecule = None
+
+    def pack(mol):
+        info = {'title' : mol['name']}
+        # lines of the MOLECULE record after the name: counts, molecule type, charge type
+        charge_type = mol['header'][2].strip().upper() if len(mol['header']) > 2 else ''
+        if charge_type != 'NO_CHARGES' and any(mol['charges']):
+            info['charge'] = int(round(sum(mol['charges'])))
+        return np.array(mol['atoms']), np.array(mol['geom'], dtype=float), info
+
+    with open_file(file) as f:
+        section = None
+        for line in f:
+            if line.startswith('@<TRIPOS>'):
+                section = line.strip()[9:]
+                if section == 'MOLECULE':
+                    if molecule:
+                        yield pack(molecule)
+                    molecule = {'name' : f.readline().strip(), 'header' : [], 'atoms' : [], 'geom' : [], 'charges' : []}
+                continue
+            if section == 'MOLECULE':
+                molecule['header'].append(line)
+            elif section == 'ATOM' and line.strip():
+                _, name, x, y, z, kind, *rest = line.split()
+                molecule['atoms'].append(_element(kind))
+                molecule['geom'].append((float(x), float(y), float(z)))
+                if len(rest) >= 3:
+                    molecule['charges'].append(float(rest[2]))
+
+    if molecule:
+        yield pack(molecule)
+
+
+def iter_pdb(file : str):
+    """
+    Read lazily a multi-model PDB file
+
+    file | str : PDB filename
+
+    return | generator : (atoms, geometry, info) of each model. info holds the model number and, if any formal charge
+                         is defined, the total charge
+    """
+    def pack(atoms, geom, charges, model):
+        info = {'title' : f'MODEL {model}' if model is not None else ''}
+        if any(charges):
+            info['charge'] = sum(charges)
+        return np.array(atoms), np.array(geom, dtype=float), info
+
+    atoms, geom, charges, model = [], [], [], None
+    with open_file(file) as f:
+        for line in f:
+            record = line[:6].strip()
+            if record == 'MODEL':
+                model = int(line.split()[1]) if len(line.split()) > 1 else None
+            elif record in ('ATOM', 'HETATM'):
+                geom.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+                # without the element column, it is right-justified in the first two characters of the atom name
+                atoms.append(_element(line[76:78]) if line[76:78].strip() else _element(line[12:14]))
+                charge = line[78:80].strip()
+                charges.append(int(charge[-1] + charge[:-1]) if charge[:-1].isdigit() and charge[-1] in '+-' else 0)
+            elif record in ('ENDMDL', 'END') and atoms:
+                yield pack(atoms, geom, charges, model)
+                atoms, geom, charges, model = [], [], [], None
+
+    if atoms:
+        yield pack(atoms, geom, charges, model)
+
+
+# native readers of the ensemble files, by extension
+READERS = {
+    '.sdf' : iter_sdf,
+    '.sd' : iter_sdf,
+    '.mol' : iter_sdf,
+    '.mol2' : iter_mol2,
+    '.pdb' : iter_pdb,
+}
+
+
+def xyz_frames(buf):
+    """
+    Index the frames of a multi-geometry XYZ file in a single pass, scanning the newlines WINDOW bytes at a time.
+    Each frame can have its own number of atoms
+
+    buf | np.array : bytes of the file (uint8, e.g. over a memory map)
+
+    return | generator : (number of atoms, start, end) of the atom lines of each frame
+    """
+    size = len(buf)
+    nl, k, scanned = np.empty(0, dtype=np.int64), 0, 0
+
+    def ensure(n):
+        # at least n newlines after the current one
+        nonlocal nl, k, scanned
+        while len(nl) - k < n and scanned < size:
+            stop = min(scanned + WINDOW, size)
+            found = scanned + np.flatnonzero(buf[scanned:stop] == 10)
+            if stop == size and buf[-1] != 10:
+                # last line without newline
+                found = np.append(found, size)
+            nl, k, scanned = np.concatenate([nl[k:], found]), 0, stop
+        return len(nl) - k >= n
+
+    pos = 0
+    while ensure(1):
+        header = buf[pos:nl[k]].tobytes().strip()
+        if not header:
+            pos, k = nl[k] + 1, k + 1
+            continue
+
+        try:
+            n_atoms = int(header)
+        except ValueError:
+            raise ValueError(f'invalid number of atoms {header.decode(errors="replace")!r} at byte {pos}') from None
+        if not ensure(n_atoms + 2):
+            raise IOError(f'Truncated XYZ frame at byte {pos}: {n_atoms} atoms expected')
+        yield n_atoms, nl[k+1] + 1, nl[k+1+n_atoms]
+        pos, k = nl[k+1+n_atoms] + 1, k + n_atoms + 2
+
+
+def parse_xyz_frames(buf, frames, first : int = 1) -> tuple:
+    """
+    Parse at once the atom lines of many frames with the same number of atoms, into arrays independent of the buffer
+
+    buf | np.array : bytes of the file
+    frames | list : (number of atoms, start, end) of each frame
+    first | int : number of the first frame in the file, to report a malformed line
+
+    return | tuple(np.array, np.array) : atoms (frames, N) and geometries (frames, N, 3)
+    """
+    n_atoms = frames[0][0]
+    tokens = b'\n'.join(buf[s:e].tobytes() for _, s, e in frames).split()
+
+    if len(tokens) != len(frames) * n_atoms * 4:
+        # additional columns: only the first four of each line are read
+        tokens = [t for _, s, e in frames for line in buf[s:e].tobytes().splitlines() for t in line.split()[:4]]
+    if len(tokens) != len(frames) * n_atoms * 4:
+        raise ValueError(f'frames {first}-{first + len(frames) - 1}: atom lines with less than four columns')
+
+    atoms = np.array(tokens[::4]).astype(str).reshape(len(frames), n_atoms)
+    del tokens[::4]
+    try:
+        geoms = np.array(tokens, dtype=float).reshape(len(frames), n_atoms, 3)
+    except ValueError:
+        bad = next(idx for idx, t in enumerate(tokens) if not _is_float(t))
+        raise ValueError(f'frame {first + bad // (3*n_atoms)}, atom {bad % (3*n_atoms) // 3 + 1}: invalid coordinate {tokens[bad].decode(errors="replace")!r}') from None
+    return atoms, geoms
+
+
+def _is_float(token : bytes) -> bool:
+    try:
+        float(token)
+    except ValueError:
+        return False
+    return True
+
+
+def _xyz_chunks(buf : np.array):
+    """
+    Parse the frames of a multi-geometry XYZ buffer, up to CHUNK frames with the same number of atoms at once
+
+    buf | np.array : content of the file, as uint8
+
+    return | generator : (atoms, geometry) of each frame
+    """
+    chunk, first = [], 1
+    for frame in xyz_frames(buf):
+        if chunk and (frame[0] != chunk[0][0] or len(chunk) == CHUNK):
+            yield from zip(*parse_xyz_frames(buf, chunk, first))
+            first += len(chunk)
+            chunk = []
+        chunk.append(frame)
+    if chunk:
+        yield from zip(*parse_xyz_frames(buf, chunk, first))
+
+
+def iter_xyz(file : str):
+    """
+    Read lazily a multi-geometry XYZ file through a memory map, parsing up to CHUNK frames at once.
+    A compressed file (.gz, .zst) cannot be mapped and is decompressed in memory
+
+    file | str : XYZ filename
+
+    return | generator : (atoms, geometry) of each frame
+    """
+    if os.path.getsize(file) == 0:
+        return
+
+    if file.endswith(COMPRESSED):
+        with open_file(file, 'rb') as f:
+            data = f.read()
+        try:
+            yield from _xyz_chunks(np.frombuffer(data, dtype=np.uint8))
+        except (ValueError, IOError) as e:
+            raise type(e)(f'{file}: {e}') from None
+        return
+
+    error = None
+    with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        buf = np.frombuffer(mm, dtype=np.uint8)
+        try:
+            yield from _xyz_chunks(buf)
+        except (ValueError, IOError) as e:
+            # only the message is kept: the traceback would hold the buffer, and the memory map could not be closed
+            error = type(e), f'{file}: {e}'
+        finally:
+            del buf
+        if error:
+            raise error[0](error[1])
+
+
+def iter_ensemble(file, charge, multiplicity, raw : bool = False, log = None):
+    """
+    Read lazily the initial ensemble. Conformers with the same atoms share the same Ensemble storage
+    XYZ, SDF, MOL2 and PDB files, also compressed (.gz, .zst), are read natively; other formats are converted with OBABEL, if available.
+    The charge defined in the file, if any, is kept together with the other information on the molecule (title, data fields)
+
+    file | str : initial ensemble file
+    charge | int : charge of the molecule
+    multiplicity | int : multiplicity of the molecule
+    raw | bool : do not check that the conformer folders are free
+    log : logger instance, to report a charge of the file different from the given one
+
+    return | generator : Conformer instances
+    """
+
+    name, ext = os.path.splitext(file)
+    if ext in COMPRESSED:
+        ext = os.path.splitext(name)[1]
+    ext = ext.lower()
+    if ext in READERS:
+        frames = READERS[ext](file)
+    else:
+        if ext != '.xyz':
+            file = convert_file(file)
+        frames = ((atoms, geom, {}) for atoms, geom in iter_xyz(file))
+
+    stores = {}
+    for counter, (atoms, geom, info) in enumerate(frames, 1):
+        key = atoms.tobytes()
+        if key not in stores:
+            stores[key] = Ensemble(atoms)
+
+        chg = info.pop('charge', charge)
+        if chg != charge and log:
+            log.warning(f'CONF_{counter}: charge {chg} read from {file}, instead of {charge}')
+
+        conf = Conformer(counter, geom=geom, atoms=atoms, charge=chg, mult=multiplicity, raw=raw, ensemble=stores[key])
+        if any(info.values()):
+            conf.metadata = info
+        yield conf
+
+
 def read_ensemble(file, charge, multiplicity, log) -> list:
     """
     Read the initial ensemble and return the ensemble list
-    Not only XYZ file is supported. OBABEL is required
+    XYZ, SDF, MOL2 and PDB files are read natively; other formats require OBABEL
     
     file | str : initial ensemble file 
     charge | int : charge of the molecule
@@ -30,32 +409,37 @@ def read_ensemble(file, charge, multiplicity, log) -> list:
     return | list : whole ensemble list as Conformer instances
     """
 
-    confs = []
+    confs = list(iter_ensemble(file, charge, multiplicity, log=log))
+    log.debug(f'Read {len(confs)} conformers from {file}')
 
-    if not file.endswith('.xyz'):
-        file = convert_file(file)
+    return confs
 
-    with open(file) as f:
-        fl = f.readlines()
 
-    n_atoms = int(fl[0])
-    old_idx = 0
-    counter = 1
-    for i in range(0, len(fl)+1, n_atoms+2):
-        if i==old_idx: continue
-        atoms, geom = _parse_xyz_str(fl[old_idx:i])
-        confs.append(Conformer(counter, geom=geom, atoms=atoms, charge=charge, mult=multiplicity))
-        old_idx = i
-        counter += 1
+def save_snapshot(output, confs, log, compression : str = None) -> str:
+    """
+    Write the active conformers in a multi-geometry XYZ file, one conformer at a time
 
-    return confs
+    output | str : XYZ filename
+    confs | list : whole ensemble list as Conformer instances
+    log : logger instance
+    compression | str : gz or zst to compress the file, appending the extension to the filename. Default SNAPSHOT_COMPRESSION
 
+    return | str : filename written
+    """
 
-def save_snapshot(output, confs, log):
+    compression = compression or SNAPSHOT_COMPRESSION
+    if compression:
+        output = f'{output}.{compression}'
 
     log.debug('Saving snapshot of the ensemble')
-    with open(output, 'w') as f:
-        f.write('\n'.join([f'{i.write_xyz().strip()}' for i in confs]).strip())
-    return None
-
-
+    with open_file(output, 'wt') as f:
+        # the inactive conformers leave an empty line, but neither at the beginning nor at the end of the file
+        blank = None
+        for conf in confs:
+            txt = conf.write_xyz()
+            if blank is not None:
+                blank += 1
+            if txt:
+                f.write('\n'*(blank or 0) + txt)
+                blank = 0
+    return output
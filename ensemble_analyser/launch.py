@@ -1,100 +1,183 @@
 
 
-from ensemble_analyser.conformer import Conformer
 from ensemble_analyser.ioFile import read_ensemble, save_snapshot
+from ensemble_analyser import ioFile
 from ensemble_analyser.logger import create_log, ordinal
 from ensemble_analyser.parser_arguments import parser_arguments
-from ensemble_analyser.parser_parameter import get_conf_parameters
+from ensemble_analyser.parser_parameter import get_conf_parameters, classify_failure
 from ensemble_analyser.IOsystem import SerialiseEncoder
 from ensemble_analyser.protocol import Protocol, load_protocol
-from ensemble_analyser.pruning import calculate_rel_energies, check_ensemble
+from ensemble_analyser.pruning import calculate_rel_energies, check_ensemble, dedup_ensemble
+from ensemble_analyser.scheduler import schedule
+from ensemble_analyser.executor import Job, Failure, get_executor
+from ensemble_analyser.pipeline import Pipeline
+from ensemble_analyser.monitor import EnergyWindow
+from ensemble_analyser.tracer import TRACER, profiled
+from ensemble_analyser.checkpoint import Checkpoint
 from ensemble_analyser.grapher import Graph
+from ensemble_analyser.archive import pack_outputs
 
-import ase
-import time, json
+import json
 import datetime
 from tabulate import tabulate
 import os
 
 
 MAX_TRY = 5 
+BACKOFF = 10
+MAX_BACKOFF = 600
 
-def launch(idx, conf, protocol, cpu, log, temp, ensemble, try_num : int = 1) -> None:
+
+def handle_failure(job, failure, executor, checkpoint, log) -> None:
+    """
+    Deal with a failed calculation without stopping the others:
+    - aborted : optimization stopped over the energy window. The conformer is deactivated
+    - fatal : error in the input, that would be the same for every conformer. Exiting
+    - scf : re-run at the tail of the queue with more robust convergence settings
+    - transient : re-run at the tail of the queue after an increasing delay
+    When the re-runs are exhausted, the conformer is deactivated
+
+    job | Job : failed job
+    failure | Failure : classification of the failure
+    executor | Executor : executor running the calculations
+    checkpoint | Checkpoint : checkpoint of the ensemble
+    log : logger instance
+
+    return None
+    """
+
+    conf, protocol = job.conf, job.protocol
+    if failure.kind == 'aborted':
+        conf.active = False
+        checkpoint.record(conf, protocol.number)
+        margin = f' + margin {executor.window.margin} kcal/mol' if executor.window else ''
+        log.info(f'{failure.message}; window: lowest E of protocol {protocol.number} + thrGMAX {protocol.thrGMAX} kcal/mol{margin}')
+        return None
+
+    if failure.message:
+        log.error(failure.message)
+
+    if failure.kind == 'fatal':
+        executor.shutdown()
+        log.critical(f"\n{'='*20}\nCRITICAL ERROR\n{'='*20}\nThe calculator reported an error in the input during the calculation of CONF_{conf.number} at protocol {protocol.number}.\n{'='*20}\nExiting\n{'='*20}\n")
+        raise RuntimeError('Some sort of error have been encountered during the calculation of the calculator.')
+
+    if job.try_num <= MAX_TRY:
+        delay = min(BACKOFF * 2**(job.try_num-1), MAX_BACKOFF)
+        if failure.kind == 'scf':
+            job.escalate = min(job.escalate+1, 2)
+        log.error(f'ERROR: During calculation of CONF_{conf.number} a {"SCF convergence" if failure.kind == "scf" else "server"} error occur; re-running protocol {protocol.number} on the same conformer for the {ordinal(job.try_num)} time in {delay} sec')
+        job.try_num += 1
+        executor.submit(job, delay=delay)
+        return None
+
+    conf.active = False
+    checkpoint.record(conf, protocol.number)
+    log.error(f"{'='*20}\nERROR\n{'='*20}\nMax number of re-run ({MAX_TRY}) executed for CONF_{conf.number}. The conformer is deactivated\n{'='*20}")
+
+    return None
+
+
+def launch(queue, protocol, executor, temp, ensemble, log, checkpoint, pipeline = None, following = None, ready = ()) -> None:
     """
-    Run the calculation for each conformer
+    Run the calculation for each conformer of the queue through the executor.
+    Outputs are parsed as soon as each calculation is completed; the checkpoint is updated after each of them.
     
-    idx | int : index of the calculation
-    conf | Conformer : conformer instance
+    queue | list : conformers to be calculated
     protocol | Protocol : protocol instance
-    cpu | int : number of cpu to allocate
-    log : logger instance
+    executor | Executor : executor running the calculations
     temp | float : temperature [K]
     ensemble | list : whole ensemble list
+    log : logger instance
+    checkpoint | Checkpoint : checkpoint of the ensemble
+    pipeline | Pipeline : speculative execution of the following protocol step. If None, no speculation
+    following | Protocol : following protocol step
+    ready | list : (Job, elapsed time or Failure) already completed to be parsed
 
     return None
     """
 
-    log.info(f'{idx}. Running {ordinal(int(protocol.number))} PROTOCOL -> CONF{conf.number}')
-    try:
-        st = time.perf_counter()
+    for idx, conf in enumerate(queue, 1):
+        executor.submit(Job(idx, conf, protocol))
 
-        calculator, label = protocol.get_calculator(cpu=cpu, charge=conf.charge, mult=conf.mult)
-        atm = conf.get_ase_atoms(calculator)
-        try:
-            atm.get_potential_energy()
-        except ase.calculators.calculator.PropertyNotImplementedError:
-            pass
+    completed = list(ready)
+    while completed or executor.pending_for(protocol.number):
+        if not completed:
+            completed = executor.poll()
 
-        end = time.perf_counter()
+        harvested = 0
+        for job, elapsed in completed:
+            conf = job.conf
 
-        os.rename(f'{label}.out', f'{conf.folder}/protocol_{protocol.number}.out')
-        if protocol.freq: 
-            os.rename(f'{label}.hess', f'{conf.folder}/protocol_{protocol.number}.hess')
-        os.remove(f'{label}.gbw')
+            if job.discard:
+                Pipeline.discard(job)
+                continue
 
+            if str(job.protocol.number) != str(protocol.number):
+                pipeline.park(job, elapsed)
+                continue
 
-    except ase.calculators.calculator.CalculationFailed:
-        with open(f'{label}.out') as f:
-            fl = f.read()
-        log.error('\n'.join(fl.splitlines()[-6:-3]))
-        log.critical(f"\n{'='*20}\nCRITICAL ERROR\n{'='*20}\nSome sort of error have been encountered during the calculation of the calculator.\n{'='*20}\nExiting\n{'='*20}\n")
-        raise RuntimeError('Some sort of error have been encountered during the calculation of the calculator.')
+            failure = elapsed if isinstance(elapsed, Failure) else None
+            if not failure:
+                with TRACER.span('parse output', conf, protocol):
+                    if not get_conf_parameters(conf, protocol.number, protocol, elapsed, temp, log):
+                        failure = Failure(classify_failure(os.path.join(conf.folder, f'protocol_{protocol.number}.out'), protocol.calculator))
+
+            if failure:
+                handle_failure(job, failure, executor, checkpoint, log)
+                continue
 
+            checkpoint.record(conf, protocol.number, geometry=protocol.opt)
+            if executor.window:
+                executor.window.update(conf, protocol.number)
+            harvested += 1
 
-    if not get_conf_parameters(conf, protocol.number, protocol, end-st, temp, log):
-        if try_num <= MAX_TRY: 
-            log.error(f'ERROR: During calculation of CONF_{conf.number} a server error occur and the energy could not be parsed; re-running protocol {protocol.number} on the same conformer for the {ordinal(try_num)} time')
-            time.sleep(10)
-            launch(idx, conf, protocol, cpu, log, temp, ensemble, try_num = try_num +1)
-        else:
-            log.critical(f"{'='*20}\nCRITICAL ERROR\n{'='*20}\nMax number of re-run ({MAX_TRY}) executed for CONF_{conf.number}.{'='*20}\nExiting\n{'='*20}")
-            raise RuntimeError(f'Max number of re-run ({MAX_TRY}) executed for CONF_{conf.number}. Exiting')
+        completed = []
+        if pipeline and following and harvested:
+            pipeline.speculate(ensemble, protocol, following)
 
-    json.dump({i.number: i.__dict__ for i in ensemble}, open('checkpoint.json', 'w'), indent=4, cls=SerialiseEncoder)
+    return None
 
 
 
-def run_protocol(conformers, p, temperature, cpu, log) -> None:
+def run_protocol(conformers, p, temperature, executor, log, checkpoint, protocols : list = None, pipeline = None) -> None:
     """
     Run the protocol for each conformer
     
     conformers | list : whole ensemble list
     p | Protocol : protocol information
     temperature | float : temperature [K]
-    cpu | int : cpu to allocate 
+    executor | Executor : executor running the calculations
     log : logger instance
+    checkpoint | Checkpoint : checkpoint of the ensemble
+    protocols | list : whole protocol steps, used to predict the runtimes from the previous steps
+    pipeline | Pipeline : speculative execution of the following protocol step. If None, no speculation
 
     return None
     """
 
     log.info(f'STARTING PROTOCOL {p.number}')
     log.info(f'\nActive conformers for this phase: {len([i for i in conformers if i.active])}\n')
-    count = 1
-    for i in conformers:
-        if not i.active: continue
-        if i.energies.get(str(p.number)): continue
-        launch(count, i, p, cpu, log, temperature, conformers)
-        count += 1
+
+    ready, running = pipeline.reconcile(p) if pipeline else ([], set())
+    following = None
+    if pipeline and protocols:
+        following = next((i for i in protocols if int(i.number) > int(p.number)), None)
+
+    if executor.window:
+        for conf in conformers:
+            executor.window.update(conf, p.number)
+
+    # the speculative jobs of this step, completed or still running, are not submitted again
+    speculated = running | {job.conf.number for job, _ in ready}
+    queue = [i for i in conformers if i.active and not i.energies.get(str(p.number)) and i.number not in speculated]
+    if executor.workers > 1:
+        queue = schedule(queue, p, protocols or [p], conformers, executor.workers, log)
+    launch(queue, p, executor, temperature, conformers, log, checkpoint, pipeline=pipeline, following=following, ready=ready)
+
+    if not any(i.active for i in conformers):
+        log.critical(f"{'='*20}\nCRITICAL ERROR\n{'='*20}\nNo conformer completed the protocol {p.number}.\n{'='*20}\nExiting\n{'='*20}")
+        raise RuntimeError(f'No conformer completed the protocol {p.number}. Exiting')
 
     conformers = sorted(conformers)
 
@@ -105,11 +188,14 @@ def run_protocol(conformers, p, temperature, cpu, log) -> None:
     log.info('\nTotal elapsed time: ' + str(datetime.timedelta(seconds = sum([i._last_energy['time'] for i in conformers if i.active]))))
 
     log.debug('Start Pruning')
-    conformers = check_ensemble(conformers, p, log)
+    # with the pipeline the CPUs are busy with the speculative jobs
+    with TRACER.span('pruning', protocol=p):
+        conformers = check_ensemble(conformers, p, log, processes=1 if pipeline else executor.cpu*executor.workers)
     save_snapshot(f'ensemble_after_{p.number}.xyz', conformers, log)
 
 
     create_summary('Summary After Pruning', conformers, log)
+    checkpoint.compact()
 
 
     log.info(f'{"="*15}\nEND PROTOCOL {p.number}\n{"="*15}\n\n')
@@ -156,16 +242,19 @@ def create_summary(title, conformers, log):
 
 
 
-def start_calculation(conformers, protocol, cpu:int, temperature: float, start_from: int, log) -> None:
+def start_calculation(conformers, protocol, executor, temperature: float, start_from: int, log, pipeline : bool = False, abort_margin : float = None, archive : bool = False) -> None:
     """
     Main calculation loop
 
     conformers | list : whole ensemble list
     protocol | list : whole protocol steps
-    cpu | int : cpu allocated
+    executor | Executor : executor running the calculations
     temperature | float : temperature [K]
     start_from | int : index of the last protocol executed
     log : logger instance
+    pipeline | bool : start the following protocol step on the safe conformers before the current one ends
+    abort_margin | float : abort the optimizations whose energy lies over thrGMAX plus this margin [kcal/mol]. If None, no abort
+    archive | bool : pack the outputs of each protocol step into a single archive, once completed
 
     return None
     """
@@ -174,12 +263,26 @@ def start_calculation(conformers, protocol, cpu:int, temperature: float, start_f
             conformers = check_ensemble(conformers, protocol[start_from], log)
             create_summary('Summary', conformers, log)
 
+    if pipeline and executor.workers == 1:
+        log.warning('Pipelined execution requires more than one worker: running one protocol step at a time')
+        pipeline = False
+    pipeline = Pipeline(executor, log) if pipeline else None
+    if abort_margin is not None:
+        executor.window = EnergyWindow(abort_margin)
+
+    checkpoint = Checkpoint(conformers)
+    checkpoint.compact()
+
     for p in protocol[start_from:]:
         with open('last_protocol', 'w') as f:
             f.write(str(p.number))
-        run_protocol(conformers, p, temperature, cpu, log)
+        with TRACER.span('protocol', protocol=p):
+            run_protocol(conformers, p, temperature, executor, log, checkpoint, protocols=protocol, pipeline=pipeline)
         if p.graph: 
-            Graph(conformers, p, log, temperature)
+            with TRACER.span('spectra', protocol=p):
+                Graph(conformers, p, log, temperature)
+        if archive:
+            pack_outputs(conformers, p, log)
 
     save_snapshot('final_ensemble.xyz', conformers, log)
     log.info(f'{"="*15}\nCALCULATIONS ENDED\n{"="*15}\n\n')
@@ -197,8 +300,7 @@ def restart() -> tuple:
     
     return | list, list, int
     """
-    confs = json.load(open('checkpoint.json'))
-    ensemble = [Conformer.load_raw(confs[i]) for i in confs]
+    ensemble = Checkpoint.load()
 
     p = json.load(open('protocol_dump.json'))
     protocol = [Protocol(**p[i]) for i in p]
@@ -210,13 +312,14 @@ def restart() -> tuple:
 
 
 
-def create_protocol(p, log) -> list:
+def create_protocol(p, log, calculator : str = 'orca') -> list:
     """
     Create the steps for the protocol to be executed
 
     p | dict : JSON read file of the protocol
     thrs | dict : JSON read file of the thresholds
     log : logger instance
+    calculator | str : calculator of the steps not defining their own
 
     return | list : protocol steps
     """
@@ -247,7 +350,7 @@ def create_protocol(p, log) -> list:
         if not graph and d.get('freq'): last_prot_with_freq = int(idx)
 
         protocol.append(Protocol(
-            number=idx, **d
+            number=idx, **{'calculator' : calculator, **d}
             ))
 
     log.info('\n'.join((f"{i.number}: {str(i)} - {i.calculation_level}\n {i.thr}" for i in protocol)) + '\n')
@@ -270,6 +373,15 @@ def main():
             'output' : args.output,
             'cpu' : args.cpu,
             'temperature' : args.temperature,
+            'workers' : args.workers,
+            'executor' : args.executor,
+            'batch_options' : args.batch_options,
+            'pipeline' : args.pipeline,
+            'scratch' : args.scratch,
+            'reuse_guess' : args.reuse_guess,
+            'abort_margin' : args.abort_margin,
+            'compress_snapshots' : args.compress_snapshots,
+            'archive' : args.archive,
         }
         json.dump(settings, open('settings.json', 'w'), indent=4)
     
@@ -277,6 +389,15 @@ def main():
     output = settings.get('output', args.output) if not args.restart else '.'.join(settings.get('output', args.output).split('.')[:-1])+'_restart.out'
     cpu = settings.get('cpu', args.cpu)
     temperature = settings.get('temperature', args.temperature)
+    workers = settings.get('workers', args.workers)
+    executor = settings.get('executor', args.executor)
+    batch_options = settings.get('batch_options', args.batch_options)
+    pipeline = settings.get('pipeline', args.pipeline)
+    scratch = settings.get('scratch', args.scratch)
+    reuse_guess = settings.get('reuse_guess', args.reuse_guess)
+    abort_margin = settings.get('abort_margin', args.abort_margin)
+    ioFile.SNAPSHOT_COMPRESSION = settings.get('compress_snapshots', args.compress_snapshots)
+    archive = settings.get('archive', args.archive)
 
     # initiate the log
     log = create_log(output)
@@ -286,21 +407,35 @@ def main():
         conformers, protocol, start_from = restart()
 
     else:
-        protocol = create_protocol(load_protocol(args.protocol), log)
+        protocol = create_protocol(load_protocol(args.protocol), log, args.calculator)
         start_from = protocol[0].number
         json.dump({i.number: i.__dict__ for i in protocol}, open('protocol_dump.json', 'w'), indent=4, cls=SerialiseEncoder)
         conformers = read_ensemble(args.ensemble, args.charge, args.multiplicity, log)
+        if args.dedup_input:
+            conformers = dedup_ensemble(conformers, args.dedup_input, log)
+
+    if args.trace:
+        TRACER.enable()
 
     # start the loop
-    start_calculation(
-        conformers = conformers,
-        protocol = protocol,
-        cpu = cpu,
-
-        temperature= temperature,
-        start_from= int(start_from),
-        log = log,
-    )
+    try:
+        with profiled(args.profile, log, 'profile.prof'):
+            start_calculation(
+                conformers = conformers,
+                protocol = protocol,
+                executor = get_executor(executor, cpu, workers, log, batch_options, scratch, reuse_guess),
+
+                temperature= temperature,
+                start_from= int(start_from),
+                log = log,
+                pipeline = pipeline,
+                abort_margin = abort_margin,
+                archive = archive,
+            )
+    finally:
+        if args.trace:
+            TRACER.summary(log)
+            TRACER.dump(args.trace)
 
 
 
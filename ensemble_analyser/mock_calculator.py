@@ -0,0 +1,236 @@
+from ensemble_analyser.regex_parsing import regex_parsing
+from ensemble_analyser.parser_parameter import EH_TO_KCAL
+
+from ase.calculators.calculator import Calculator, CalculationFailed, all_changes
+from ase.data import covalent_radii, vdw_radii, atomic_masses
+from ase.units import Hartree
+import numpy as np
+import itertools
+import random
+import time
+import zlib
+import os
+
+
+# Behaviour of the mock calculator, set through the environment so that it reaches the batch tasks as well
+LATENCY = float(os.getenv('MOCK_LATENCY', 0))            # mean duration of a calculation [sec]
+FAILURE_RATE = float(os.getenv('MOCK_FAILURE_RATE', 0))  # probability of a (SCF) failure
+NOISE = float(os.getenv('MOCK_NOISE', 0.2))              # deviation between levels of theory [kcal/mol]
+OPT_CYCLES = int(os.getenv('MOCK_OPT_CYCLES', 30))       # maximum number of optimization cycles
+STATES = int(os.getenv('MOCK_STATES', 10))               # number of excited states printed
+SEED = os.getenv('MOCK_SEED')                            # seed for latency and failures. Reproducible only for serial runs
+
+# Force field [kcal/mol, Å]
+K_BOND = 300
+K_ANGLE = 50
+EPS_LJ = 0.1
+MAX_STEP = 0.1
+
+_counter = itertools.count()
+
+
+def topology(numbers, geom) -> tuple:
+    """
+    Bonded (1-2) and angle (1-3) pairs from the covalent radii
+
+    numbers | np.array : atomic numbers
+    geom | np.array : geometry [Å]
+
+    return | tuple(np.array, np.array) : boolean matrices of the 1-2 and 1-3 pairs
+    """
+    r = np.linalg.norm(geom[:, None] - geom[None], axis=-1)
+    cov = covalent_radii[numbers]
+    bond = (r < 1.2*(cov[:, None] + cov[None])) & ~np.eye(len(numbers), dtype=bool)
+    angle = ((bond.astype(int) @ bond.astype(int)) > 0) & ~bond & ~np.eye(len(numbers), dtype=bool)
+    return bond, angle
+
+
+def force_field(numbers, geom, ref) -> tuple:
+    """
+    Cheap force field: harmonic 1-2 and 1-3 distances around the reference geometry, Lennard-Jones on the other pairs
+
+    numbers | np.array : atomic numbers
+    geom | np.array : geometry [Å]
+    ref | np.array : reference geometry, defining the topology and the equilibrium distances [Å]
+
+    return | tuple(float, np.array) : energy [kcal/mol] and gradient [kcal/mol/Å]
+    """
+    bond, angle = topology(numbers, ref)
+    r0 = np.linalg.norm(ref[:, None] - ref[None], axis=-1)
+
+    diff = geom[:, None] - geom[None]
+    r = np.linalg.norm(diff, axis=-1)
+    np.fill_diagonal(r, 1)
+
+    k = np.where(bond, K_BOND, 0) + np.where(angle, K_ANGLE, 0)
+    vdw = np.nan_to_num(vdw_radii[numbers], nan=2.)
+    rmin = vdw[:, None] + vdw[None]
+    lj = ~bond & ~angle & ~np.eye(len(numbers), dtype=bool)
+    x = np.where(lj, rmin/r, 0)
+
+    # each pair is counted twice
+    energy = 0.5*np.sum(k*(r-r0)**2) + 0.5*np.sum(EPS_LJ*(x**12 - 2*x**6))
+    de_dr = 2*k*(r-r0) + np.where(lj, EPS_LJ*(-12*x**12 + 12*x**6)/r, 0)
+    grad = np.sum((de_dr/r)[:, :, None] * diff, axis=1)
+
+    return energy, grad
+
+
+def level_noise(geom, protocol) -> float:
+    """
+    Deterministic shift of the energy for a geometry at a level of theory
+
+    geom | np.array : geometry [Å]
+    protocol | Protocol : protocol instance
+
+    return | float : shift [kcal/mol]
+    """
+    key = np.round(geom, 3).tobytes() + f'{protocol.functional}/{protocol.basis}'.encode()
+    return np.random.default_rng(zlib.crc32(key)).normal(scale=NOISE)
+
+
+
+class MockCalculator(Calculator):
+    """
+    Stand-in of the ORCA calculator for the tests of the workflow: energies come from a cheap force field and the outputs
+    are written in the ORCA format, so that everything downstream (parsing, pruning, graphs) runs unchanged.
+    """
+
+    implemented_properties = ['energy']
+
+    def __init__(self, protocol, charge : int, mult : int, label : str = 'orca'):
+        """
+        protocol | Protocol : protocol instance
+        charge | int : charge of the molecule
+        mult | int : multiplicity of the molecule
+        label | str : label of the calculation
+        """
+        super().__init__(label=label)
+        self.protocol = protocol
+        self.charge = charge
+        self.mult = mult
+        self.rng = random.Random(f'{SEED}:{label}:{protocol.number}:{next(_counter)}' if SEED is not None else None)
+
+    def calculate(self, atoms=None, properties=['energy'], system_changes=all_changes):
+        super().calculate(atoms, properties, system_changes)
+
+        if LATENCY:
+            time.sleep(self.rng.uniform(0, 2*LATENCY))
+
+        out = []
+        if self.rng.random() < FAILURE_RATE:
+            self.write(out + ['', 'SCF NOT CONVERGED AFTER 125 CYCLES', '', 'ORCA finished by error termination in SCF', ''])
+            raise CalculationFailed(f'{self.label} failed')
+
+        numbers, ref = self.atoms.get_atomic_numbers(), self.atoms.get_positions()
+        geom = ref.copy()
+        baseline = -0.5*np.sum(numbers**2.4) + level_noise(ref, self.protocol)/EH_TO_KCAL
+
+        energy, grad = force_field(numbers, geom, ref)
+        if self.protocol.opt:
+            for cycle in range(1, OPT_CYCLES+1):
+                out += self.geometry_block(geom) + self.energy_block(baseline, energy, cycle)
+                if np.max(np.abs(grad)) < 0.5:
+                    break
+                step = -grad * 0.002
+                step *= min(1, MAX_STEP/np.max(np.abs(step)))
+                geom = geom + step
+                energy, grad = force_field(numbers, geom, ref)
+            out += ['', '                    ***        THE OPTIMIZATION HAS CONVERGED     ***', '', '***               (AFTER %d CYCLES)               ***' % cycle, '']
+            self.write_xyz(geom)
+
+        out += self.geometry_block(geom) + self.energy_block(baseline, energy)
+
+        masses = atomic_masses[numbers]
+        com = np.sum(geom*masses[:, None], axis=0)/np.sum(masses)
+        pos = geom-com
+        inertia = np.sum(masses*np.sum(pos**2, axis=1))*np.eye(3) - np.einsum('i,ij,ik->jk', masses, pos, pos)
+        # B = h/(8π²cI) [cm-1], I in amu Å²
+        B = 16.857629/np.clip(np.linalg.eigvalsh(inertia), 1e-3, None)
+        dip = np.sum(((numbers % 3) - 1)[:, None] * 0.1 * (geom-com), axis=0)
+        out += [
+            '', '-'*20, 'Rotational spectrum', '-'*20,
+            'Rotational constants in cm-1: ' + ''.join(f'{i:13.6f}' for i in np.sort(B)[::-1]), '',
+            '-'*20, 'DIPOLE MOMENT', '-'*20,
+            'Total Dipole Moment    : ' + ''.join(f'{i:13.5f}' for i in dip),
+            'Magnitude (a.u.)       : ' + f'{np.linalg.norm(dip):13.5f}', '',
+        ]
+
+        if self.protocol.freq:
+            out += self.frequencies_block(geom)
+        if self.protocol.graph or 'tddft' in self.protocol.add_input.lower():
+            out += self.spectra_block(geom)
+
+        out += ['', '****ORCA TERMINATED NORMALLY****']
+        self.write(out)
+        self.write_properties(baseline + energy/EH_TO_KCAL, geom, np.sort(B)[::-1], dip)
+        open(f'{self.label}.gbw', 'w').close()
+
+        self.results['energy'] = (baseline + energy/EH_TO_KCAL) * Hartree
+
+    def energy_block(self, baseline, energy, cycle=None) -> list:
+        e = baseline + energy/EH_TO_KCAL
+        return (['', f'                         *   GEOMETRY OPTIMIZATION CYCLE {cycle:3d}   *'] if cycle else []) + [
+            '-'*25 + '   ' + '-'*20,
+            f'FINAL SINGLE POINT ENERGY {e:20.12f}',
+            '-'*25 + '   ' + '-'*20,
+        ]
+
+    def geometry_block(self, geom) -> list:
+        return ['', '-'*33, regex_parsing['orca']['s_geom'], '-'*33] + [
+            f'  {s:<2s} {x:14.6f}{y:14.6f}{z:14.6f}' for s, (x, y, z) in zip(self.atoms.get_chemical_symbols(), geom)
+        ] + ['', '-'*28, 'CARTESIAN COORDINATES (A.U.)', '-'*28]
+
+    def frequencies_block(self, geom) -> list:
+        n = 3*len(geom)
+        rng = np.random.default_rng(zlib.crc32(np.round(geom, 3).tobytes()))
+        n_h = int(np.sum(self.atoms.get_atomic_numbers() == 1))
+        freq = np.sort(np.concatenate([rng.uniform(20, 1700, n-6-n_h), rng.uniform(2900, 3200, n_h)]))
+        freq = np.concatenate([np.zeros(6), freq])
+
+        with open(f'{self.label}.hess', 'w') as f:
+            f.write(f'\n$orca_hessian_file\n\n$act_atom\n  0\n\n$vibrational_frequencies\n{n}\n')
+            f.write(''.join(f'{i:5d}   {j:14.6f}\n' for i, j in enumerate(freq)))
+            f.write('\n$end\n')
+
+        self.frequencies = freq
+        return ['', '-'*23, regex_parsing['orca']['s_freq'], '-'*23, '', 'Scaling factor for frequencies =  1.000000000  (already applied!)', ''] + [
+            f'{i:5d}:{j:13.2f} cm**-1' for i, j in enumerate(freq)
+        ] + ['', '', regex_parsing['orca']['e_freq'], 'NORMAL MODES', regex_parsing['orca']['e_freq'], '']
+
+    def spectra_block(self, geom) -> list:
+        rng = np.random.default_rng(zlib.crc32(np.round(geom, 3).tobytes()) + 1)
+        nm = np.sort(rng.uniform(180, 450, STATES))[::-1]
+        fosc = rng.uniform(0, 0.3, STATES)
+        rot = rng.normal(scale=30, size=STATES)
+        return ['', '-'*40, f'{regex_parsing["orca"]["start_spec"]}', '-'*40, '', regex_parsing['orca']['s_UV']] + [
+            f'{i:4d} {1e7/w:10.1f} {w:8.1f} {f:14.9f} {0:10.5f} {0:9.5f} {0:9.5f} {0:9.5f}' for i, (w, f) in enumerate(zip(nm, fosc), 1)
+        ] + ['', '', regex_parsing['orca']['s_ECD']] + [
+            f'{i:4d} {1e7/w:10.1f} {w:8.1f} {r:13.5f} {0:9.5f} {0:9.5f} {0:9.5f}' for i, (w, r) in enumerate(zip(nm, rot), 1)
+        ] + ['', '', regex_parsing['orca']['end_spec'], '']
+
+    def write_xyz(self, geom) -> None:
+        with open(f'{self.label}.xyz', 'w') as f:
+            f.write(f'{len(geom)}\nCoordinates from ORCA-job {os.path.basename(self.label)}\n')
+            f.write(''.join(f'  {s:<2s} {x:14.6f}{y:14.6f}{z:14.6f}\n' for s, (x, y, z) in zip(self.atoms.get_chemical_symbols(), geom)))
+
+    def write_properties(self, energy, geom, B, dip) -> None:
+        sep = '# ' + '-'*59
+        def section(name, lines):
+            return [sep, f'$ {name}', '   description: mock', '   geom. index: 1', '   prop. index: 1'] + [f'       {i}' for i in lines]
+        out = ['-'*61, '-'*23 + ' !PROPERTIES! ' + '-'*24, '-'*61]
+        out += section('Single_Point_Data', [f'FINAL SINGLE POINT ENERGY: {energy:20.12f}'])
+        out += section('Geometry', [f'Number of atoms: {len(geom)}', 'Coordinate units: Bohr', 'Coordinates:', ' '*12 + '0'] + [
+            f'{i:5d} {s:<2s} {x:20.12f}{y:20.12f}{z:20.12f}' for i, (s, (x, y, z)) in enumerate(zip(self.atoms.get_chemical_symbols(), geom/0.529177210903))
+        ])
+        out += section('Dipole_Moment', ['Total Dipole moment:', ' '*12 + '0'] + [f'{i:5d} {j:20.12f}' for i, j in enumerate(dip)] + [f'Magnitude (a.u.) : {np.linalg.norm(dip):20.12f}'])
+        out += section('Rotational_spectrum', ['Rotational constants in cm-1: ' + ''.join(f'{i:20.12f}' for i in B)])
+        if self.protocol.freq:
+            out += section('THERMOCHEMISTRY_Energies', ['Vibrational frequencies:', ' '*12 + '0'] + [f'{i:5d} {j:20.12f}' for i, j in enumerate(self.frequencies)])
+        out += [sep, '$ End']
+        with open(f'{self.label}_property.txt', 'w') as f:
+            f.write('\n'.join(out) + '\n')
+
+    def write(self, lines) -> None:
+        with open(f'{self.label}.out', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
@@ -0,0 +1,170 @@
+from ensemble_analyser.regex_parsing import regex_parsing
+from ensemble_analyser.parser_parameter import EH_TO_KCAL
+
+import threading
+import signal
+import re, os
+
+
+POLL = 5
+
+
+class EnergyWindow:
+    """
+    Lowest electronic energy reached at each protocol step, shared between the main thread (the only one updating it)
+    and the monitors of the running calculations.
+    """
+
+    def __init__(self, margin : float):
+        """
+        margin | float : safety margin over thrGMAX before aborting a calculation [kcal/mol]
+        """
+        self.margin = margin
+        self.lowest = {}
+
+    def update(self, conf, number) -> None:
+        """
+        Lower the minimum of a protocol step with a completed conformer
+
+        conf | Conformer : conformer instance
+        number | int : protocol number
+
+        return None
+        """
+        en = conf.energies.get(str(number))
+        if en and en.get('E') is not None:
+            self.lowest[str(number)] = min(self.lowest.get(str(number), en['E']), en['E'])
+        return None
+
+    @staticmethod
+    def applies(protocol) -> bool:
+        """
+        Whether the running calculations of a protocol step can be tested against the window: only the optimizations
+        ranked on their electronic energy. With the frequencies, the pruning ranks the conformers on G, that is not
+        known until the calculation ends
+
+        protocol | Protocol : protocol instance
+
+        return | bool
+        """
+        return bool(protocol.opt) and not protocol.freq
+
+    def ceiling(self, protocol):
+        """
+        Energy over which a running optimization of the protocol step is aborted.
+        The energy of the optimization can only decrease, while the minimum of the ensemble can only decrease as well.
+
+        protocol | Protocol : protocol instance
+
+        return | float : energy [kcal/mol]; None if no conformer is completed yet, or if the step is not ranked on E
+        """
+        lowest = self.lowest.get(str(protocol.number))
+        if lowest is None or not self.applies(protocol):
+            return None
+        return lowest + protocol.thrGMAX + self.margin
+
+
+
+def kill_calculator(workdir : str) -> bool:
+    """
+    Terminate the processes of the calculator running inside a folder.
+    Processes are found through their working directory in /proc, so it is available only on Linux
+
+    workdir | str : folder of the calculation
+
+    return | bool : some process has been terminated
+    """
+
+    if not os.path.isdir('/proc'):
+        return False
+
+    workdir = os.path.realpath(workdir)
+    killed = False
+    for pid in filter(str.isdigit, os.listdir('/proc')):
+        if int(pid) == os.getpid():
+            continue
+        try:
+            if os.readlink(f'/proc/{pid}/cwd') != workdir:
+                continue
+            os.kill(int(pid), signal.SIGTERM)
+            killed = True
+        except (OSError, ProcessLookupError):
+            continue
+
+    return killed
+
+
+
+class Monitor(threading.Thread):
+    """
+    Follow the output of a running calculation, aborting it when its energy lies over the ceiling of the energy window.
+    Meant for optimizations: the energy of each cycle is an upper bound of the optimized one.
+    """
+
+    def __init__(self, fname : str, workdir : str, ceiling, calculator : str = 'orca', interval : float = None):
+        """
+        fname | str : output filename of the running calculation
+        workdir | str : folder of the calculation
+        ceiling | callable : returns the current ceiling [kcal/mol], or None if not available
+        calculator | str : calculator name
+        interval | float : seconds between two reads of the output
+        """
+        super().__init__(daemon=True)
+        self.fname = fname
+        self.workdir = workdir
+        self.ceiling = ceiling
+        self.regex = re.compile(regex_parsing[calculator]['E'])
+        self.interval = interval or POLL
+        self.aborted = None
+        self.limit = None
+        self.offset = 0
+        self.buffer = ''
+        self.event = threading.Event()
+
+    def energies(self) -> list:
+        """
+        Read the energies printed since the last call
+
+        return | list : energies [kcal/mol]
+        """
+        if not os.path.exists(self.fname):
+            return []
+
+        with open(self.fname, errors='replace') as f:
+            f.seek(self.offset)
+            chunk = f.read()
+            self.offset = f.tell()
+
+        # the last line can still be written
+        lines = (self.buffer + chunk).split('\n')
+        self.buffer = lines.pop()
+
+        en = []
+        for line in lines:
+            if self.regex.search(line):
+                try:
+                    en.append(float(line.split()[-1]) * EH_TO_KCAL)
+                except ValueError:
+                    continue
+        return en
+
+    def run(self) -> None:
+        while not self.event.wait(self.interval):
+            en = self.energies()
+            ceiling = self.ceiling()
+            if not en or ceiling is None:
+                continue
+            if en[-1] > ceiling and kill_calculator(self.workdir):
+                self.aborted, self.limit = en[-1] - ceiling, ceiling
+                return None
+        return None
+
+    def stop(self) -> None:
+        """
+        Stop following the output
+
+        return None
+        """
+        self.event.set()
+        self.join()
+        return None
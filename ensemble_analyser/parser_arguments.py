@@ -24,7 +24,9 @@ def print_help_protocol():
                 "add_input": "str: ADDITIONAL INPUT TO BE PASSED TO THE CALCULATOR. NO SANITY CHECK ON THIS BLOCK! USE WITH CARE. DEFAULT null",
                 'thrG' : "float: ADD SPECIAL THRESHOLD FOR THIS PECULIAR STEP OF THE PROTOL FOR thrG, IF NOT PRESENT, THE DEFAULT ONE WILL BE USED", 
                 "thrB" : "float: ADD SPECIAL THRESHOLD FOR THIS PECULIAR STEP OF THE PROTOL FOR thrB, IF NOT PRESENT, THE DEFAULT ONE WILL BE USED", 
-                "thrGMAX" : "float: ADD SPECIAL THRESHOLD FOR THIS PECULIAR STEP OF THE PROTOL FOR thrGMAX, IF NOT PRESENT, THE DEFAULT ONE WILL BE USED"
+                "thrGMAX" : "float: ADD SPECIAL THRESHOLD FOR THIS PECULIAR STEP OF THE PROTOL FOR thrGMAX, IF NOT PRESENT, THE DEFAULT ONE WILL BE USED",
+                "thrI" : "float: OPTIONAL. GEOMETRIC CRITERION, ON TOP OF thrG AND thrB: TWO CONFORMERS ARE DUPLICATES ONLY IF ALSO THEIR PRINCIPAL MOMENTS OF INERTIA DIFFER LESS THAN THIS FRACTION (e.g. 0.01). IT CAN ONLY KEEP MORE CONFORMERS. DEFAULT: NOT USED",
+                "thrD" : "float: OPTIONAL. GEOMETRIC CRITERION, ON TOP OF thrG AND thrB: TWO CONFORMERS ARE DUPLICATES ONLY IF ALSO THE CUMULATIVE DISTRIBUTIONS OF THEIR INTERATOMIC DISTANCES DIFFER LESS THAN THIS FRACTION OF THE DISTANCES (e.g. 0.05). IT CAN ONLY KEEP MORE CONFORMERS. DEFAULT: NOT USED"
             }
         }, indent=4
     ) 
@@ -65,8 +67,9 @@ def parser_arguments():
 
 
     input_group = parser.add_argument_group('Input Files')
-    input_group.add_argument('-e', '--ensemble' , help='The ensemble file. Could be an xyz file (preferably) or other type parsable by OpenBabel', required=('--restart' not in sys.argv))
+    input_group.add_argument('-e', '--ensemble' , help='The ensemble file. XYZ (preferably), SDF, MOL2 and multi-model PDB files are read directly, other types are converted with OpenBabel', required=('--restart' not in sys.argv))
     input_group.add_argument('--restart', help='Restart the calculation', action='store_true')
+    input_group.add_argument('--dedup-input', help='Remove the duplicates of the input ensemble before any calculation: conformers with heavy-atom RMSD below this threshold [Å] and rotational constants (from the geometries) within 1%. Default: disabled', type=float, default=None)
     input_group.add_argument('-p', '--protocol', help='JSON file contains the computational protocol. Default: %(default)s', default=os.path.join(os.path.dirname(__file__), 'parameters_file','default_protocol.json'))
     input_group.add_argument('-t', '--threshold', help='JSON file contains the threshold divided by calculation type. Default: %(default)s', default=os.path.join(os.path.dirname(__file__), 'parameters_file','default_threshold.json'))
 
@@ -77,10 +80,21 @@ def parser_arguments():
 
     system_group = parser.add_argument_group('System Parameters')
     system_group.add_argument('-cpu', type=int, help='Define the number of CPU used by the calculations', default=1)
-    system_group.add_argument('-calc', '--calculator', help='Define the calculator to use. Default %(default)s', choices=['orca'], default='orca')
+    system_group.add_argument('--workers', type=int, help='Define the number of calculations running simultaneously. The CPU are split across the workers. Default %(default)s', default=1)
+    system_group.add_argument('--executor', help='Define how the calculations are run: in this process (local), as separate processes through a local stand-in of a batch system (fake) or as SLURM job arrays (slurm). Default %(default)s', choices=['local', 'fake', 'slurm'], default='local')
+    system_group.add_argument('--batch-options', help='Additional options passed to the batch system at submission (e.g. "--partition=short --time=2:00:00")', default='')
+    system_group.add_argument('--pipeline', help='Start the following protocol step on the conformers that the pruning cannot deactivate, before the current step ends. Requires more than one worker', action='store_true')
+    system_group.add_argument('--scratch', help='Run each calculation in a private folder inside this (node-local) directory, copying back only the needed outputs. Environment variables are expanded on the node running the calculation (e.g. "$TMPDIR")', default=None)
+    system_group.add_argument('--abort-margin', help='Follow the running optimizations and abort those whose energy lies over thrGMAX plus this margin [kcal/mol] from the lowest conformer already completed. Only the optimizations without frequencies are followed, the others being ranked on G. Linux only. Default: disabled', type=float, default=None)
+    system_group.add_argument('--reuse-guess', help='Keep the converged wavefunction of each conformer and use it as initial guess for its next protocol step (or for the nearest conformer\'s first calculation)', action='store_true')
+    system_group.add_argument('--trace', help='Record the time spent in each stage (calculator setup and run, parsing, thermochemistry, checkpoint, pruning, spectra) per conformer and protocol into this file (.json or .csv)', default=None)
+    system_group.add_argument('--profile', help='Profile the run with cProfile (stats also saved in profile.prof) or tracemalloc, logging the results at the end', choices=['cprofile', 'tracemalloc'], default=None)
+    system_group.add_argument('-calc', '--calculator', help='Define the calculator to use, unless set in the protocol step. The mock calculator writes ORCA-like outputs from a cheap force field, to test the workflow without ORCA (tuned by the MOCK_* environment variables). Default %(default)s', choices=['orca', 'mock'], default='orca')
 
     other_group = parser.add_argument_group('Other Parameters')
     other_group.add_argument('-o', '--output', help='Define the output filename. Default: %(default)s', default='$SLURM_SUBMIT_DIR/output.out')
+    other_group.add_argument('--archive', help='Pack the outputs of each protocol step, once completed, into a single compressed ZIP archive (archive/protocol_N.zip), read in place when needed', action='store_true')
+    other_group.add_argument('--compress-snapshots', help='Compress the snapshots of the ensemble written after each protocol step (ensemble_after_N.xyz.gz, final_ensemble.xyz.gz). zst requires the zstandard package. Default: not compressed', choices=['gz', 'zst'], default=None)
 
 
     help_group = parser.add_argument_group('Get help')
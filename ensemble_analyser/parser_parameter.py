@@ -1,12 +1,29 @@
 
 
-import re, os
+import re, os, io, json
+import functools
+from collections import deque
 import numpy as np
 from ensemble_analyser.regex_parsing import regex_parsing
 from ensemble_analyser.rrho import free_gibbs_energy
+from ensemble_analyser.tracer import TRACER
+from ensemble_analyser.archive import output_exists, open_output
 
 EH_TO_KCAL = 627.5096080305927
 
+# bytes read from the end of an output at first; the window grows until all the fields requested are found
+TAIL = 1 << 20
+# last line printing each parameter, and blocks (from their header) of the last frequencies, geometry and spectra
+LINES = ('E', 'B', 'm')
+BLOCKS = {'freq' : 's_freq', 'geom' : 's_geom', 'spectra' : 'start_spec'}
+
+# property files kept for each protocol step (protocol_N.property.txt, protocol_N.property.json)
+PROPERTY_FILES = ('property.txt', 'property.json')
+# ORCA 6 layout of the property file: &KEY [&Attribute value, ...] value
+PROPERTY_KEY = re.compile(r'&(\w+)\s*(?:\[(.*?)\])?\s*(.*)')
+PROPERTY_ATTR = re.compile(r'&(\w+)\s*("[^"]*"|\([^)]*\)|[^,\s]+)')
+BOHR_TO_ANG = 0.529177210903
+
 def get_param(x, calculator, param):
     """
     Parsing for Rotational Constant
@@ -25,6 +42,416 @@ def get_freq(fl, calc):
     return freq
 
 
+def get_geometry(fl, calc):
+    """
+    Parsing for the last geometry printed (the optimized one at the end of an optimization)
+
+    fl | list : lines of the output file
+    calc | str : calculator name
+
+    return | tuple(np.array, np.array) : atoms and geometry [Å]; (None, None) if no geometry is printed
+    """
+
+    text = ''.join(fl)
+    if regex_parsing[calc]['s_geom'] not in text:
+        return None, None
+
+    block = text.split(regex_parsing[calc]['s_geom'])[-1].strip().splitlines()[1:]
+    block = '\n'.join(block).split(regex_parsing[calc]['e_geom'])[0].strip().splitlines()
+    atoms = np.array([i.split()[0] for i in block])
+    geom = np.array([i.split()[1:4] for i in block], dtype=float)
+    return atoms, geom
+
+
+def read_xyz_geometry(fname):
+    """
+    Read the geometry from an xyz file (the last frame if a trajectory)
+
+    fname | str : xyz filename
+
+    return | tuple(np.array, np.array) : atoms and geometry [Å]; (None, None) if the file is not present
+    """
+
+    if not output_exists(fname):
+        return None, None
+
+    with open_output(fname) as f:
+        fl = f.read().strip().splitlines()
+
+    n = int(fl[0].split()[0])
+    block = fl[-n:]
+    atoms = np.array([i.split()[0] for i in block])
+    geom = np.array([i.split()[1:4] for i in block], dtype=float)
+    return atoms, geom
+
+
+@functools.lru_cache(maxsize=None)
+def _patterns(calc) -> tuple:
+    """
+    Patterns of a calculator, compiled once
+
+    calc | str : calculator name
+
+    return | tuple(re.Pattern, dict) : pattern matching any line of interest, and pattern of each parameter line
+    """
+    parsing = regex_parsing[calc]
+    lines = {i : re.compile(parsing[i]) for i in LINES}
+    trigger = re.compile('|'.join([f'(?:{parsing[i]})' for i in LINES] + [re.escape(parsing[i]) for i in BLOCKS.values()]))
+    return trigger, lines
+
+
+class OutputParser:
+    """
+    Single pass over the lines of an output, keeping the last occurrence of each field: the line of each parameter (E, B, m)
+    and the text, from the header, of the frequencies, geometry and spectra blocks.
+    The blocks are cut a little after their end, so the usual parsing (get_freq, get_geometry, ...) gives the same result
+    as on the whole output.
+    """
+
+    def __init__(self, calc : str):
+        """
+        calc | str : calculator name
+        """
+        self.calc = calc
+        self.trigger, self.patterns = _patterns(calc)
+        self.lines = {}
+        self.blocks = {}
+        self.tail = deque(maxlen=6)
+        # blocks still being read: field -> [parts, index of the current line after the leading blank ones]
+        self.open = {}
+
+    def feed(self, lines):
+        """
+        Parse the lines (e.g. an open file)
+
+        lines | iterable : lines, with their newline
+
+        return | OutputParser : self
+        """
+        parsing = regex_parsing[self.calc]
+        trigger, tail, current = self.trigger.search, self.tail.append, self.open
+
+        for line in lines:
+            tail(line)
+            for field, state in list(current.items()):
+                state[0].append(line)
+                if self._ended(field, state, line):
+                    self.blocks[field] = ''.join(current.pop(field)[0])
+
+            if not trigger(line):
+                continue
+            for field, pattern in self.patterns.items():
+                if pattern.search(line):
+                    self.lines[field] = line
+            for field, key in BLOCKS.items():
+                if parsing[key] in line:
+                    # a later header replaces the block
+                    self.blocks.pop(field, None)
+                    current[field] = [[line[line.rindex(parsing[key]):]], -1 if not line[line.rindex(parsing[key])+len(parsing[key]):].strip() else 0]
+
+        for field, state in current.items():
+            self.blocks[field] = ''.join(state[0])
+        current.clear()
+        return self
+
+    def _ended(self, field : str, state : list, line : str) -> bool:
+        """
+        Whether the block ends with this line
+
+        field | str : block name
+        state | list : parts read and index of the line, counted from the first non blank one (-1 until then)
+        line | str : line just read
+
+        return | bool
+        """
+        if state[1] < 0 and not line.strip():
+            return False
+        state[1] += 1
+
+        parsing = regex_parsing[self.calc]
+        if field == 'freq':
+            # the first four lines (title, scaling factor) are skipped, the table ends with a line of dashes
+            return state[1] >= 4 and parsing['e_freq'] in line
+        if field == 'geom':
+            return state[1] >= 2 and line in ('\n', '')
+        return parsing['end_spec'] in line
+
+    def found(self, fields) -> bool:
+        """
+        Whether all the fields are present
+
+        fields | iterable : names of the fields (E, B, m, freq, geom, spectra)
+
+        return | bool
+        """
+        return all(i in self.lines or i in self.blocks for i in fields)
+
+    def line(self, field : str) -> str:
+        """
+        Last line printing a parameter
+
+        field | str : E, B or m
+
+        return | str : None if not printed
+        """
+        return self.lines.get(field)
+
+    def block(self, field : str) -> str:
+        """
+        Text of the last block, from its header
+
+        field | str : freq, geom or spectra
+
+        return | str : empty if not printed
+        """
+        return self.blocks.get(field, '')
+
+
+def parse_output(fname : str, calc : str, fields = LINES + tuple(BLOCKS)) -> OutputParser:
+    """
+    Parse an output in a single pass. Only the last occurrence of each field matters, so the file is read backwards:
+    the window at its end grows until all the fields requested are found, or the whole file is read.
+    An archived output is parsed streaming the member
+
+    fname | str : output filename
+    calc | str : calculator name
+    fields | iterable : fields needed
+
+    return | OutputParser
+    """
+    if not os.path.exists(fname):
+        with open_output(fname) as f:
+            return OutputParser(calc).feed(f)
+
+    with open(fname, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        window = TAIL
+        while True:
+            start = max(size - window, 0)
+            f.seek(start)
+            data = f.read()
+            if start:
+                # the first line is incomplete
+                data = data[data.find(b'\n')+1:] if b'\n' in data else b''
+            parser = OutputParser(calc).feed(io.TextIOWrapper(io.BytesIO(data)))
+            if not start or parser.found(fields):
+                return parser
+            window *= 8
+
+
+def _normalise(key : str) -> str:
+    """
+    Name of a section or key, lower case and alphanumeric only (e.g. Rotational constants in cm-1 -> rotationalconstantsincm1)
+
+    key | str : name
+
+    return | str
+    """
+    return re.sub(r'[^a-z0-9]', '', str(key).lower())
+
+
+def _value(text : str):
+    """
+    Value of a key: a number, a list of numbers or a string
+
+    text | str : value as printed
+
+    return | float, list or str
+    """
+    try:
+        values = [float(i) for i in text.split()]
+    except ValueError:
+        return text.strip()
+    return values[0] if len(values) == 1 else values
+
+
+def read_property_txt(lines) -> dict:
+    """
+    Sections of a property file in text format: each section starts with "$ Name" and contains either
+    - "key : value" lines and tables (a "key:" line followed by the rows, each starting with its index) (ORCA 5)
+    - "&KEY [&Type "...", &Dim(n,m), &Units "..."] value" lines, the arrays followed by their rows (ORCA 6).
+      The units of a key are stored as "{key}units"
+    The rows of a table printed in blocks of columns are joined by index. A section repeated for a later geometry
+    replaces the previous one
+
+    lines | iterable : lines of the file
+
+    return | dict : section -> {key -> value}, names normalised
+    """
+    sections, current, table, loose = {}, None, None, False
+    for line in lines:
+        text = line.strip()
+        if text.startswith('$'):
+            name = _normalise(text[1:])
+            current = None if name == 'end' else sections.setdefault(name, {})
+            if current is not None:
+                current.clear()
+            table = None
+            continue
+        if current is None or not text or text.startswith(('#', '*')):
+            continue
+
+        tokens = text.split()
+        if table is not None and not text.startswith('&') and (loose or tokens[0].isdigit()):
+            # rows of column indices are headers; the rows of the ORCA 6 coordinates have no index
+            if not tokens[0].isdigit():
+                table.append(tokens)
+            elif not all(i.isdigit() for i in tokens):
+                row = int(tokens[0])
+                if row < len(table):
+                    table[row].extend(tokens[1:])
+                else:
+                    table.append(tokens[1:])
+            continue
+
+        if text.startswith('&'):
+            table = None
+            match = PROPERTY_KEY.match(text)
+            if not match:
+                continue
+            key, attrs, value = _normalise(match[1]), dict(PROPERTY_ATTR.findall(match[2] or '')), match[3]
+            attrs = {_normalise(k) : v.strip('"') for k, v in attrs.items()}
+            if 'units' in attrs:
+                current[f'{key}units'] = attrs['units']
+            if 'dim' in attrs:
+                # the value, if any, is the description of the array
+                table, loose = current.setdefault(key, []), True
+                table.clear()
+            elif value:
+                current[key] = _value(value.strip('"'))
+        elif ':' in text:
+            # a "key: value" line within a table (e.g. its number of rows) does not end it
+            key, _, value = text.partition(':')
+            if value.strip():
+                current[_normalise(key)] = _value(value)
+            else:
+                table, loose = current.setdefault(_normalise(key), []), False
+                table.clear()
+        elif len(tokens) > 1 and not isinstance(_value(tokens[-1]), str):
+            current[_normalise(' '.join(tokens[:-1]))] = _value(tokens[-1])
+
+    return sections
+
+
+def read_property_json(data, name : str = '', sections : dict = None) -> dict:
+    """
+    Sections of a property file in JSON format: each object is a section, containing its non-object members.
+    An object repeated (e.g. for each geometry) updates the section
+
+    data | dict : JSON content
+    name | str : name of the object
+    sections | dict : sections already read
+
+    return | dict : section -> {key -> value}, names normalised
+    """
+    sections = {} if sections is None else sections
+    current = sections.setdefault(_normalise(name), {})
+    for key, value in data.items():
+        children = value if isinstance(value, list) and value and all(isinstance(i, dict) for i in value) else [value]
+        if all(isinstance(i, dict) for i in children):
+            for child in children:
+                read_property_json(child, key, sections)
+        else:
+            current[_normalise(key)] = value
+    return sections
+
+
+def read_properties(base : str, calc : str) -> dict:
+    """
+    Parameters of a calculation from its machine-readable property file, if present.
+    A field is returned only if found with the expected shape (and, for the geometry, with known units)
+
+    base | str : filename without extension (e.g. conf_1/protocol_0)
+    calc | str : calculator name
+
+    return | dict : E [Eh], B (rotational constants [cm-1]), m (dipole moment [a.u.]), freq (frequencies [cm-1]) and
+    geom (atoms and geometry [Å]), as far as found
+    """
+    aliases = regex_parsing[calc].get('properties')
+    if not aliases:
+        return {}
+
+    sections = None
+    for ext in PROPERTY_FILES:
+        fname = f'{base}.{ext}'
+        if output_exists(fname):
+            with open_output(fname, errors='replace') as f:
+                sections = read_property_json(json.load(f)) if ext.endswith('json') else read_property_txt(f)
+            break
+    if not sections:
+        return {}
+
+    fields = {}
+    for field, candidates in aliases.items():
+        for section, key in candidates:
+            found = [(i, v[key]) for i, v in sections.items() if section in (None, i) and key in v]
+            if not found:
+                continue
+            name, value = found[-1]
+            try:
+                fields[field] = _property_field(field, value, sections[name], key)
+            except (ValueError, TypeError, IndexError, KeyError):
+                continue
+            break
+
+    return {k : v for k, v in fields.items() if v is not None}
+
+
+def _property_field(field : str, value, section : dict, key : str = ''):
+    """
+    Convert the value of a field read from the property file
+
+    field | str : E, B, m, freq or geom
+    value : value read
+    section | dict : section of the value (for the units of the geometry)
+    key | str : key of the value, whose units are preferred to those of the section
+
+    return : converted value; None if not usable
+    """
+    if field == 'E':
+        return float(value)
+    if field in ('B', 'm'):
+        value = np.asarray(value, dtype=float).ravel()
+        return value if value.size == 3 else None
+    if field == 'freq':
+        return np.asarray(value, dtype=float).ravel()
+
+    units = section.get(f'{key}units', section.get('units', section.get('coordinateunits', section.get('coordinatesunits', ''))))
+    units = str(units).lower()
+    if units.startswith('ang'):
+        factor = 1.
+    elif units.startswith(('bohr', 'au', 'a.u.')):
+        factor = BOHR_TO_ANG
+    else:
+        return None
+    atoms = np.array([str(i[-4]) for i in value])
+    geom = np.array([i[-3:] for i in value], dtype=float) * factor
+    return atoms, geom
+
+
+def classify_failure(fname, calc) -> str:
+    """
+    Classify the failure of a calculation from its output
+
+    fname | str : output filename
+    calc | str : calculator name
+
+    return | str : fatal (error in the input, a re-run gives the same result), scf (SCF not converged) or transient (any other, e.g. server or I/O error)
+    """
+
+    if not output_exists(fname):
+        return 'transient'
+
+    with open_output(fname, errors='replace') as f:
+        fl = f.read()
+
+    if re.search(regex_parsing[calc]['err_fatal'], fl):
+        return 'fatal'
+    if re.search(regex_parsing[calc]['err_scf'], fl):
+        return 'scf'
+    return 'transient'
+
+
 def get_conf_parameters(conf, number, p, time, temp, log) -> bool:
     """
     Obtain the parameters for a conformer: E, G, B, m
@@ -39,36 +466,54 @@ def get_conf_parameters(conf, number, p, time, temp, log) -> bool:
     return | bool : calculation ended correctly and not crashed due to server error
     """
 
-    with open(os.path.join(conf.folder, f'protocol_{number}.out')) as f:
-        fl = f.readlines() 
+    base = os.path.join(conf.folder, f'protocol_{number}')
+    fields = LINES + (('freq',) if p.freq else ()) + (('geom',) if p.opt else ())
+
+    # values of the property file, if any; the output is parsed only for the fields missing
+    props = read_properties(base, p.calculator)
+    missing = [i for i in fields if i not in props]
+    out = parse_output(f'{base}.out', p.calculator, missing) if missing else None
 
     try: 
-        e = float(list(filter(lambda x: get_param(x, p.calculator, 'E'), fl))[-1].strip().split()[-1])    
+        e = props['E'] if 'E' in props else float(out.line('E').strip().split()[-1])
     except Exception as e:
         log.error(e)
         return False
     
     freq = np.array([])
     if p.freq:
-        freq = get_freq(fl, p.calculator) * p.freq_fact
+        freq = props['freq'] if 'freq' in props else get_freq([out.block('freq')], p.calculator)
+        freq = freq[freq != 0.0] * p.freq_fact
         if freq.size == 0:
-            log.error(('\n'.join(fl[-6:])).strip())
+            out = out or parse_output(f'{base}.out', p.calculator, ())
+            log.error(('\n'.join(out.tail)).strip())
             log.critical(f"{'='*20}\nCRITICAL ERROR\n{'='*20}\nNo frequency present in the calculation output.\n{'='*20}\nExiting\n{'='*20}\n")
             raise IOError('No frequency in the output file')
     
-    B = np.array(list(filter(lambda x: get_param(x, p.calculator, 'B'), fl))[-1].strip().split(':')[-1].split(), dtype=float)
+    if p.opt:
+        atoms, geom = props['geom'] if 'geom' in props else get_geometry([out.block('geom')], p.calculator)
+        if geom is None:
+            atoms, geom = read_xyz_geometry(f'{base}.xyz')
+
+        if geom is None or len(atoms) != len(conf.atoms) or any(i.lower() != j.lower() for i, j in zip(atoms, conf.atoms)):
+            log.warning(f'Optimized geometry of CONF{conf.number} not found in the output: keeping the starting one')
+        else:
+            conf.last_geometry = geom
+
+    B = props['B'] if 'B' in props else np.array(out.line('B').strip().split(':')[-1].split(), dtype=float)
     b = np.linalg.norm(B)
 
-    M = np.linalg.norm(np.array(list(filter(lambda x: get_param(x, p.calculator, 'm'), fl))[-1].strip().split(':')[-1].split(), dtype=float))
+    M = np.linalg.norm(props['m'] if 'm' in props else np.array(out.line('m').strip().split(':')[-1].split(), dtype=float))
 
     g = ''
     if freq.size > 0:
-        g = free_gibbs_energy(
-            SCF = e, T = temp, freq=freq, 
-            mw=conf.weight_mass, 
-            B = B,
-            m=conf.mult
-            )
+        with TRACER.span('rrho', conf, p):
+            g = free_gibbs_energy(
+                SCF = e, T = temp, freq=freq, 
+                mw=conf.weight_mass, 
+                B = B,
+                m=conf.mult
+                )
 
 
     conf.energies[str(number)] = {
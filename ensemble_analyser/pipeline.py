@@ -0,0 +1,190 @@
+from ensemble_analyser.executor import Job
+
+import numpy as np
+import os
+
+
+def protocol_energy(conf, number):
+    """
+    Energy used for the pruning (G if available, else E) of a conformer at a protocol step
+
+    conf | Conformer : conformer instance
+    number | int : protocol number
+
+    return | float : energy [kcal/mol]; None if not calculated
+    """
+    en = conf.energies.get(str(number))
+    if not en:
+        return None
+    return en['G'] if en.get('G') else en['E']
+
+
+def previous_energy(conf, number):
+    """
+    Energy of the last protocol step calculated on the conformer before the given one
+
+    conf | Conformer : conformer instance
+    number | int : protocol number
+
+    return | float : energy [kcal/mol]; None if not calculated
+    """
+    keys = [k for k in conf.energies if int(k) < int(number)]
+    if not keys:
+        return None
+    return protocol_energy(conf, keys[-1])
+
+
+
+class Pipeline:
+    """
+    Speculative execution of the following protocol step on the conformers that the pruning of the current step
+    is not expected to deactivate.
+
+    The energy of the conformers still running is bounded from their energy at the previous step, shifted by the
+    median shift observed on the completed ones and widened by the largest deviation from it. A completed conformer is
+    safe if it lies in the thrGMAX window also against the lowest possible pending energy, and if no completed or
+    pending conformer could lie below it inside thrG (and so be its reference as duplicate).
+
+    Results of the speculative jobs are held back until the following step starts: those whose conformer was
+    deactivated by the pruning meanwhile are cancelled or discarded.
+    """
+
+    MIN_KNOWN = 3
+
+    def __init__(self, executor, log):
+        """
+        executor | Executor : executor running the calculations
+        log : logger instance
+        """
+        self.executor = executor
+        self.log = log
+        self.jobs = {}
+        self.parked = []
+
+    def speculate(self, conformers, current, following) -> None:
+        """
+        Submit the following protocol step for the conformers that became safe
+
+        conformers | list : whole ensemble list
+        current | Protocol : protocol step running
+        following | Protocol : next protocol step
+
+        return None
+        """
+
+        active = [i for i in conformers if i.active]
+        known = [i for i in active if i.energies.get(str(current.number))]
+        pending = [i for i in active if not i.energies.get(str(current.number))]
+        candidates = [i for i in known if i.number not in self.jobs]
+        if not candidates:
+            return None
+
+        if current.graph:
+            # no pruning after a graph calculation
+            safe = candidates
+        else:
+            e_known = np.array([protocol_energy(i, current.number) for i in known])
+            b_known = np.array([i.energies[str(current.number)]['B'] or np.nan for i in known], dtype=float)
+            lo = np.array([])
+
+            if pending:
+                shifts = np.array([protocol_energy(i, current.number) - previous_energy(i, current.number) for i in known if previous_energy(i, current.number) is not None])
+                prev_pending = [previous_energy(i, current.number) for i in pending]
+                if shifts.size < self.MIN_KNOWN or any(i is None for i in prev_pending):
+                    return None
+                shift = np.median(shifts)
+                spread = np.max(np.abs(shifts - shift))
+                pred = np.array(prev_pending) + shift
+                lo, hi = pred - spread, pred + spread
+
+            e_min = min(np.min(e_known), np.min(lo)) if lo.size else np.min(e_known)
+
+            index = {i.number : idx for idx, i in enumerate(known)}
+            safe = []
+            for conf in candidates:
+                idx = index[conf.number]
+                e, b = e_known[idx], b_known[idx]
+                if e - e_min > current.thrGMAX:
+                    continue
+                ref = (e_known <= e) & (e - e_known < current.thrG)
+                ref[idx] = False
+                if np.any(ref & ~(np.abs(b_known - b) >= current.thrB)):
+                    continue
+                if lo.size and np.any((lo <= e) & (hi > e - current.thrG)):
+                    continue
+                safe.append(conf)
+
+        for conf in safe:
+            job = Job(len(self.jobs)+1, conf, following)
+            self.jobs[conf.number] = job
+            self.executor.submit(job)
+
+        if safe:
+            self.log.info(f'Speculatively started protocol {following.number} on CONF{", CONF".join(str(i.number) for i in safe)}')
+
+        return None
+
+    def park(self, job, elapsed) -> None:
+        """
+        Hold back a completed speculative job until its protocol step starts
+
+        job | Job : completed job
+        elapsed | float : elapsed time [sec]
+
+        return None
+        """
+        self.parked.append((job, elapsed))
+        return None
+
+    def reconcile(self, protocol) -> tuple:
+        """
+        At the start of a protocol step, keep the speculative jobs of the conformers still active and
+        cancel or discard the others
+
+        protocol | Protocol : protocol step starting
+
+        return | tuple(list, set) : completed (Job, elapsed) to be parsed, numbers of the conformers with a job still running
+        """
+
+        ready, running = [], set()
+        parked = {job.conf.number for job, _ in self.parked}
+        discarded = 0
+
+        for job, elapsed in self.parked:
+            if job.conf.active:
+                ready.append((job, elapsed))
+            else:
+                Pipeline.discard(job)
+                discarded += 1
+
+        for number, job in self.jobs.items():
+            if number in parked:
+                continue
+            if job.conf.active:
+                running.add(number)
+            else:
+                if not self.executor.cancel(job):
+                    job.discard = True
+                discarded += 1
+
+        if self.jobs:
+            self.log.info(f'Speculative jobs for protocol {protocol.number}: {len(ready)} completed, {len(running)} running, {discarded} discarded\n')
+
+        self.jobs, self.parked = {}, []
+        return ready, running
+
+    @staticmethod
+    def discard(job) -> None:
+        """
+        Remove the outputs of a job that are not going to be used, wavefunction kept as guess included: the following
+        steps must not start from a step the conformer has been pruned from
+
+        job | Job : job to discard
+
+        return None
+        """
+        for ext in ('out', 'hess', 'xyz', 'property.txt', 'property.json', 'gbw'):
+            fname = os.path.join(job.conf.folder, f'protocol_{job.protocol.number}.{ext}')
+            if os.path.exists(fname):
+                os.remove(fname)
+        return None
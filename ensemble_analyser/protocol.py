@@ -2,17 +2,36 @@
 
 import json, os
 import sys
-from ase.calculators.orca import ORCA
+import shutil
+from ase.calculators.orca import ORCA, OrcaProfile
 
 
 DEBUG = os.getenv('DEBUG')
 
+# name of the input written by the ASE calculator of ORCA, and so of all the files of the calculation (orca.out, ...)
+ORCA_LABEL = 'orca'
+
 
 def load_protocol(file:str):
     default = 'ensemble_analyser/parameters_file/default_protocol.json'
     return json.load(open(default if not file else file ))
 
 
+def orca_profile():
+    """
+    Profile running ORCA: the [orca] section of the ASE configuration if present, else the orca executable found in
+    the PATH (with its full path, required by the parallel runs of ORCA)
+
+    return | OrcaProfile : None to use the one of the ASE configuration
+    """
+    if 'orca' in ORCA.cfg.parser:
+        return None
+    command = shutil.which('orca')
+    if not command:
+        raise IOError('ORCA executable not found: add it to the PATH or define the [orca] section of the ASE configuration')
+    return OrcaProfile(command=command)
+
+
 LEVEL_DEFINITION = {
     0 : 'SP'.lower()          , # mere energy calculation
     1 : 'OPT'.lower()         , # optimisation step
@@ -43,7 +62,7 @@ class Solvent:
 
 class Protocol: 
 
-    def __init__(self, number : int , functional:str, basis : str = 'def2-svp', solvent = {}, opt:bool = False, freq:bool = False, add_input:str = '', freq_fact : float = 1, graph : bool = False, calculator='orca', thrG: float = None, thrB: float = None, thrGMAX: float = None):
+    def __init__(self, number : int , functional:str, basis : str = 'def2-svp', solvent = {}, opt:bool = False, freq:bool = False, add_input:str = '', freq_fact : float = 1, graph : bool = False, calculator='orca', thrG: float = None, thrB: float = None, thrGMAX: float = None, thrI: float = None, thrD: float = None):
 
         self.number = number
         self.functional = functional.upper()
@@ -55,6 +74,8 @@ class Protocol:
         self.thrG = thrG
         self.thrB = thrB
         self.thrGMAX = thrGMAX
+        self.thrI = thrI
+        self.thrD = thrD
         self.get_thrs(self.load_threshold())
         self.calculator = calculator
 
@@ -71,7 +92,7 @@ class Protocol:
     
     @property
     def thr(self):
-        return f'\tthrG    : {self.thrG} kcal/mol\n\tthrB    : {self.thrB} cm-1\n\tthrGMAX : {self.thrGMAX} kcal/mol\n'
+        return f'\tthrG    : {self.thrG} kcal/mol\n\tthrB    : {self.thrB} cm-1\n\tthrGMAX : {self.thrGMAX} kcal/mol\n' + (f'\tthrI    : {self.thrI}\n' if self.thrI else '') + (f'\tthrD    : {self.thrD}\n' if self.thrD else '')
     
     @property
     def number_level(self):
@@ -90,20 +111,26 @@ class Protocol:
         default = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'parameters_file','default_threshold.json')
         return json.load(open(default))
 
-    def get_calculator(self, cpu, charge:int, mult:int):
+    def get_calculator(self, cpu, charge:int, mult:int, directory:str = '.', escalate:int = 0, guess:str = None):
         """
         Get the calculator from the user selector
         
         cpu | int : allocated CPU
         charge | int : charge of the molecule
         mult | int : multiplicity of the molecule
+        directory | str : folder where the calculator runs and writes all its files
+        escalate | int : level of the more robust SCF convergence settings (0 for the protocol ones)
+        guess | str : wavefunction file to be read as initial guess, relative to the folder of the calculation
+
+        return | tuple(Calculator, str) : calculator and path of its files without extension (e.g. conf_1/orca)
         """
 
         calc = {
-            'orca' : self.get_orca_calculator(cpu, charge, mult)
+            'orca' : self.get_orca_calculator,
+            'mock' : self.get_mock_calculator,
         }
 
-        return calc[self.calculator]
+        return calc[self.calculator](cpu, charge, mult, directory, escalate, guess)
         
 
     def get_thrs(self, thr_json):
@@ -128,7 +155,7 @@ class Protocol:
             return f'{self.functional}/{self.basis} - {self.solvent}'
         return f'{self.functional}/{self.basis}'    
 
-    def get_orca_calculator(self, cpu:int, charge:int, mult:int):
+    def get_orca_calculator(self, cpu:int, charge:int, mult:int, directory:str = '.', escalate:int = 0, guess:str = None):
         # possibilities for solvent definitions
         if self.solvent:
             if 'xtb' in self.functional.lower():
@@ -141,6 +168,18 @@ class Protocol:
         # ! B3LYP def2-SVP FREQ CPCM(solvent)
         simple_input = f'{self.functional} {self.basis} {"freq" if self.freq else ""} {"opt" if self.opt else ""} {solv} nopop'
 
+        # more robust SCF convergence when re-running after a failure
+        scf = ''
+        if escalate and 'xtb' not in self.functional.lower():
+            simple_input += ' slowconv' if escalate == 1 else ' veryslowconv'
+            if 'maxiter' not in self.add_input.lower():
+                scf = f' %scf maxiter {250 * 2**escalate} end'
+
+        # initial guess from a converged wavefunction
+        moinp = ''
+        if guess and 'xtb' not in self.functional.lower():
+            simple_input += ' moread'
+            moinp = f' %moinp "{guess}"'
 
         # %cpcm
         #     smd True
@@ -149,18 +188,24 @@ class Protocol:
         smd = ''
         if self.solvent and 'xtb' not in self.functional.lower(): smd = self.solvent.orca_input_smd()
 
-        label = 'ORCA'
         calculator = ORCA(
-            label = label,
+            profile = orca_profile(),
+            directory = directory,
             orcasimpleinput = simple_input,
-            orcablocks=f'%pal nprocs {cpu} end ' + smd + self.add_input + (' %maxcore 4000' if 'maxcore' not in self.add_input else ''),
+            orcablocks=f'%pal nprocs {cpu} end ' + smd + self.add_input + scf + moinp + (' %maxcore 4000' if 'maxcore' not in self.add_input else ''),
             charge = charge, 
             mult = mult, 
-            task='energy'
         )
 
-        return calculator, label
+        return calculator, os.path.join(directory, ORCA_LABEL)
     
+    def get_mock_calculator(self, cpu:int, charge:int, mult:int, directory:str = '.', escalate:int = 0, guess:str = None):
+        # imported here: the mock is never needed in production runs
+        from ensemble_analyser.mock_calculator import MockCalculator
+
+        label = os.path.join(directory, ORCA_LABEL)
+        return MockCalculator(self, charge, mult, label), label
+
     @staticmethod
     def load_raw(json):
         
@@ -177,6 +222,8 @@ class Protocol:
             thrB=json['thrB'], 
             thrG=json['thrG'], 
             thrGMAX=json['thrGMAX'],
+            thrI=json.get('thrI'),
+            thrD=json.get('thrD'),
             freq_fact=json['freq_fact'],
             graph=json['graph']
         )
@@ -1,13 +1,27 @@
 
 
-from ase.build import minimize_rotation_and_translation
+from concurrent.futures import ProcessPoolExecutor
+from ase.data import atomic_masses, atomic_numbers
 from scipy.constants import R
+from scipy.spatial import cKDTree
 from tabulate import tabulate
 import numpy as np
+import os
 from ensemble_analyser.ioFile import save_snapshot
 
 
 from ensemble_analyser.logger import DEBUG, ordinal
+from ensemble_analyser.tracer import TRACER
+from ensemble_analyser.conformer import shared_ensemble
+
+
+# pairs aligned at once by rmsd_pairs, and number of pairs over which the chunks are distributed over processes
+RMSD_CHUNK = 4096
+RMSD_PARALLEL = 50000
+
+# width of the bins of the interatomic distances [Å], and conformers fingerprinted at once
+FP_WIDTH = 0.25
+FP_CHUNK = 1024
 
 
 def cut_over_thr_max(confs: list, thrGMAX: float, log) -> list:
@@ -33,30 +47,183 @@ def cut_over_thr_max(confs: list, thrGMAX: float, log) -> list:
     log.info('\n')
 
 
+def kabsch_rmsd(geoms_a, geoms_b) -> np.array:
+    """
+    Root Mean Squared Deviation of pairs of centred geometries, after their optimal superposition
+    (Kabsch algorithm, batched SVD)
+
+    geoms_a | np.array (M, N, 3) : first geometry of each pair, centred
+    geoms_b | np.array (M, N, 3) : second geometry of each pair, centred
+
+    return | np.array (M) : RMSDs
+    """
+    u, sv, vt = np.linalg.svd(np.einsum('mni,mnj->mij', geoms_a, geoms_b))
+    # avoid reflections
+    sv[:, -1] *= np.where(np.linalg.det(u) * np.linalg.det(vt) < 0, -1, 1)
+    msd = (np.sum(geoms_a**2, axis=(1, 2)) + np.sum(geoms_b**2, axis=(1, 2)) - 2*np.sum(sv, axis=1)) / geoms_a.shape[1]
+
+    return np.sqrt(np.clip(msd, 0, None))
+
+
+def centre(geoms) -> np.array:
+    """
+    Move the centroid of each geometry to the origin
+
+    geoms | np.array (M, N, 3) : geometries
+
+    return | np.array (M, N, 3) : centred geometries
+    """
+    geoms = np.asarray(geoms, dtype=float)
+    return geoms - geoms.mean(axis=-2, keepdims=True)
+
+
+def rmsd_pairs(geoms, i, j, processes : int = 1) -> np.array:
+    """
+    RMSD of many pairs of geometries of a stack. Pairs are computed in chunks of RMSD_CHUNK; when there are more
+    than RMSD_PARALLEL pairs, chunks are distributed over processes.
+
+    geoms | np.array (M, N, 3) : geometries
+    i | np.array : index of the first geometry of each pair
+    j | np.array : index of the second geometry of each pair
+    processes | int : number of processes
+
+    return | np.array : RMSDs
+    """
+    geoms = centre(geoms)
+    i, j = np.asarray(i, dtype=int), np.asarray(j, dtype=int)
+    chunks = [(i[k:k+RMSD_CHUNK], j[k:k+RMSD_CHUNK]) for k in range(0, i.size, RMSD_CHUNK)]
+    if not chunks:
+        return np.array([])
+
+    processes = min(processes, os.cpu_count() or 1)
+    if processes > 1 and i.size > RMSD_PARALLEL:
+        with ProcessPoolExecutor(min(processes, len(chunks))) as pool:
+            res = list(pool.map(kabsch_rmsd, [geoms[a] for a, _ in chunks], [geoms[b] for _, b in chunks]))
+    else:
+        res = [kabsch_rmsd(geoms[a], geoms[b]) for a, b in chunks]
+
+    return np.concatenate(res)
+
+
 def rmsd(check, ref) -> float:
     """
     Compute the Root Mean Squared Root of two geometries
 
     RMSD = sqrt(1/N)*||v_i - w_i||
 
-    check | Conformer : conformer to be compared
-    ref | Conformer : reference 
+    check | Atoms : geometry to be compared
+    ref | Atoms : reference 
 
     return | float : RMSD
     """
-    ref_pos, check_pos = ref.copy(), check.copy()
-    minimize_rotation_and_translation(ref_pos, check_pos)
-    return np.sqrt(1/len(ref.get_positions())) * np.linalg.norm(np.array(ref_pos.get_positions())-np.array(check_pos.get_positions()))
+    return float(rmsd_pairs(np.stack([check.get_positions(), ref.get_positions()]), [0], [1])[0])
+
+
+def rmsd_many(ref, geoms) -> np.array:
+    """
+    Root Mean Squared Deviation of one geometry against a stack of geometries
+
+    ref | np.array (N, 3) : reference geometry
+    geoms | np.array (M, N, 3) : geometries to be compared
+
+    return | np.array (M) : RMSDs
+    """
+    geoms = centre(geoms)
+    return kabsch_rmsd(np.broadcast_to(centre(ref), geoms.shape), geoms)
+
+
+def inertia_moments(geoms, atoms) -> np.array:
+    """
+    Principal moments of inertia of each geometry
+
+    geoms | np.array (M, N, 3) : geometries [Å]
+    atoms | list : atomic symbols
+
+    return | np.array (M, 3) : moments, ascending [amu Å²]
+    """
+    geoms = np.asarray(geoms, dtype=float)
+    masses = atomic_masses[[atomic_numbers[i] for i in atoms]]
+    pos = geoms - (np.einsum('n,mni->mi', masses, geoms) / np.sum(masses))[:, None]
+    inertia = np.einsum('n,mni,mni->m', masses, pos, pos)[:, None, None]*np.eye(3) - np.einsum('n,mni,mnj->mij', masses, pos, pos)
+    return np.linalg.eigvalsh(inertia)
+
+
+def rotational_constant(geoms, atoms) -> np.array:
+    """
+    Rotational constant of each geometry, as the norm of the three constants (as read from the outputs)
 
+    geoms | np.array (M, N, 3) : geometries [Å]
+    atoms | list : atomic symbols
 
-def dict_compare(check, conf_ref, deactivate=True):
+    return | np.array (M) : rotational constants [cm-1]
+    """
+    # B = h/(8π²cI) [cm-1], I in amu Å². Linear molecules have a null moment: no constant around that axis
+    moments = inertia_moments(geoms, atoms)
+    return np.linalg.norm(np.where(moments > 1e-6, 16.857629/np.maximum(moments, 1e-6), 0), axis=1)
+
+
+def fingerprints(geoms, atoms) -> np.array:
+    """
+    Rotation and translation invariant fingerprint of each geometry:
+    - principal moments of inertia (the rotational constants of the geometry) [amu Å²]
+    - cumulative distribution of the interatomic distances, on bins of FP_WIDTH up to the largest distance
+
+    geoms | np.array (M, N, 3) : geometries
+    atoms | list : atomic symbols
+
+    return | np.array (M, 3+bins) : fingerprints
+    """
+    geoms = np.asarray(geoms, dtype=float)
+    iu, ju = np.triu_indices(geoms.shape[1], 1)
+
+    moments = inertia_moments(geoms, atoms)
+    dists = np.concatenate([
+        np.linalg.norm(geoms[k:k+FP_CHUNK, iu] - geoms[k:k+FP_CHUNK, ju], axis=-1).astype(np.float32) for k in range(0, len(geoms), FP_CHUNK)
+    ])
+
+    bins = int(np.max(dists, initial=0) // FP_WIDTH) + 1
+    idx = np.minimum(dists // FP_WIDTH, bins-1).astype(np.int64) + (np.arange(len(geoms)) * bins)[:, None]
+    counts = np.bincount(idx.ravel(), minlength=len(geoms)*bins).reshape(len(geoms), bins)
+    cdf = np.cumsum(counts, axis=1) / max(iu.size, 1)
+
+    return np.hstack([moments, cdf]).astype(np.float32)
+
+
+def similar_fingerprints(F, i, j, thrI : float = None, thrD : float = None) -> np.array:
+    """
+    Whether two conformers have the same geometry according to their fingerprints. The two parts of the fingerprint
+    are on different scales, so each one has its own threshold (a part is not compared if its threshold is not set):
+    1. relative difference of the principal moments of inertia < thrI
+    2. largest difference of the cumulative distributions of the interatomic distances < thrD
+
+    F | np.array : fingerprints
+    i | int : first conformer
+    j | int or np.array : second conformer(s)
+    thrI | float : threshold on the moments of inertia (fraction of the larger moment)
+    thrD | float : threshold on the cumulative distributions of the distances (fraction of the distances, 0-1)
+
+    return | bool or np.array
+    """
+    same = np.ones(np.shape(j), dtype=bool)
+    if thrI:
+        mi, mj = F[i, :3], F[j, :3]
+        same &= np.max(np.abs(mi - mj) / np.maximum(np.maximum(mi, mj), 1e-6), axis=-1) < thrI
+    if thrD:
+        same &= np.max(np.abs(F[i, 3:] - F[j, 3:]), axis=-1) < thrD
+    return same
+
+
+def dict_compare(check, conf_ref, deactivate=True, protocol=None, rmsd_value=None):
+    if rmsd_value is None:
+        with TRACER.span('rmsd', protocol=protocol, aggregate=True):
+            rmsd_value = rmsd(check.get_ase_atoms(), conf_ref.get_ase_atoms())
     return {
         'Check': check.number,
         'Ref': conf_ref.number,
         '∆E [kcal/mol]': check.get_energy - conf_ref.get_energy,
         '∆B [e-3 cm-1]': np.abs(check.rotatory - conf_ref.rotatory)*10**3,
         '∆m [Debye]': np.abs(check.moment - conf_ref.moment),
-        'RMSD [Å]': rmsd(check.get_ase_atoms(), conf_ref.get_ase_atoms()),
+        'RMSD [Å]': rmsd_value,
         'Deactivate': deactivate
     }
 
@@ -80,12 +247,12 @@ def check(check, conf_ref, protocol, controller) -> bool:
 
     l = len(controller)
 
-    controller[l] = dict_compare(check, conf_ref, deactivate=False)
+    controller[l] = dict_compare(check, conf_ref, deactivate=False, protocol=protocol)
 
     if (controller[l]['∆E [kcal/mol]'] < protocol.thrG and controller[l]['∆B [e-3 cm-1]']*10**-3 < protocol.thrB):
         check.active = False
         check.diactivated_by = conf_ref.number
-        controller[l] = dict_compare(check, conf_ref)
+        controller[l] = dict_compare(check, conf_ref, protocol=protocol)
         return True
 
     controller.pop(l)
@@ -115,15 +282,96 @@ def refactor_dict(controller):
     return d
 
 
-def check_ensemble(confs, protocol, log) -> list:
+def find_duplicates(E, B, thrG : float, thrB : float, F = None, thrI : float = None, thrD : float = None) -> np.array:
+    """
+    Find, for each conformer, the first previous conformer still active of which it is a duplicate, that is with
+    E_check - E_reference < thrG and |B_check - B_reference| < thrB.
+    Conformers are checked in order, so a duplicate is not a reference for the following ones.
+
+    If the fingerprints are given, the geometric criterion (see similar_fingerprints) is required as well: two
+    conformers with the same energy and rotational constant but different geometries are both kept. The candidates
+    of each conformer are first filtered by fingerprint, all at once, and only the remaining ones go through the E/B
+    checks: since all the criteria are required, the duplicates found do not depend on this order.
+
+    If the energies are sorted, the active conformers are binned on a (E, B) grid of thrG x thrB cells, and each
+    conformer is compared only with those of the neighbouring cells (the thrG window below it). Otherwise every
+    previous conformer is compared.
+
+    E | np.array : energies [kcal/mol]
+    B | np.array : rotational constants [cm-1]
+    thrG | float : energy threshold [kcal/mol]
+    thrB | float : rotational constant threshold [cm-1]
+    F | np.array : fingerprints of the conformers (see fingerprints); None to skip the geometric criterion
+    thrI | float : threshold on the moments of inertia of the fingerprints
+    thrD | float : threshold on the distance distributions of the fingerprints
+
+    return | np.array : index of the reference of each conformer; -1 if not a duplicate
+    """
+
+    n = len(E)
+    ref = np.full(n, -1)
+
+    # same operations of dict_compare and check, so that the outcome is the same up to the last bit
+    def duplicate(i, j):
+        return (E[i] - E[j] < thrG) & (np.abs(B[i] - B[j])*10**3*10**-3 < thrB)
+
+    valid = ~np.isnan(E) & ~np.isnan(B)
+    if n > 1 and np.all(np.diff(E[valid]) >= 0):
+        if thrG <= 0 or thrB <= 0:
+            return ref
+
+        # cells slightly larger than the thresholds: a pair passing the test is always in neighbouring cells
+        ke = np.floor(np.where(valid, E, 0) / (thrG*(1+1e-6))).astype(np.int64).tolist()
+        kb = np.floor(np.where(valid, B, 0) / (thrB*(1+1e-6))).astype(np.int64).tolist()
+        e, b = E.tolist(), B.tolist()
+        cells = {}
+
+        for i in np.flatnonzero(valid).tolist():
+            best = -1
+            if F is not None:
+                # the candidates of a different geometry are rejected at once, before the E/B checks
+                cand = np.array([j for de in (-1, 0) for db in (-1, 0, 1) for j in cells.get((ke[i]+de, kb[i]+db), ())], dtype=int)
+                cand = np.sort(cand[similar_fingerprints(F, i, cand, thrI, thrD)]).tolist()
+                best = next((j for j in cand if e[i] - e[j] < thrG and abs(b[i] - b[j])*10**3*10**-3 < thrB), -1)
+            else:
+                for de in (-1, 0):
+                    for db in (-1, 0, 1):
+                        for j in cells.get((ke[i]+de, kb[i]+db), ()):
+                            if best >= 0 and j > best:
+                                break
+                            if e[i] - e[j] < thrG and abs(b[i] - b[j])*10**3*10**-3 < thrB:
+                                best = j
+                                break
+            if best >= 0:
+                ref[i] = best
+            else:
+                # only the conformers left active can be a reference
+                cells.setdefault((ke[i], kb[i]), []).append(i)
+        return ref
+
+    active = valid.copy()
+    for i in np.flatnonzero(valid)[1:]:
+        cand = np.flatnonzero(active[:i])
+        if F is not None:
+            cand = cand[similar_fingerprints(F, i, cand, thrI, thrD)]
+        hit = cand[duplicate(i, cand)]
+        if hit.size:
+            ref[i] = hit[0]
+            active[i] = False
+
+    return ref
+
+
+def check_ensemble(confs, protocol, log, processes : int = 1) -> list:
     """
     Check the ensemble
     1. Over energy threshold
-    2. Assert if duplicate conformers with energy and B comparison
+    2. Assert if duplicate conformers with energy and B comparison (and geometric fingerprint, if thrI or thrD is set)
 
     confs | list : whole ensemble list
     protocol | Protocol : protocol instance 
     log : logger instance
+    processes | int : number of processes for the RMSD of the duplicates, used only on very large ensembles
 
     return | list : ensemble pruned with conformers deactivated
     """
@@ -138,14 +386,42 @@ def check_ensemble(confs, protocol, log) -> list:
         save_snapshot(
             f'after_protocol_{protocol.number}_before_check.xyz', confs, log)
 
-    controller = {}
+    active = [i for i in confs if i.active]
+    store = shared_ensemble(active)
+    if store is not None:
+        rows = [i.row for i in active]
+        G, E = store.last_values(rows, 'G'), store.last_values(rows, 'E')
+        E = np.where(np.nan_to_num(G) != 0, G, E)
+        B = store.last_values(rows, 'B')
+        geoms = store.geometry[rows]
+    else:
+        last = [i._last_energy for i in active]
+        E = np.array([en['G'] if en['G'] else en['E'] for en in last], dtype=float)
+        B = np.array([en['B'] if en['B'] is not None else np.nan for en in last], dtype=float)
+        geoms = np.array([i.last_geometry for i in active]) if len({np.shape(i.last_geometry) for i in active}) == 1 else None
+
+    # optional geometric criterion, on top of energy and rotational constant
+    F = None
+    thrI, thrD = getattr(protocol, 'thrI', None), getattr(protocol, 'thrD', None)
+    if (thrI or thrD) and active and geoms is not None:
+        with TRACER.span('fingerprint', protocol=protocol):
+            F = fingerprints(geoms, active[0].atoms)
+
+    refs = find_duplicates(E, B, protocol.thrG, protocol.thrB, F, thrI, thrD)
+    idx = np.flatnonzero(refs >= 0)
+
+    # RMSD only of the reported pairs, all at once
+    rmsds = [None] * idx.size
+    if idx.size and geoms is not None:
+        with TRACER.span('rmsd', protocol=protocol, aggregate=True):
+            rmsds = rmsd_pairs(geoms, idx, refs[idx], processes).tolist()
 
-    for idx, i in enumerate(confs):
-        if not i.active:
-            continue  # Not check the non active conformers
-        for j in range(0, idx):
-            if check(i, confs[j], protocol, controller):
-                break
+    controller = {}
+    for i, rmsd_value in zip(idx, rmsds):
+        check, ref = active[i], active[refs[i]]
+        check.active = False
+        check.diactivated_by = ref.number
+        controller[len(controller)] = dict_compare(check, ref, protocol=protocol, rmsd_value=rmsd_value)
 
     controller = refactor_dict(controller)
 
@@ -156,6 +432,70 @@ def check_ensemble(confs, protocol, log) -> list:
     return confs
 
 
+def dedup_ensemble(confs, thrRMSD : float, log, thrB_rel : float = 0.01) -> list:
+    """
+    Deactivate the duplicates of the input ensemble, before any calculation. A conformer is a duplicate of a previous
+    active one if both:
+    1. the RMSD of the heavy atoms is below thrRMSD
+    2. the rotational constants, computed from the (whole) geometries, differ less than thrB_rel of their value.
+       The thrB of the protocol steps is meant for converged geometries, too tight for the raw ones
+
+    confs | list : whole ensemble list
+    thrRMSD | float : heavy-atom RMSD threshold [Å]
+    log : logger instance
+    thrB_rel | float : relative rotational constant threshold
+
+    return | list : ensemble with the duplicates deactivated
+    """
+
+    active = [i for i in confs if i.active]
+    if len({np.shape(i.last_geometry) for i in active}) != 1:
+        log.warning('Conformers of the input ensemble have different number of atoms: duplicates NOT removed')
+        return confs
+
+    atoms = list(active[0].atoms)
+    geoms = np.array([i.last_geometry for i in active], dtype=float)
+    heavy = [a.upper() != 'H' for a in atoms]
+    if sum(heavy) < 3:
+        heavy = [True] * len(atoms)
+    B = rotational_constant(geoms, atoms)
+    heavy_geoms = centre(geoms[:, heavy])
+
+    # the distance of the singular values of two centred geometries is a lower bound of their RMSD (Mirsky):
+    # only the neighbours in this 3D space are aligned
+    sv = np.linalg.svd(heavy_geoms, compute_uv=False) / np.sqrt(heavy_geoms.shape[1])
+    neighbours = cKDTree(sv).query_ball_point(sv, thrRMSD)
+    kept = np.zeros(len(active), dtype=bool)
+
+    controller = {}
+    for i in range(len(active)):
+        cand = np.array(neighbours[i], dtype=int)
+        cand = np.sort(cand[kept[cand] & (np.abs(B[cand] - B[i]) < thrB_rel*B[i])])
+        if cand.size:
+            rmsds = rmsd_many(heavy_geoms[i], heavy_geoms[cand])
+            hit = np.flatnonzero(rmsds < thrRMSD)
+            if hit.size:
+                check, ref = active[i], active[cand[hit[0]]]
+                check.active = False
+                check.diactivated_by = ref.number
+                controller[len(controller)] = {
+                    'Check': check.number,
+                    'Ref': ref.number,
+                    '∆B [e-3 cm-1]': np.abs(B[i] - B[cand[hit[0]]])*10**3,
+                    'RMSD [Å]': rmsds[hit[0]],
+                    'Deactivate': True
+                }
+                continue
+        kept[i] = True
+
+    log.info(f'\nRemoving the duplicates of the input ensemble (heavy-atom RMSD < {thrRMSD} Å and ∆B < {thrB_rel*100:.1f}%)')
+    log.info('')
+    log.info(tabulate(refactor_dict(controller), headers="keys", floatfmt=".3f"))
+    log.info(f'\n{len(controller)} duplicates removed, {int(np.sum(kept))} conformers left\n')
+
+    return confs
+
+
 def calculate_rel_energies(conformers, T) -> None:
     """
     Relative energy
@@ -167,10 +507,22 @@ def calculate_rel_energies(conformers, T) -> None:
     """
 
     c = [i for i in conformers if i.active]
-    ens = np.array([i.get_energy for i in conformers if i.active])
+    store = shared_ensemble(c)
+    if store is not None:
+        rows = [i.row for i in c]
+        G, E = store.last_values(rows, 'G'), store.last_values(rows, 'E')
+        ens = np.where(np.nan_to_num(G) != 0, G, E)
+    else:
+        ens = np.array([i.get_energy for i in c], dtype=float)
     ens -= min(ens)
     bolz = np.exp((-ens*4186)/(R*T))
     pop = (bolz/np.sum(bolz))*100
+
+    if store is not None:
+        store.set_last_values(rows, 'Erel', ens)
+        store.set_last_values(rows, 'Pop', pop)
+        return None
+
     for idx, i in enumerate(list(ens)):
         c[idx]._last_energy['Erel'] = i
         c[idx]._last_energy['Pop'] = pop[idx]
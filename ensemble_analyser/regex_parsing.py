@@ -23,6 +23,24 @@ State  Energy     Wavelength     R         MX        MY        MZ
         'idx_imp_ECD': 3,
         's_freq' : "VIBRATIONAL FREQUENCIES",
         'e_freq' : "------------",
-        'idx_freq' : 1
+        'idx_freq' : 1,
+        's_geom' : 'CARTESIAN COORDINATES (ANGSTROEM)',
+        'e_geom' : '\n\n',
+
+        # machine-readable property file, preferred to the output when present: (section, key) where each field is looked
+        # for, both lower case and alphanumeric only (None: any section). The fields not found are parsed from the output
+        'properties' : {
+            'E' : [(None, 'finalsinglepointenergy'), ('singlepointdata', 'finalenergy')],
+            'B' : [('rotationalspectrum', 'rotationalconstantsincm1')],
+            'm' : [('dipolemoment', 'totaldipolemoment'), ('dipolemoment', 'dipoletotal')],
+            'freq' : [(None, 'vibrationalfrequencies'), ('thermochemistryenergies', 'freq')],
+            'geom' : [('geometry', 'coordinates'), ('geometry', 'cartesiancoordinates'), ('coordinates', 'cartesians')],
+        },
+
+        'err_fatal' : r'INPUT ERROR|UNRECOGNIZED OR DUPLICATED KEYWORD|Unknown identifier|-> impossible',
+        'err_scf' : r'SCF NOT CONVERGED|The SCF is NOT converged|SCF not fully converged',
     }
-}
\ No newline at end of file
+}
+
+# the mock calculator writes its outputs in the ORCA format
+regex_parsing['mock'] = regex_parsing['orca']
@@ -0,0 +1,152 @@
+import heapq
+import datetime
+import numpy as np
+
+from ensemble_analyser.protocol import LEVEL_DEFINITION
+
+
+# Relative cost of a calculation type with respect to a single point
+LEVEL_COST = {
+    'sp'        : 1,
+    'opt'       : 12,
+    'freq'      : 6,
+    'opt+freq'  : 18,
+}
+
+# Relative cost of a basis set family, looked up as substring of the basis name
+BASIS_COST = (
+    ('qzv', 8),
+    ('tzv', 3),
+    ('svp', 1),
+)
+
+# Formal scaling of the cost with the number of atoms
+SEMIEMPIRICAL = ('xtb', 'pm3', 'pm6', 'am1', 'mndo')
+EXPONENT_SEMIEMPIRICAL = 2
+EXPONENT_QM = 3
+
+
+def level_cost(protocol, n_atoms : int) -> float:
+    """
+    Relative cost of a protocol step for a molecule, used to scale timings between different levels of theory
+
+    protocol | Protocol : protocol instance
+    n_atoms | int : number of atoms of the conformer
+
+    return | float : relative cost (arbitrary units)
+    """
+
+    functional = protocol.functional.lower()
+    if any(i in functional for i in SEMIEMPIRICAL):
+        return LEVEL_COST[LEVEL_DEFINITION[protocol.number_level]] * n_atoms**EXPONENT_SEMIEMPIRICAL
+
+    basis = protocol.basis.lower()
+    # composite methods (e.g. B97-3c, r2SCAN-3c) carry their own basis set
+    basis_cost = 1 if functional.endswith('3c') else next((c for k, c in BASIS_COST if k in basis), 1)
+
+    return LEVEL_COST[LEVEL_DEFINITION[protocol.number_level]] * basis_cost * n_atoms**EXPONENT_QM
+
+
+def previous_timing(conf, protocol, protocols : list):
+    """
+    Get the timing of the last protocol executed on the conformer before the current one
+
+    conf | Conformer : conformer instance
+    protocol | Protocol : current protocol
+    protocols | list : whole protocol steps
+
+    return | tuple(float, Protocol) or None : elapsed time [sec] and protocol that produced it
+    """
+
+    for key in reversed(list(conf.energies.keys())):
+        if int(key) >= int(protocol.number):
+            continue
+        t = conf.energies[key].get('time')
+        p_prev = next((i for i in protocols if str(i.number) == str(key)), None)
+        if t and p_prev:
+            return t, p_prev
+
+    return None
+
+
+def predict_runtimes(queue, protocol, protocols : list, ensemble) -> np.array:
+    """
+    Predict the runtime of each calculation in the queue.
+    Each conformer's previous timing is rescaled to the current level of theory; the estimate is calibrated on the
+    conformers already calculated with the current protocol (e.g. after a restart) when available.
+    Conformers without a previous timing get the median of the predictions.
+
+    queue | list : conformers to be calculated
+    protocol | Protocol : current protocol
+    protocols | list : whole protocol steps
+    ensemble | list : whole ensemble list
+
+    return | np.array : predicted runtimes [sec]; NaN if nothing can be predicted
+    """
+
+    def raw_prediction(conf):
+        prev = previous_timing(conf, protocol, protocols)
+        if not prev:
+            return np.nan
+        t, p_prev = prev
+        return t * level_cost(protocol, len(conf.atoms)) / level_cost(p_prev, len(conf.atoms))
+
+    # calibration on the conformers already done for this protocol
+    ratios = []
+    for conf in ensemble:
+        done = conf.energies.get(str(protocol.number))
+        if not done or not done.get('time'):
+            continue
+        pred = raw_prediction(conf)
+        if not np.isnan(pred) and pred > 0:
+            ratios.append(done['time']/pred)
+    scale = np.median(ratios) if ratios else 1
+
+    pred = np.array([raw_prediction(i) for i in queue], dtype=float) * scale
+    if pred.size and not np.all(np.isnan(pred)):
+        pred[np.isnan(pred)] = np.nanmedian(pred)
+
+    return pred
+
+
+def makespan(runtimes, workers : int) -> float:
+    """
+    Simulate the greedy assignment of the jobs (in order) to the first free worker
+
+    runtimes | iterable : runtime of each job [sec]
+    workers | int : number of simultaneous calculations
+
+    return | float : time to complete all the jobs [sec]
+    """
+
+    loads = [0.] * workers
+    for t in runtimes:
+        heapq.heappush(loads, heapq.heappop(loads) + t)
+    return max(loads)
+
+
+def schedule(queue, protocol, protocols : list, ensemble, workers : int, log) -> list:
+    """
+    Order the queue longest-job-first, using the predicted runtimes.
+    Submitting the longest jobs first to a pool of workers is the LPT scheduling, that keeps the tail of a protocol short.
+
+    queue | list : conformers to be calculated
+    protocol | Protocol : current protocol
+    protocols | list : whole protocol steps
+    ensemble | list : whole ensemble list
+    workers | int : number of simultaneous calculations
+    log : logger instance
+
+    return | list : ordered queue
+    """
+
+    pred = predict_runtimes(queue, protocol, protocols, ensemble)
+    if not pred.size or np.all(np.isnan(pred)):
+        log.debug('No previous timings available, running the queue in ensemble order')
+        return queue
+
+    order = np.argsort(-pred, kind='stable')
+    fmt = lambda x: str(datetime.timedelta(seconds=round(x)))
+    log.info(f'Predicted makespan on {workers} workers: {fmt(makespan(pred[order], workers))} (ensemble order: {fmt(makespan(pred, workers))}, serial: {fmt(np.sum(pred))})\n')
+
+    return [queue[i] for i in order]
@@ -0,0 +1,215 @@
+from tabulate import tabulate
+
+from contextlib import contextmanager
+import threading
+import functools
+import json, csv
+import time
+import os
+
+
+FIELDS = ['name', 'conf', 'protocol', 'start', 'duration', 'count', 'pid', 'thread']
+
+# methods of the calculator (or of its template, for the newer ASE calculators) timed separately
+CALCULATOR_STAGES = {
+    'write_input' : 'ase write input',
+    'execute' : 'qm run',
+    'read_results' : 'ase read results',
+}
+
+
+class Tracer:
+    """
+    Timing spans of the stages of the calculation, per conformer and per protocol step.
+    When disabled every span is a no-op, so the instrumentation can stay in the hot paths.
+
+    Spans marked as aggregate (e.g. the RMSD of each pair during the pruning) are summed into a single record.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self.aggregates = {}
+        self.lock = threading.Lock()
+
+    def enable(self) -> None:
+        """
+        Start recording the spans
+
+        return None
+        """
+        self.enabled = True
+        return None
+
+    @contextmanager
+    def span(self, name : str, conf = None, protocol = None, aggregate : bool = False):
+        """
+        Time the enclosed block
+
+        name | str : stage name
+        conf | Conformer : conformer involved, if any
+        protocol | Protocol or int : protocol step involved, if any
+        aggregate | bool : sum the time into a single record per (stage, protocol step)
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start, st = time.time(), time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - st
+            number = str(getattr(protocol, 'number', protocol)) if protocol is not None else None
+            with self.lock:
+                if aggregate:
+                    record = self.aggregates.setdefault((name, number), {
+                        'name' : name, 'conf' : None, 'protocol' : number, 'start' : start, 'duration' : 0., 'count' : 0,
+                        'pid' : os.getpid(), 'thread' : threading.current_thread().name,
+                    })
+                    record['duration'] += duration
+                    record['count'] += 1
+                else:
+                    self.spans.append({
+                        'name' : name,
+                        'conf' : conf.number if conf is not None else None,
+                        'protocol' : number,
+                        'start' : start,
+                        'duration' : duration,
+                        'count' : 1,
+                        'pid' : os.getpid(),
+                        'thread' : threading.current_thread().name,
+                    })
+
+    def instrument(self, calculator, conf, protocol) -> None:
+        """
+        Time the stages of an ASE calculator (input writing, QM code, output reading) by wrapping its methods
+
+        calculator : ASE calculator instance
+        conf | Conformer : conformer calculated
+        protocol | Protocol : protocol step calculated
+
+        return None
+        """
+        if not self.enabled:
+            return None
+
+        for obj in (calculator, getattr(calculator, 'template', None)):
+            for method, name in CALCULATOR_STAGES.items():
+                func = getattr(obj, method, None)
+                if not callable(func):
+                    continue
+
+                @functools.wraps(func)
+                def traced(*args, _func=func, _name=name, **kwargs):
+                    with self.span(_name, conf, protocol):
+                        return _func(*args, **kwargs)
+
+                setattr(obj, method, traced)
+        return None
+
+    def records(self) -> list:
+        """
+        All the recorded spans, aggregates included
+
+        return | list
+        """
+        with self.lock:
+            return self.spans + list(self.aggregates.values())
+
+    def add(self, spans : list) -> None:
+        """
+        Merge the spans recorded in another process (e.g. a batch task)
+
+        spans | list : spans recorded
+
+        return None
+        """
+        if self.enabled and spans:
+            with self.lock:
+                self.spans.extend(spans)
+        return None
+
+    def dump(self, fname : str) -> None:
+        """
+        Write the trace: CSV if the filename ends with .csv, else JSON
+
+        fname | str : trace filename
+
+        return None
+        """
+        records = sorted(self.records(), key=lambda x: x['start'])
+        if fname.endswith('.csv'):
+            with open(fname, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(records)
+        else:
+            with open(fname, 'w') as f:
+                json.dump(records, f, indent=1)
+        return None
+
+    def summary(self, log) -> None:
+        """
+        Log the time spent in each stage, summed over the conformers, for each protocol step
+
+        log : logger instance
+
+        return None
+        """
+        totals = {}
+        for r in self.records():
+            key = (r['protocol'] or '-', r['name'])
+            total = totals.setdefault(key, [0., 0])
+            total[0] += r['duration']
+            total[1] += r['count']
+
+        rows = [[p, name, t, n, t/n*1e3] for (p, name), (t, n) in sorted(totals.items(), key=lambda x: (x[0][0], -x[1][0]))]
+        log.info('Timing of the stages')
+        log.info(tabulate(rows, headers=['Protocol', 'Stage', 'Total [sec]', 'Calls', 'Mean [ms]'], floatfmt='.3f'))
+        log.info('')
+        return None
+
+
+TRACER = Tracer()
+
+
+
+@contextmanager
+def profiled(kind : str, log, fname : str = None):
+    """
+    Profile the enclosed block, logging the hottest functions (cprofile) or the largest allocations (tracemalloc)
+
+    kind | str : cprofile or tracemalloc; None to disable
+    log : logger instance
+    fname | str : file where to store the raw profile (cProfile stats)
+    """
+    if not kind:
+        yield
+        return
+
+    if kind == 'cprofile':
+        import cProfile, pstats, io
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if fname:
+                profiler.dump_stats(fname)
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(30)
+            log.info(stream.getvalue())
+
+    elif kind == 'tracemalloc':
+        import tracemalloc
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            log.info(f'Memory allocated by Python: {current/2**20:.1f} MiB (peak {peak/2**20:.1f} MiB)')
+            log.info('\n'.join(str(i) for i in snapshot.statistics('lineno')[:20]) + '\n')
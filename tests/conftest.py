@@ -0,0 +1,78 @@
+import logging
+import sys
+import os
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ensemble_analyser.conformer import Conformer
+from ensemble_analyser.executor import get_executor
+from ensemble_analyser.launch import start_calculation
+from ensemble_analyser.protocol import Protocol
+
+
+@pytest.fixture
+def log():
+    return logging.getLogger('ensemble_analyser.tests')
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # the calculations write their folders and checkpoints in the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def ethanol():
+    """
+    Factory of the ensembles for the mock calculator: n conformers of ethanol, perturbed from the same geometry
+    """
+    from ase.build import molecule
+    base = molecule('CH3CH2OH')
+
+    def build(n, seed=1):
+        rng = np.random.default_rng(seed)
+        return [Conformer(i+1, base.positions + rng.normal(scale=0.05, size=base.positions.shape), np.array(base.get_chemical_symbols())) for i in range(n)]
+    return build
+
+
+@pytest.fixture
+def steps():
+    """
+    Protocol run with the mock calculator: single point, optimization, optimization and frequencies
+    """
+    return [
+        Protocol(number='0', functional='b97-3c', calculator='mock'),
+        Protocol(number='1', functional='r2scan-3c', opt=True, calculator='mock'),
+        Protocol(number='2', functional='r2scan-3c', opt=True, freq=True, calculator='mock'),
+    ]
+
+
+@pytest.fixture
+def run(log):
+    """
+    Run a protocol on an ensemble in the working directory
+
+    return | callable : (conformers, protocol, executor name, workers, start_from, **options of start_calculation) -> None
+    """
+    def calculate(conformers, protocol, executor='local', workers=1, start_from=0, **kwargs):
+        start_calculation(conformers, protocol, get_executor(executor, 1, workers, log), 298.15, start_from, log, **kwargs)
+    return calculate
+
+
+@pytest.fixture
+def state():
+    """
+    State of an ensemble to be compared between two runs: active flag, values of each protocol step and last geometry
+
+    return | callable : conformers -> dict
+    """
+    def summary(conformers):
+        return {
+            i.number : (i.active, {n : {k : v for k, v in en.items() if k != 'time'} for n, en in i.energies.items()}, i.last_geometry.round(8).tolist())
+            for i in conformers
+        }
+    return summary
@@ -0,0 +1,61 @@
+import os
+import zipfile
+
+import pytest
+
+from ensemble_analyser.archive import archive_path, open_output, output_exists, pack_outputs
+from ensemble_analyser.parser_parameter import get_conf_parameters
+from ensemble_analyser.protocol import Protocol
+
+
+@pytest.fixture
+def spectra(steps):
+    return steps + [Protocol(number='3', functional='cam-b3lyp', add_input='%tddft nroots 10 end', graph=True, calculator='mock')]
+
+
+def test_archive(workdir, log, ethanol, spectra, run):
+    conformers = ethanol(6)
+    run(conformers, spectra, archive=True)
+
+    for p in spectra:
+        calculated = [i for i in conformers if str(p.number) in i.energies]
+        with zipfile.ZipFile(archive_path(p.number)) as zf:
+            assert len([i for i in zf.namelist() if i.endswith('.out')]) == len(calculated)
+
+        for conf in calculated:
+            out = os.path.join(conf.folder, f'protocol_{p.number}.out')
+            assert not os.path.exists(out) and output_exists(out)
+
+            # the outputs parsed back from the archive give the values of the run (the G of a graph step is derived
+            # from the previous steps, not from its output)
+            values = {k : conf.energies[str(p.number)][k] for k in ('E', 'B', 'm') + (('G',) if p.freq else ())}
+            assert get_conf_parameters(conf, p.number, p, 0, 298.15, log)
+            assert {k : conf.energies[str(p.number)][k] for k in values} == values
+
+    # the spectra of the last step are saved next to the archived outputs
+    for conf in conformers:
+        if conf.active:
+            assert os.path.exists(os.path.join(conf.folder, 'uv_protocol_3.dat'))
+
+
+def test_archive_repack(workdir, log, ethanol, steps, run):
+    conformers = ethanol(3)
+    run(conformers, steps[:1])
+    pack_outputs(conformers, steps[0], log)
+    out = os.path.join(conformers[0].folder, 'protocol_0.out')
+    with open_output(out) as f:
+        packed = f.read()
+
+    assert packed.rstrip().endswith('****ORCA TERMINATED NORMALLY****')
+
+    # a repeated calculation is read from its file, left in place when packing again (its member is already archived)
+    with open(out, 'w') as f:
+        f.write('repeated\n')
+    pack_outputs(conformers, steps[0], log)
+    with zipfile.ZipFile(archive_path(0)) as zf:
+        assert len(zf.namelist()) == len(set(zf.namelist()))
+    with open_output(out) as f:
+        assert f.read() == 'repeated\n'
+    os.remove(out)
+    with open_output(out) as f:
+        assert f.read() == packed
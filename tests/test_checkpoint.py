@@ -0,0 +1,47 @@
+import json
+import os
+
+import pytest
+
+import ensemble_analyser.launch as launch
+from ensemble_analyser.IOsystem import SerialiseEncoder
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(monkeypatch, calls):
+    # the run stops as killed while parsing the output of a calculation
+    parse, count = launch.get_conf_parameters, [0]
+
+    def get_conf_parameters(*args, **kwargs):
+        if count[0] == calls:
+            raise Interrupted
+        count[0] += 1
+        return parse(*args, **kwargs)
+    monkeypatch.setattr(launch, 'get_conf_parameters', get_conf_parameters)
+    return parse
+
+
+# 6 conformers: interrupted during the first, second and third step
+@pytest.mark.parametrize('calls', [3, 8, 13])
+def test_restart(workdir, monkeypatch, ethanol, steps, run, state, calls):
+    os.mkdir('reference')
+    monkeypatch.chdir('reference')
+    reference = ethanol(6)
+    run(reference, steps)
+
+    os.mkdir(workdir / 'restart')
+    monkeypatch.chdir(workdir / 'restart')
+    json.dump({i.number : i.__dict__ for i in steps}, open('protocol_dump.json', 'w'), cls=SerialiseEncoder)
+    parse = interrupt_after(monkeypatch, calls)
+    with pytest.raises(Interrupted):
+        run(ethanol(6), steps)
+    monkeypatch.setattr(launch, 'get_conf_parameters', parse)
+
+    conformers, protocol, start_from = launch.restart()
+    assert start_from == calls // 6
+    run(conformers, protocol, start_from=start_from)
+
+    assert state(conformers) == state(reference)
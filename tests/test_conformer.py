@@ -0,0 +1,117 @@
+import json
+
+import numpy as np
+import pytest
+
+from ensemble_analyser.conformer import Conformer, Ensemble, shared_ensemble
+
+
+ENERGIES = {
+    '0' : {'E' : -100.5, 'G' : None, 'B' : 0.25, 'm' : 1.5, 'time' : 3.},
+    '1' : {'E' : -101.5, 'G' : -90.25, 'B' : None, 'm' : 1.25, 'time' : 12.},
+}
+
+
+@pytest.fixture
+def conformers(ethanol):
+    # the same atoms are stored in one ensemble, grown past its initial capacity
+    base = ethanol(1)[0]
+    store = Ensemble(base.atoms)
+    confs = [Conformer(i, base.last_geometry + 0.01*i, base.atoms, raw=True, ensemble=store) for i in range(1, 6)]
+    for i, conf in enumerate(confs):
+        conf.energies = {k : {f : x - i if f in ('E', 'G') and x is not None else x for f, x in v.items()} for k, v in ENERGIES.items()}
+    return confs
+
+
+def test_parameters_as_dict(conformers):
+    # the views behave as the dictionaries they replace: a parameter set to None reads None, one never set is missing
+    conf = conformers[0]
+    assert {k : dict(v) for k, v in conf.energies.items()} == ENERGIES
+    assert list(conf.energies) == ['0', '1']
+
+    params = conf.energies['0']
+    assert params['G'] is None and 'G' in params
+    assert 'Erel' not in params and params.get('Erel', 0.) == 0.
+    with pytest.raises(KeyError):
+        params['Erel']
+    with pytest.raises(KeyError):
+        conf.energies['2']
+
+    params['Erel'] = 0.5
+    assert conf.energies['0']['Erel'] == 0.5
+    params['Erel'] = None
+    assert conf.energies['0']['Erel'] is None
+    del params['Erel']
+    assert 'Erel' not in conf.energies['0']
+
+    # NaN in the columns, None through the views
+    store = conf.ensemble
+    assert np.isnan(store.columns['G'][conf.row, store.index['0']])
+    assert np.all(np.isnan(store.last_values([i.row for i in conformers], 'B')))
+
+
+def test_last_values(conformers):
+    # the last protocol step is the last one calculated; G is used when set, else E
+    conf = conformers[2]
+    assert conf.rotatory is None and conf.moment == 1.25 and conf.get_energy == -90.25 - 2
+    conf.energies['1']['G'] = None
+    assert conf.get_energy == -101.5 - 2
+
+    store = shared_ensemble(conformers)
+    rows = [i.row for i in conformers]
+    store.set_last_values(rows, 'Erel', np.arange(5.))
+    assert [i.energies['1']['Erel'] for i in conformers] == [0., 1., 2., 3., 4.]
+    assert store.last_values(rows, 'E').tolist() == [-101.5 - i for i in range(5)]
+
+    del conf.energies['1']
+    assert conf.get_energy == -100.5 - 2 and list(conf.energies) == ['0']
+
+
+def test_sort(conformers):
+    # energies decreasing with the conformer number
+    assert sorted(conformers) == conformers[::-1]
+
+    # a conformer failed before any energy is sorted as 0
+    conformers[1].active = False
+    conformers[1].energies = {}
+    assert sorted(conformers) == [conformers[i] for i in (4, 3, 2, 0, 1)]
+
+
+def test_raw_round_trip(conformers):
+    conf = conformers[1]
+    conf.active = False
+    conf.diactivated_by = 1
+    conf.metadata = {'title' : 'ethanol'}
+
+    raw = json.loads(json.dumps(conf.dump_raw()))
+    loaded = Conformer.load_raw(raw)
+
+    assert loaded.dump_raw() == conf.dump_raw()
+    assert loaded.energies['0']['G'] is None and loaded.diactivated_by == 1 and not loaded.active
+    assert loaded.last_geometry == pytest.approx(conf.last_geometry)
+    assert loaded.ensemble is not conf.ensemble
+
+    # into an existing ensemble, with the same atoms
+    store = conformers[0].ensemble
+    assert Conformer.load_raw(raw, store).ensemble is store
+
+
+def test_last_geometry_read_only(conformers):
+    conf = conformers[0]
+    geom = conf.last_geometry
+    with pytest.raises(ValueError):
+        geom[0, 0] = 10.
+
+    conf.last_geometry = geom + 1
+    assert conf.last_geometry == pytest.approx(conf._initial_geometry + 1)
+    assert conf.get_ase_atoms().get_positions() == pytest.approx(conf.last_geometry)
+    # the other conformers are untouched
+    assert conformers[1].last_geometry == pytest.approx(conformers[1]._initial_geometry)
+
+
+def test_different_atoms(conformers):
+    # a conformer with different atoms gets its own ensemble: the conformers are not handled at once
+    water = Conformer(10, np.zeros((3, 3)), np.array(['O', 'H', 'H']), raw=True, ensemble=conformers[0].ensemble)
+    assert water.ensemble is not conformers[0].ensemble
+    assert shared_ensemble(conformers) is conformers[0].ensemble
+    assert shared_ensemble(conformers + [water]) is None
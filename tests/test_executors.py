@@ -0,0 +1,21 @@
+import os
+
+import pytest
+
+
+@pytest.mark.parametrize('executor', ['local', 'fake'])
+def test_executors(workdir, monkeypatch, ethanol, steps, run, state, executor):
+    os.mkdir('inline')
+    monkeypatch.chdir('inline')
+    reference = ethanol(4)
+    run(reference, steps)
+
+    os.mkdir(workdir / executor)
+    monkeypatch.chdir(workdir / executor)
+    conformers = ethanol(4)
+    run(conformers, steps, executor=executor, workers=2)
+
+    assert state(conformers) == state(reference)
+    # the batch tasks run in their own processes: each calculation is staged out into its conformer folder
+    for conf in conformers:
+        assert os.path.exists(os.path.join(conf.folder, 'protocol_0.out'))
@@ -0,0 +1,79 @@
+import collections
+import logging
+
+import pytest
+
+import ensemble_analyser.executor as executor
+import ensemble_analyser.launch as launch
+import ensemble_analyser.mock_calculator as mock_calculator
+from ensemble_analyser.parser_parameter import classify_failure
+from ensemble_analyser.protocol import Protocol
+
+
+@pytest.mark.parametrize('text, kind', [
+    ('INPUT ERROR\nUNRECOGNIZED OR DUPLICATED KEYWORD(S) IN SIMPLE INPUT LINE', 'fatal'),
+    ('SCF NOT CONVERGED AFTER 125 CYCLES', 'scf'),
+    ('ORCA finished by error termination in MDCI', 'transient'),
+    (None, 'transient'),
+], ids=['fatal', 'scf', 'transient', 'no output'])
+def test_classify_failure(workdir, text, kind):
+    if text is not None:
+        (workdir / 'orca.out').write_text(text + '\n')
+    assert classify_failure(str(workdir / 'orca.out'), 'orca') == kind
+
+
+@pytest.mark.parametrize('escalate, keyword, maxiter', [(0, None, None), (1, 'slowconv', 500), (2, 'veryslowconv', 1000)])
+def test_escalation_input(monkeypatch, escalate, keyword, maxiter):
+    # the re-runs after a SCF failure use more robust convergence settings, unless the user already set them
+    monkeypatch.setattr('ensemble_analyser.protocol.orca_profile', lambda: None)
+    monkeypatch.setattr('ensemble_analyser.protocol.ORCA.cfg.parser', {'orca' : {'command' : 'orca'}})
+
+    calculator, _ = Protocol(number='1', functional='b97-3c').get_calculator(1, 0, 1, escalate=escalate)
+    simple, blocks = calculator.parameters['orcasimpleinput'].split(), calculator.parameters['orcablocks']
+    assert ('slowconv' in simple, 'veryslowconv' in simple) == (keyword == 'slowconv', keyword == 'veryslowconv')
+    assert (f'%scf maxiter {maxiter} end' in blocks) if maxiter else ('%scf' not in blocks)
+
+    calculator, _ = Protocol(number='1', functional='b97-3c', add_input='%scf maxiter 100 end').get_calculator(1, 0, 1, escalate=escalate)
+    assert calculator.parameters['orcablocks'].count('maxiter') == 1
+
+    calculator, _ = Protocol(number='1', functional='xtb').get_calculator(1, 0, 1, escalate=escalate)
+    assert 'slowconv' not in calculator.parameters['orcasimpleinput'] and '%scf' not in calculator.parameters['orcablocks']
+
+
+def test_retry_then_deactivate(workdir, monkeypatch, ethanol, steps, run, caplog):
+    # the mock fails CONF_2 at every run and CONF_3 only at the first one: CONF_3 is re-run and completed, CONF_2 is
+    # deactivated once the re-runs are exhausted, and the run goes on for the others
+    calls, calculate = collections.defaultdict(list), executor.run_calculator
+
+    def run_calculator(idx, conf, protocol, cpu, log, escalate, *args, **kwargs):
+        calls[conf.number].append(escalate)
+        fail = conf.number == 2 or (conf.number == 3 and len(calls[3]) == 1)
+        monkeypatch.setattr(mock_calculator, 'FAILURE_RATE', 1 if fail else 0)
+        return calculate(idx, conf, protocol, cpu, log, escalate, *args, **kwargs)
+    monkeypatch.setattr(executor, 'run_calculator', run_calculator)
+    monkeypatch.setattr(launch, 'BACKOFF', 0.01)
+
+    conformers = ethanol(4)
+    with caplog.at_level(logging.INFO):
+        run(conformers, steps[:1])
+
+    # SCF failures: every re-run with the next level of convergence settings, up to the most robust one
+    assert calls[2] == [0, 1, 2, 2, 2, 2] and len(calls[2]) == launch.MAX_TRY + 1
+    assert calls[3] == [0, 1]
+    assert calls[1] == calls[4] == [0]
+
+    assert [i.active for i in conformers] == [True, False, True, True]
+    assert all('0' in i.energies for i in conformers if i.active)
+    # delays doubling at each re-run
+    for n, delay in enumerate((0.01, 0.02, 0.04, 0.08, 0.16), 1):
+        assert f'for the {launch.ordinal(n)} time in {delay} sec' in caplog.text
+    assert 'The conformer is deactivated' in caplog.text
+
+
+def test_fatal_failure(workdir, monkeypatch, ethanol, steps, run):
+    # an error in the input would be the same for every conformer: the run stops
+    monkeypatch.setattr(executor, 'classify_failure', lambda *args: 'fatal')
+    monkeypatch.setattr(mock_calculator, 'FAILURE_RATE', 1)
+
+    with pytest.raises(RuntimeError):
+        run(ethanol(2), steps[:1])
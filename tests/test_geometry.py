@@ -0,0 +1,75 @@
+import logging
+import os
+
+import numpy as np
+import pytest
+
+from ensemble_analyser.IOsystem import conf_folder
+from ensemble_analyser.conformer import Conformer
+from ensemble_analyser.parser_parameter import get_conf_parameters
+from ensemble_analyser.protocol import Protocol
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+START = np.array([[0, 0, 0.12], [0, 0.76, -0.47], [0, -0.76, -0.47]])
+# last CARTESIAN COORDINATES (ANGSTROEM) block of water.out
+OPTIMIZED = np.array([[0, 0, 0.117176], [0, 0.757329, -0.468706], [0, -0.757329, -0.468706]])
+
+
+def water(number, geometry_block=True, xyz=None):
+    # optimisation of water: the output, without its geometry blocks if requested, and the xyz written by ORCA
+    folder = conf_folder(number, create=True)
+    with open(os.path.join(DATA, 'water.out')) as f:
+        text = f.read()
+    if not geometry_block:
+        text = text.replace('CARTESIAN COORDINATES (ANGSTROEM)', 'CARTESIAN COORDINATES')
+    with open(os.path.join(folder, 'protocol_0.out'), 'w') as f:
+        f.write(text)
+    if xyz:
+        with open(os.path.join(folder, 'protocol_0.xyz'), 'w') as f:
+            f.write(xyz)
+    return Conformer(number, START.copy(), np.array(['O', 'H', 'H']), raw=True)
+
+
+def xyz(atoms, geom):
+    return f'{len(atoms)}\nCoordinates from ORCA-job orca E -76.328545873210\n' + ''.join(f'{a} {x:.6f} {y:.6f} {z:.6f}\n' for a, (x, y, z) in zip(atoms, geom))
+
+
+@pytest.mark.parametrize('opt', [True, False], ids=['opt', 'sp'])
+def test_carry_forward(workdir, log, opt):
+    # only an optimization replaces the geometry, with the last one printed
+    conf = water(1)
+    assert get_conf_parameters(conf, 0, Protocol(number='0', functional='b97-3c', opt=opt, calculator='orca'), 1., 298.15, log)
+
+    assert conf.last_geometry == pytest.approx(OPTIMIZED if opt else START)
+    assert conf.get_ase_atoms().get_positions() == pytest.approx(OPTIMIZED if opt else START)
+
+
+def test_xyz_fallback(workdir, log):
+    moved = OPTIMIZED + 0.01
+    conf = water(1, geometry_block=False, xyz=xyz(['O', 'H', 'H'], moved))
+    assert get_conf_parameters(conf, 0, Protocol(number='0', functional='b97-3c', opt=True, calculator='orca'), 1., 298.15, log)
+
+    assert conf.last_geometry == pytest.approx(moved)
+
+
+@pytest.mark.parametrize('atoms, block', [(None, False), (['O', 'H'], False), (['H', 'O', 'H'], False)], ids=['no geometry', 'atoms number', 'atoms order'])
+def test_atoms_mismatch(workdir, log, caplog, atoms, block):
+    # a geometry not matching the atoms of the conformer is not used: the starting one is kept
+    conf = water(1, geometry_block=block, xyz=xyz(atoms, OPTIMIZED) if atoms else None)
+    with caplog.at_level(logging.WARNING):
+        assert get_conf_parameters(conf, 0, Protocol(number='0', functional='b97-3c', opt=True, calculator='orca'), 1., 298.15, log)
+
+    assert conf.last_geometry == pytest.approx(START)
+    assert 'keeping the starting one' in caplog.text
+
+
+def test_run_geometry(workdir, ethanol, steps, run):
+    # through a whole run, the geometry of a conformer is the one of its last optimization (printed to 6 decimals)
+    conformers = ethanol(2)
+    run(conformers, steps[:2])
+
+    for conf in conformers:
+        with open(os.path.join(conf.folder, 'protocol_1.out')) as f:
+            block = f.read().split('CARTESIAN COORDINATES (ANGSTROEM)')[-1].split('\n\n')[0].strip().splitlines()[1:]
+        assert conf.last_geometry == pytest.approx(np.array([i.split()[1:4] for i in block], dtype=float), abs=1e-6)
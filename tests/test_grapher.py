@@ -0,0 +1,26 @@
+import os
+
+import numpy as np
+import pytest
+
+from ensemble_analyser.IOsystem import conf_folder
+from ensemble_analyser.grapher import Graph, FACTOR_EV_NM
+from ensemble_analyser.protocol import Protocol
+
+
+def test_save_creates_folders(workdir, log, ethanol):
+    # conformers never calculated: their folders do not exist yet
+    confs = ethanol(3)
+    graph = Graph.__new__(Graph)
+    graph.confs, graph.log = confs, log
+    graph.protocol = Protocol(number='1', functional='cam-b3lyp', graph=True, calculator='mock')
+    graph.x = np.linspace(FACTOR_EV_NM/100, FACTOR_EV_NM/800, 1000)
+    graph.pop = np.full(len(confs), 1/len(confs))
+    impulses = [[(FACTOR_EV_NM/(250 + 10*i), 1.)] for i in range(len(confs))]
+
+    assert not any(os.path.isdir(conf_folder(i.number)) for i in confs)
+    y = graph.calc_graph(impulses=impulses, sigma=1/3, fname='uv_protocol_1.dat', save=True)
+
+    # each conformer's spectrum is saved in its folder, and the ensemble one is their weighted sum
+    spectra = [np.loadtxt(os.path.join(conf_folder(i.number), 'uv_protocol_1.dat'))[:, 1] for i in confs]
+    assert y == pytest.approx(np.sum(spectra, axis=0) / len(confs), abs=1e-6)
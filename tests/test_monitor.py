@@ -0,0 +1,41 @@
+import subprocess
+import sys
+
+import pytest
+
+from ensemble_analyser.monitor import EnergyWindow, Monitor
+from ensemble_analyser.parser_parameter import EH_TO_KCAL
+from ensemble_analyser.protocol import Protocol
+
+
+class Conf:
+    def __init__(self, E, G=None):
+        self.energies = {'1': {'E': E, 'G': G}}
+
+
+@pytest.mark.parametrize('opt, freq, applies', [(True, False, True), (True, True, False), (False, False, False)], ids=['opt', 'opt+freq', 'sp'])
+def test_window_ranking(opt, freq, applies):
+    window = EnergyWindow(2)
+    protocol = Protocol(number='1', functional='b97-3c', opt=opt, freq=freq, thrGMAX=5)
+    for E in (-10, -12, -11):
+        window.update(Conf(E), 1)
+
+    assert window.applies(protocol) is applies
+    assert window.ceiling(protocol) == (-12 + 5 + 2 if applies else None)
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='the calculator processes are found through /proc')
+def test_monitor_abort(tmp_path):
+    proc = subprocess.Popen(['sleep', '60'], cwd=tmp_path)
+    out = tmp_path / 'ORCA.out'
+    out.write_text(''.join(f'FINAL SINGLE POINT ENERGY {e/EH_TO_KCAL:20.12f}\n' for e in (-100, -101)))
+
+    monitor = Monitor(str(out), str(tmp_path), lambda: -103.5, interval=0.05)
+    monitor.start()
+    try:
+        assert proc.wait(timeout=10) != 0
+    finally:
+        proc.kill()
+        monitor.stop()
+    assert monitor.limit == -103.5
+    assert monitor.aborted == pytest.approx(2.5)
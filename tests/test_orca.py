@@ -0,0 +1,99 @@
+import json
+import os
+import sys
+
+import pytest
+
+from ensemble_analyser.executor import Failure, run_calculator
+from ensemble_analyser.protocol import Protocol
+
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# stand-in of the ORCA executable: prints a real output on stdout, writes the wavefunction next to the input and
+# records where it ran and what it found there
+FAKE_ORCA = f'''#!{sys.executable}
+import json, os, sys
+with open(os.environ['FAKE_ORCA_LOG'], 'a') as f:
+    f.write(json.dumps({{'cwd' : os.getcwd(), 'input' : open(sys.argv[1]).read(), 'guess' : os.path.exists('guess.gbw')}}) + '\\n')
+if os.environ.get('FAKE_ORCA_FAIL'):
+    print('SCF NOT CONVERGED')
+    sys.exit(1)
+print(' Number of atoms                             ...      3')
+print(open({os.path.join(DATA, 'water.out')!r}).read())
+open('orca.gbw', 'w').write('wavefunction')
+'''
+
+
+@pytest.fixture
+def orca(workdir, monkeypatch):
+    """
+    Fake ORCA executable in the PATH, used through the ASE calculator of ORCA
+
+    return | callable : () -> list of the runs recorded
+    """
+    bin = workdir / 'bin'
+    bin.mkdir()
+    (bin / 'orca').write_text(FAKE_ORCA)
+    (bin / 'orca').chmod(0o755)
+    monkeypatch.setenv('PATH', f'{bin}{os.pathsep}{os.environ["PATH"]}')
+    monkeypatch.setenv('FAKE_ORCA_LOG', str(workdir / 'runs.jsonl'))
+    monkeypatch.setattr('ensemble_analyser.protocol.ORCA.cfg.parser', {})
+
+    def runs():
+        with open(workdir / 'runs.jsonl') as f:
+            return [json.loads(i) for i in f]
+    return runs
+
+
+@pytest.fixture
+def sp():
+    return Protocol(number='1', functional='b97-3c', calculator='orca')
+
+
+def test_orca_folder(workdir, log, ethanol, orca, sp):
+    # each calculation runs in its conformer folder: nothing is written in the working directory and the outputs
+    # of different conformers do not overwrite each other
+    conformers = ethanol(2)
+    for conf in conformers:
+        assert isinstance(run_calculator(conf.number, conf, sp, 1, log, keep_gbw=True), float)
+
+    assert sorted(os.listdir(workdir)) == ['bin', 'confs', 'runs.jsonl']
+    assert [i['cwd'] for i in orca()] == [os.path.abspath(i.folder) for i in conformers]
+    for conf in conformers:
+        with open(os.path.join(conf.folder, 'protocol_1.out')) as f:
+            assert 'FINAL SINGLE POINT ENERGY' in f.read()
+        assert os.path.exists(os.path.join(conf.folder, 'protocol_1.gbw'))
+        assert not os.path.exists(os.path.join(conf.folder, 'orca.out'))
+
+
+def test_orca_guess(workdir, log, ethanol, orca, sp):
+    # the guess is copied next to the input, where %moinp reads it
+    conf, = ethanol(1)
+    guess = workdir / 'previous.gbw'
+    guess.write_text('wavefunction')
+    run_calculator(1, conf, sp, 1, log, guess=str(guess))
+
+    run, = orca()
+    assert run['guess'] and '%moinp "guess.gbw"' in run['input']
+    assert not os.path.exists(os.path.join(conf.folder, 'guess.gbw'))
+
+
+def test_orca_scratch(workdir, log, ethanol, orca, sp):
+    conf, = ethanol(1)
+    scratch = workdir / 'scratch'
+    run_calculator(1, conf, sp, 1, log, scratch=str(scratch))
+
+    run, = orca()
+    assert os.path.dirname(run['cwd']) == str(scratch)
+    assert os.path.exists(os.path.join(conf.folder, 'protocol_1.out'))
+    assert os.listdir(scratch) == []
+
+
+def test_orca_failure(workdir, log, ethanol, orca, sp, monkeypatch):
+    # ORCA exiting with an error is a failure of the calculation, classified from its output
+    monkeypatch.setenv('FAKE_ORCA_FAIL', '1')
+    conf, = ethanol(1)
+    failure = run_calculator(1, conf, sp, 1, log)
+
+    assert isinstance(failure, Failure) and failure.kind == 'scf'
@@ -0,0 +1,99 @@
+import os
+import re
+
+import numpy as np
+import pytest
+
+import ensemble_analyser.parser_parameter as parser_parameter
+from ensemble_analyser.parser_parameter import get_freq, get_geometry, parse_output
+from ensemble_analyser.regex_parsing import regex_parsing
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+FIELDS = ('E', 'B', 'm', 'freq', 'geom')
+
+
+class Counting(parser_parameter.OutputParser):
+    # size of each window of the output parsed [bytes]
+    windows = []
+
+    def feed(self, lines):
+        lines = list(lines)
+        Counting.windows.append(sum(len(i) for i in lines))
+        return super().feed(lines)
+
+
+@pytest.fixture
+def windows(monkeypatch):
+    Counting.windows = []
+    monkeypatch.setattr(parser_parameter, 'OutputParser', Counting)
+    return Counting.windows
+
+
+def optimization(fname, cycles, normal_modes):
+    """
+    Output of a long optimization with frequencies: the cycles before the final one of water.out, and the normal modes
+    (never parsed) after the frequencies
+
+    return | int : size [bytes]
+    """
+    with open(os.path.join(DATA, 'water.out')) as f:
+        text = f.read()
+    cycle = text[text.index('---------------------------------\nCARTESIAN'):text.index('HURRAY')].rsplit('\n', 2)[0] + '\n'
+    cycles = ''.join(re.sub(r'-76\.3285\d+', f'-76.{i:010d}', cycle.replace('0.117188', f'{i/1e6:.6f}')) for i in range(cycles))
+    modes = ''.join(f'{i:6d}    0.000000    0.000000    0.000000\n' for i in range(normal_modes))
+    text = text.replace('*\n\n---------------------------------\nCARTESIAN', '*\n\n' + cycles + '---------------------------------\nCARTESIAN', 1)
+    text = text.replace('NORMAL MODES\n------------\n', 'NORMAL MODES\n------------\n' + modes)
+    with open(fname, 'w') as f:
+        f.write(text)
+    return os.path.getsize(fname)
+
+
+def previous_parsing(fname):
+    # parsing replaced by the single pass: every line searched for each parameter, blocks split from the whole text
+    with open(fname) as f:
+        fl = f.readlines()
+    lines = {k : [i for i in fl if re.search(regex_parsing['orca'][k], i)][-1] for k in ('E', 'B', 'm')}
+    return lines, get_freq(fl, 'orca'), get_geometry(fl, 'orca')
+
+
+@pytest.mark.parametrize('tail', [64, 1000, 4096, 1 << 20])
+def test_window_growth(workdir, monkeypatch, windows, tail):
+    # whatever the first window, and wherever it cuts a line or a block, the result is the one of the whole file
+    monkeypatch.setattr(parser_parameter, 'TAIL', tail)
+    size = optimization('protocol_0.out', 200, 2000)
+    lines, freq, (atoms, geom) = previous_parsing('protocol_0.out')
+
+    out = parse_output('protocol_0.out', 'orca', FIELDS)
+
+    assert {k : out.line(k) for k in ('E', 'B', 'm')} == lines
+    assert get_freq([out.block('freq')], 'orca') == pytest.approx(freq)
+    assert list(get_geometry([out.block('geom')], 'orca')[0]) == list(atoms)
+    assert np.array_equal(get_geometry([out.block('geom')], 'orca')[1], geom)
+
+    # the window grows eightfold, from the end, until all the fields are found (the frequencies and the geometry
+    # are more than 90 kB from the end)
+    assert all(a < b for a, b in zip(windows, windows[1:]))
+    assert all(w <= tail * 8**i for i, w in enumerate(windows)) and windows[-1] <= size
+    assert (len(windows) > 1) == (tail < 90000)
+
+
+def test_window_final_block(workdir, monkeypatch, windows):
+    # the fields are all in the last part of an optimization: the cycles before are not read
+    monkeypatch.setattr(parser_parameter, 'TAIL', 4096)
+    size = optimization('protocol_0.out', 2000, 0)
+
+    out = parse_output('protocol_0.out', 'orca', FIELDS)
+
+    assert len(windows) == 1 and windows[0] < size / 100
+    assert out.line('E').split()[-1] == '-76.328545873210'
+
+
+def test_missing_field(workdir, monkeypatch, windows):
+    # a field never printed: the whole file is read, and the field is missing
+    monkeypatch.setattr(parser_parameter, 'TAIL', 1024)
+    size = optimization('protocol_0.out', 200, 0)
+
+    out = parse_output('protocol_0.out', 'orca', FIELDS + ('spectra',))
+
+    assert windows[-1] == size
+    assert out.block('spectra') == '' and out.line('E') is not None
@@ -0,0 +1,84 @@
+import collections
+import logging
+import os
+
+import ensemble_analyser.executor as executor
+
+from ensemble_analyser.IOsystem import conf_folder
+from ensemble_analyser.executor import Job
+from ensemble_analyser.pipeline import Pipeline
+
+
+class Executor:
+    # cancels only the jobs not started yet
+    def __init__(self, started):
+        self.started = started
+        self.cancelled = []
+
+    def cancel(self, job):
+        if job.conf.number in self.started:
+            return False
+        self.cancelled.append(job.conf.number)
+        return True
+
+
+def test_pipeline(workdir, monkeypatch, ethanol, steps, run, state, caplog):
+    os.mkdir('sequential')
+    monkeypatch.chdir('sequential')
+    reference = ethanol(12)
+    run(reference, steps, workers=2)
+
+    os.mkdir(workdir / 'pipeline')
+    monkeypatch.chdir(workdir / 'pipeline')
+    conformers = ethanol(12)
+    with caplog.at_level(logging.INFO):
+        run(conformers, steps, workers=2, pipeline=True)
+
+    assert 'Speculatively started' in caplog.text
+    assert state(conformers) == state(reference)
+
+
+def test_pipeline_runs_once(workdir, monkeypatch, ethanol, steps, run, caplog):
+    # each protocol step runs once on a conformer: a speculative job completed is not submitted again
+    calls, calculate = collections.Counter(), executor.run_calculator
+
+    def run_calculator(idx, conf, protocol, *args, **kwargs):
+        calls[conf.number, protocol.number] += 1
+        return calculate(idx, conf, protocol, *args, **kwargs)
+    monkeypatch.setattr(executor, 'run_calculator', run_calculator)
+
+    with caplog.at_level(logging.INFO):
+        run(ethanol(12), steps, workers=2, pipeline=True)
+
+    assert 'Speculatively started' in caplog.text
+    assert calls and max(calls.values()) == 1
+
+
+def test_reconcile(workdir, log, ethanol, steps):
+    conformers = ethanol(6)
+    following = steps[1]
+    pipeline = Pipeline(Executor(started={3, 4}), log)
+    pipeline.jobs = {i.number : Job(i.number, i, following) for i in conformers}
+    for conf in conformers:
+        for ext in ('out', 'gbw'):
+            with open(os.path.join(conf_folder(conf.number, create=True), f'protocol_1.{ext}'), 'w') as f:
+                f.write('output\n')
+
+    # 1, 2 completed; 3, 4 running; 5, 6 queued. The pruning deactivated 2, 4 and 6
+    pipeline.park(pipeline.jobs[1], 1.)
+    pipeline.park(pipeline.jobs[2], 1.)
+    for i in (1, 3, 5):
+        conformers[i].active = False
+    jobs = dict(pipeline.jobs)
+
+    ready, running = pipeline.reconcile(following)
+
+    assert [(job.conf.number, elapsed) for job, elapsed in ready] == [(1, 1.)]
+    assert running == {3, 5}
+    assert pipeline.executor.cancelled == [6]
+    assert jobs[4].discard and not jobs[3].discard
+    # only the output of the completed job discarded is removed; the running one is discarded once completed
+    # the wavefunction kept as guess as well
+    for ext in ('out', 'gbw'):
+        assert [os.path.exists(os.path.join(i.folder, f'protocol_1.{ext}')) for i in conformers] == [True, False, True, True, True, True]
+    assert pipeline.jobs == {} and pipeline.parked == []
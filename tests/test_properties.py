@@ -0,0 +1,75 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from ensemble_analyser.IOsystem import conf_folder
+from ensemble_analyser.conformer import Conformer
+from ensemble_analyser.parser_parameter import get_conf_parameters, get_freq, get_geometry, parse_output, read_properties
+from ensemble_analyser.protocol import Protocol
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# fields each layout provides; the others are parsed from the output
+LAYOUTS = {
+    'orca5': {'B', 'm', 'freq'},
+    'orca6': {'E', 'm', 'freq', 'geom'},
+}
+
+
+def water(number, layout=None):
+    # optimisation and frequencies of water, with the property file of the given ORCA version (None: output only)
+    folder = conf_folder(number, create=True)
+    shutil.copy(os.path.join(DATA, 'water.out'), os.path.join(folder, 'protocol_0.out'))
+    if layout:
+        shutil.copy(os.path.join(DATA, f'water_{layout}.property.txt'), os.path.join(folder, 'protocol_0.property.txt'))
+    geom = np.array([[0, 0, 0.12], [0, 0.76, -0.47], [0, -0.76, -0.47]])
+    return Conformer(number, geom, np.array(['O', 'H', 'H']), raw=True)
+
+
+@pytest.fixture
+def protocol():
+    return Protocol(number='0', functional='b97-3c', opt=True, freq=True, calculator='orca')
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_property_fields(workdir, layout):
+    conf = water(1, layout)
+    base = os.path.join(conf.folder, 'protocol_0')
+    props = read_properties(base, 'orca')
+    out = parse_output(f'{base}.out', 'orca', ('E', 'B', 'm', 'freq', 'geom'))
+
+    assert set(props) == LAYOUTS[layout]
+    if 'E' in props:
+        assert props['E'] == pytest.approx(float(out.line('E').split()[-1]), abs=1e-10)
+    if 'B' in props:
+        assert props['B'] == pytest.approx(np.array(out.line('B').split(':')[-1].split(), dtype=float), abs=1e-6)
+    if 'm' in props:
+        assert props['m'] == pytest.approx(np.array(out.line('m').split(':')[-1].split(), dtype=float), abs=1e-5)
+    if 'freq' in props:
+        freq = props['freq']
+        assert freq[freq != 0] == pytest.approx(get_freq([out.block('freq')], 'orca'), abs=1e-6)
+    if 'geom' in props:
+        atoms, geom = get_geometry([out.block('geom')], 'orca')
+        assert list(props['geom'][0]) == list(atoms)
+        assert props['geom'][1] == pytest.approx(geom, abs=1e-6)
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_property_parity(workdir, log, protocol, layout):
+    text, props = water(1), water(2, layout)
+    assert get_conf_parameters(text, 0, protocol, 9.4, 298.15, log)
+    assert get_conf_parameters(props, 0, protocol, 9.4, 298.15, log)
+
+    for key in ('E', 'G', 'B', 'm'):
+        assert props.energies['0'][key] == pytest.approx(text.energies['0'][key], rel=1e-9), key
+    assert props.last_geometry == pytest.approx(text.last_geometry, abs=1e-6)
+
+
+def test_property_column_blocks(workdir):
+    # tables wider than 6 columns are printed in blocks: the rows are joined by index
+    from ensemble_analyser.parser_parameter import read_property_txt
+    with open(os.path.join(DATA, 'water_orca5.property.txt')) as f:
+        hessian = read_property_txt(f)['hessian']['normalmodes']
+    assert np.array(hessian, dtype=float).shape == (9, 9)
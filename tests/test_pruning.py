@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from ensemble_analyser.pruning import find_duplicates, fingerprints, similar_fingerprints
+
+
+def reference(E, B, thrG, thrB, same=lambda i, j: True):
+    # plain translation of check: every conformer against each previous one still active
+    ref = np.full(len(E), -1)
+    for i in range(1, len(E)):
+        for j in range(i):
+            if ref[j] < 0 and E[i] - E[j] < thrG and abs(B[i] - B[j]) < thrB and same(i, j):
+                ref[i] = j
+                break
+    return ref
+
+
+def ensemble(n, seed):
+    rng = np.random.default_rng(seed)
+    E = np.round(rng.uniform(0, 3, n), 2)
+    B = 1 + np.round(rng.normal(scale=0.01, size=n), 3)
+    geoms = rng.normal(size=(n, 6, 3))
+    return E, B, geoms
+
+
+@pytest.mark.parametrize('sort', [True, False], ids=['sorted', 'unsorted'])
+@pytest.mark.parametrize('seed', range(5))
+def test_find_duplicates(seed, sort):
+    E, B, _ = ensemble(300, seed)
+    if sort:
+        order = np.argsort(E, kind='stable')
+        E, B = E[order], B[order]
+    assert np.array_equal(find_duplicates(E, B, 0.1, 0.01), reference(E, B, 0.1, 0.01))
+
+
+@pytest.mark.parametrize('sort', [True, False], ids=['sorted', 'unsorted'])
+@pytest.mark.parametrize('thrI, thrD', [(0.1, None), (None, 0.1), (0.2, 0.2)])
+def test_fingerprints_only_keep(thrI, thrD, sort):
+    # the fingerprints filter the candidates before the E/B checks: the duplicates are those of all the criteria
+    E, B, geoms = ensemble(300, 7)
+    if sort:
+        order = np.argsort(E, kind='stable')
+        E, B, geoms = E[order], B[order], geoms[order]
+    F = fingerprints(geoms, ['C', 'C', 'O', 'H', 'H', 'H'])
+
+    plain = find_duplicates(E, B, 0.1, 0.01)
+    refs = find_duplicates(E, B, 0.1, 0.01, F, thrI, thrD)
+    idx = np.flatnonzero(refs >= 0)
+
+    assert 0 < idx.size < np.count_nonzero(plain >= 0)
+    assert np.all(similar_fingerprints(F, idx, refs[idx], thrI, thrD))
+    assert np.array_equal(refs, reference(E, B, 0.1, 0.01, lambda i, j: similar_fingerprints(F, i, j, thrI, thrD)))
+
+
+def test_fingerprint_thresholds():
+    rng = np.random.default_rng(0)
+    geom = rng.normal(size=(8, 3))
+    rot = np.linalg.qr(rng.normal(size=(3, 3)))[0]
+    atoms = ['C'] * 8
+    F = fingerprints([geom, geom @ rot.T + 1.5, geom * 1.1], atoms)
+
+    # rotated and translated copy: same fingerprint
+    assert similar_fingerprints(F, 0, 1, 1e-4, 1e-4)
+    # scaled by 10%: moments of inertia 17% apart, each threshold is checked on its own quantity
+    assert not similar_fingerprints(F, 0, 2, 0.15, None)
+    assert similar_fingerprints(F, 0, 2, 0.2, None)
+    assert similar_fingerprints(F, 0, 2, None, None)
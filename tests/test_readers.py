@@ -0,0 +1,172 @@
+import logging
+
+import numpy as np
+import pytest
+
+from ensemble_analyser.ioFile import iter_ensemble, iter_xyz, read_ensemble
+
+
+SDF = '''conf A
+  RDKit          3D
+
+  3  2  0  0  0  0  0  0  0  0999 V2000
+    0.0000    0.0000    0.0000 N   0  0  0  0  0  0  0  0  0  0  0  0
+    1.0000    0.0000    0.0000 H   0  0  0  0  0  0  0  0  0  0  0  0
+    0.0000    1.0000    0.0000 Cl  0  0  0  0  0  0  0  0  0  0  0  0
+  1  2  1  0
+  1  3  1  0
+M  CHG  1   1   1
+M  END
+>  <energy>
+-12.5
+
+$$$$
+conf B
+  RDKit          3D
+
+  3  2  0  0  0  0  0  0  0  0999 V2000
+    0.1000    0.0000    0.0000 N   0  0  0  0  0  0  0  0  0  0  0  0
+    1.0000    0.1000    0.0000 H   0  0  0  0  0  0  0  0  0  0  0  0
+    0.0000    1.0000    0.1000 Cl  0  0  0  0  0  0  0  0  0  0  0  0
+  1  2  1  0
+  1  3  1  0
+M  END
+$$$$
+'''
+
+MOL2 = '''@<TRIPOS>MOLECULE
+{name}
+ 5 4 0 0 0
+SMALL
+{charge_type}
+
+@<TRIPOS>ATOM
+      1 N1          0.0000    0.0000    0.0000 N.4     1  UNL1        {q[0]:.4f}
+      2 H1          1.0300    0.0000    0.0000 H       1  UNL1        {q[1]:.4f}
+      3 H2         -0.3400    0.9700    0.0000 H       1  UNL1        {q[1]:.4f}
+      4 H3         -0.3400   -0.4900    0.8400 H       1  UNL1        {q[1]:.4f}
+      5 H4         -0.3400   -0.4900   -0.8400 H       1  UNL1        {q[1]:.4f}
+@<TRIPOS>BOND
+     1     1     2    1
+     2     1     3    1
+     3     1     4    1
+     4     1     5    1
+'''
+
+PDB = '''MODEL     1
+ATOM      1  N   NH4 A   1       0.000   0.000   0.000  1.00  0.00           N1+
+ATOM      2  H1  NH4 A   1       1.030   0.000   0.000  1.00  0.00           H  
+ATOM      3  H2  NH4 A   1      -0.340   0.970   0.000  1.00  0.00           H  
+ENDMDL
+MODEL     2
+ATOM      1  N   NH4 A   1       0.010   0.000   0.000  1.00  0.00           N  
+ATOM      2  H1  NH4 A   1       1.040   0.000   0.000  1.00  0.00           H  
+ATOM      3  CA  NH4 A   1      -0.330   0.970   0.000  1.00  0.00              
+ENDMDL
+END
+'''
+
+
+def read(path, charge):
+    return list(iter_ensemble(str(path), charge, 1, raw=True, log=logging.getLogger('ensemble_analyser.tests')))
+
+
+def test_sdf(tmp_path, caplog):
+    caplog.set_level(logging.WARNING)
+    path = tmp_path / 'ens.sdf'
+    path.write_text(SDF)
+    confs = read(path, 0)
+
+    assert [list(i.atoms) for i in confs] == [['N', 'H', 'Cl']]*2
+    assert np.allclose(confs[1].last_geometry[0], [0.1, 0, 0])
+    # M  CHG overrides the command line, a molecule without charges keeps it
+    assert [i.charge for i in confs] == [1, 0]
+    assert confs[0].metadata == {'title' : 'conf A', 'energy' : '-12.5'}
+    assert 'CONF_1: charge 1' in caplog.text and 'CONF_2' not in caplog.text
+
+
+@pytest.mark.parametrize('charge_type, q, cli, expected', [
+    # the column of a NO_CHARGES file is only padding
+    ('NO_CHARGES', (0, 0), 1, 1),
+    ('GASTEIGER', (-0.2, 0.3), 0, 1),
+    # all the partial charges zero: nothing to override
+    ('GASTEIGER', (0, 0), 1, 1),
+])
+def test_mol2_charge(tmp_path, caplog, charge_type, q, cli, expected):
+    caplog.set_level(logging.WARNING)
+    path = tmp_path / 'cation.mol2'
+    path.write_text(MOL2.format(name='nh4', charge_type=charge_type, q=q))
+    confs = read(path, cli)
+
+    assert len(confs) == 1 and list(confs[0].atoms) == ['N', 'H', 'H', 'H', 'H']
+    assert confs[0].charge == expected
+    assert ('instead of' in caplog.text) == (expected != cli)
+
+
+def test_mol2_multi(tmp_path):
+    path = tmp_path / 'ens.mol2'
+    path.write_text(MOL2.format(name='a', charge_type='NO_CHARGES', q=(0, 0)) + MOL2.format(name='b', charge_type='NO_CHARGES', q=(0, 0)))
+    confs = read(path, 1)
+    assert [i.metadata['title'] for i in confs] == ['a', 'b']
+    assert [i.charge for i in confs] == [1, 1]
+
+
+def test_pdb(tmp_path, caplog):
+    caplog.set_level(logging.WARNING)
+    path = tmp_path / 'ens.pdb'
+    path.write_text(PDB)
+    confs = read(path, 0)
+
+    # the atom name CA is a carbon, without the element column
+    assert [list(i.atoms) for i in confs] == [['N', 'H', 'H'], ['N', 'H', 'C']]
+    assert [i.charge for i in confs] == [1, 0]
+    assert confs[0].metadata['title'] == 'MODEL 1'
+
+
+def test_read_ensemble_creates_no_folder(workdir, log):
+    (workdir / 'ens.sdf').write_text(SDF)
+    confs = read_ensemble('ens.sdf', 0, 1, log)
+    assert len(confs) == 2
+    assert not (workdir / 'confs').exists()
+
+
+XYZ = '''3
+first
+O 0.0 0.0 0.0
+H 0.0 0.0 0.96
+H 0.93 0.0 -0.24
+3
+
+O 0.1 0.0 0.0 extra
+H 0.0 0.0 0.96 extra
+H 0.93 0.0 -0.24 extra
+2
+H2
+H 0 0 0
+H 0 0 0.74
+'''
+
+
+def test_xyz(tmp_path):
+    path = tmp_path / 'ens.xyz'
+    path.write_text(XYZ)
+    frames = list(iter_xyz(str(path)))
+
+    assert [list(a) for a, _ in frames] == [['O', 'H', 'H'], ['O', 'H', 'H'], ['H', 'H']]
+    assert np.allclose(frames[1][1][0], [0.1, 0, 0])
+    assert np.allclose(frames[2][1][1], [0, 0, 0.74])
+    # the geometries do not refer to the memory map, closed at the end of the reading
+    assert all(g.base is None or g.base.flags.owndata for _, g in frames)
+
+
+@pytest.mark.parametrize('text, message', [
+    (XYZ.replace('H 0 0 0.74', 'H 0 0 1.0D0'), "frame 3, atom 2: invalid coordinate '1.0D0'"),
+    (XYZ.replace('H2\n', 'H2\nH 0 0 0\n').replace('2\nH2', 'x\nH2'), "invalid number of atoms 'x'"),
+    (XYZ + '4\n\nH 0 0 0\n', 'Truncated XYZ frame'),
+], ids=['coordinate', 'atoms', 'truncated'])
+def test_xyz_malformed(tmp_path, text, message):
+    path = tmp_path / 'bad.xyz'
+    path.write_text(text)
+    with pytest.raises((ValueError, IOError)) as error:
+        list(iter_xyz(str(path)))
+    assert str(path) in str(error.value) and message in str(error.value)
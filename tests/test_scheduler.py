@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from ensemble_analyser.scheduler import level_cost, makespan, predict_runtimes, schedule
+
+
+def timed(conformers, number, times):
+    # timings of a protocol step, as stored by the parsing of the outputs
+    for conf, t in zip(conformers, times):
+        if t is not None:
+            conf.energies[number] = {'E': -100., 'G': None, 'B': 1., 'm': 0., 'time': t}
+
+
+def test_longest_first(log, ethanol, steps):
+    conformers = ethanol(5)
+    timed(conformers, '0', [10, 40, 20, 30, None])
+
+    order = schedule(conformers, steps[1], steps, conformers, 2, log)
+
+    # a conformer without a previous timing is predicted as the median of the others
+    assert [i.number for i in order] == [2, 4, 5, 3, 1]
+
+
+def test_calibration(log, ethanol, steps):
+    conformers = ethanol(6)
+    timed(conformers, '0', [10, 40, 20, 30, 10, 10])
+    ratio = level_cost(steps[1], 9) / level_cost(steps[0], 9)
+
+    assert predict_runtimes(conformers[:4], steps[1], steps, conformers) == pytest.approx(np.array([10, 40, 20, 30]) * ratio)
+
+    # the conformers already calculated at the current step (e.g. before a restart) calibrate the prediction; the
+    # timings of the other steps do not
+    timed(conformers[4:5], '1', [3 * 10 * ratio])
+    timed(conformers[5:], '2', [100 * 10 * ratio])
+    assert predict_runtimes(conformers[:4], steps[1], steps, conformers) == pytest.approx(np.array([10, 40, 20, 30]) * ratio * 3)
+
+
+def test_no_timings(log, ethanol, steps):
+    conformers = ethanol(3)
+    assert schedule(conformers, steps[1], steps, conformers, 2, log) == conformers
+
+
+def test_makespan():
+    assert makespan([1, 1, 4], 2) == 5
+    assert makespan([4, 1, 1], 2) == 4
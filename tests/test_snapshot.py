@@ -0,0 +1,79 @@
+import gzip
+import importlib.util
+
+import pytest
+
+import ensemble_analyser.ioFile as ioFile
+from ensemble_analyser.ioFile import read_ensemble, save_snapshot
+
+
+def previous_writer(output, confs):
+    # writer replaced by the streaming one: the whole ensemble joined in a string, one line per atom
+    def write_xyz(conf):
+        if not conf.active: return ''
+        en = conf._last_energy
+        txt = f'{len(conf.atoms)}\nCONFORMER {conf.number} {"G : {:.6f} kcal/mol".format(en["G"]) if en["G"] else "E : {:.6f} kcal/mol".format(en["E"])}\n'
+        for a, pos in zip(conf.atoms, conf.last_geometry):
+            x, y, z = pos
+            txt += f' {a}\t{x:14f}\t{y:14f}\t{z:14f}\n'
+        return txt.strip()
+
+    with open(output, 'w') as f:
+        f.write('\n'.join([f'{write_xyz(i).strip()}' for i in confs]).strip())
+
+
+@pytest.fixture
+def ensemble(ethanol):
+    # inactive conformers at the beginning, in the middle and at the end; energies with and without G
+    confs = ethanol(8)
+    for i, conf in enumerate(confs):
+        conf.energies = {'0' : {'E' : -100.123456789 - i, 'G' : -90.5 - i if i % 2 else None, 'B' : 1., 'm' : 1., 'time' : 1.}}
+    for i in (0, 3, 4, 7):
+        confs[i].active = False
+    return confs
+
+
+@pytest.mark.parametrize('inactive', [(0, 3, 4, 7), (), (1, 2, 3, 4, 5, 6)], ids=['mixed', 'all active', 'one active'])
+def test_byte_identical(workdir, log, ensemble, inactive):
+    for i, conf in enumerate(ensemble):
+        conf.active = i not in inactive
+    previous_writer('previous.xyz', ensemble)
+
+    assert save_snapshot('snapshot.xyz', ensemble, log) == 'snapshot.xyz'
+    assert (workdir / 'snapshot.xyz').read_bytes() == (workdir / 'previous.xyz').read_bytes()
+
+
+def test_gzip(workdir, log, ensemble):
+    save_snapshot('snapshot.xyz', ensemble, log)
+    assert save_snapshot('snapshot.xyz', ensemble, log, 'gz') == 'snapshot.xyz.gz'
+
+    with gzip.open('snapshot.xyz.gz', 'rb') as f:
+        assert f.read() == (workdir / 'snapshot.xyz').read_bytes()
+
+    # read back as an input ensemble
+    confs = read_ensemble('snapshot.xyz.gz', 0, 1, log)
+    active = [i for i in ensemble if i.active]
+    assert [i.last_geometry.round(6).tolist() for i in confs] == [i.last_geometry.round(6).tolist() for i in active]
+
+
+def test_default_compression(workdir, log, ensemble, monkeypatch):
+    # the compression of the command line applies to every snapshot
+    monkeypatch.setattr(ioFile, 'SNAPSHOT_COMPRESSION', 'gz')
+    assert save_snapshot('snapshot.xyz', ensemble, log) == 'snapshot.xyz.gz'
+    assert not (workdir / 'snapshot.xyz').exists()
+
+
+@pytest.mark.skipif(importlib.util.find_spec('zstandard') is None, reason='zstandard not installed')
+def test_zstandard(workdir, log, ensemble):
+    import zstandard
+    save_snapshot('snapshot.xyz', ensemble, log)
+    assert save_snapshot('snapshot.xyz', ensemble, log, 'zst') == 'snapshot.xyz.zst'
+
+    with zstandard.open('snapshot.xyz.zst', 'rb') as f:
+        assert f.read() == (workdir / 'snapshot.xyz').read_bytes()
+
+
+@pytest.mark.skipif(importlib.util.find_spec('zstandard') is not None, reason='zstandard installed')
+def test_zstandard_missing(workdir, log, ensemble):
+    with pytest.raises(IOError, match='pip install zstandard'):
+        save_snapshot('snapshot.xyz', ensemble, log, 'zst')